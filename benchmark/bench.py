@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+"""
+Benchmarks of the pipeline stages on synthetic data.
+
+    python bench.py                        sizes 1e4 1e5 1e6, compared to baseline.json
+    python bench.py --sizes 1e6 1e7 --save baseline.json
+
+Every stage is timed (best of --repeat) and run once more under tracemalloc
+for its peak memory. The report has the throughput per size, the scaling
+exponent of the run time in the number of rows (1 = linear) and, when a
+baseline exists, the ratio to its run time. Ratios above --tolerance are
+regressions and make the exit code 1.
+"""
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+sys.path.append("..")
+import numpy as np
+import pandas as pd
+from financialml.ch1.loader import load_bars
+from financialml.ch1.bars import mad_outlier, get_tick_bars_idx, volume_bars_idx, dollar_bars_idx, get_ohlc, \
+    get_ohlcv
+from financialml.ch1.builder import BarBuilder
+from financialml.ch1.infobars import get_imbalance_bars
+from financialml.ch2.cusumfilter import get_daily_vol, cusum_filter_close
+from financialml.ch3.triplebarrier import get_events, get_t1
+from financialml.ch3.bins import get_bins
+from financialml.utils.synthetic import TickGenerator, minute_close
+
+BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+
+
+def tick_stages(path):
+    # (name, function) over a tick file, each function takes the output of load_bars
+    def ohlc(df):
+        return get_ohlc(df, df.iloc[get_tick_bars_idx(df, 'price', 100)])
+
+    return [
+        ('load_bars', lambda df: load_bars(path)),
+        ('mad_outlier', lambda df: mad_outlier(df.price.values.reshape(-1, 1))),
+        ('tick_bars', lambda df: get_tick_bars_idx(df, 'price', 100)),
+        ('volume_bars', lambda df: volume_bars_idx(df, 'v', 100000)),
+        ('dollar_bars', lambda df: dollar_bars_idx(df, 'dv', 5000000)),
+        ('imbalance_bars', lambda df: get_imbalance_bars(df, 'tick', 100, min_ticks=10)),
+        ('bar_builder', lambda df: BarBuilder('dollar', 5000000).update_batch(df)),
+        ('get_ohlc', ohlc),
+        ('get_ohlcv', lambda df: get_ohlcv(df, get_tick_bars_idx(df, 'price', 100))),
+    ]
+
+
+def close_stages(close):
+    # (name, function) over a close series, run in order on shared intermediate results
+    state = {}
+
+    def daily_vol(close):
+        state['vol'] = get_daily_vol(close, span=100)
+
+    def cusum(close):
+        state['tEvents'] = cusum_filter_close(close, state['vol'])
+
+    def events(close):
+        t1 = get_t1(close, state['tEvents'], numDays=1)
+        state['events'] = get_events(close, state['tEvents'], [1, 1], state['vol'], t1=t1)
+
+    def bins(close):
+        get_bins(state['events'], close)
+
+    return [('get_daily_vol', daily_vol), ('cusum_filter_close', cusum), ('get_events', events), ('get_bins', bins)]
+
+
+def measure(func, arg, repeat):
+    """ :return: (best run time in seconds, peak traced memory in MB) """
+    seconds = np.inf
+    for _ in range(repeat):
+        time0 = time.perf_counter()
+        func(arg)
+        seconds = min(seconds, time.perf_counter() - time0)
+    tracemalloc.start()
+    func(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / (1 << 20)
+
+
+def run(sizes, repeat=3, seed=0):
+    """
+    :param sizes: numbers of ticks (and of close bars)
+    :return: pd.DataFrame stage, rows, seconds, throughput (rows per second), memory (MB)
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as root:
+        for n in sizes:
+            path = Path(root) / f"ticks-{n}.txt"
+            TickGenerator(n, seed=seed).write(path)
+            df = load_bars(path)
+            for name, func in tick_stages(path):
+                rows.append((name, n) + measure(func, df, repeat))
+            close = minute_close(n, seed=seed)
+            for name, func in close_stages(close):
+                rows.append((name, n) + measure(func, close, repeat))
+            path.unlink()
+    out = pd.DataFrame(rows, columns=['stage', 'rows', 'seconds', 'memory'])
+    out['throughput'] = out['rows'] / out['seconds']
+    return out
+
+
+def scaling(results):
+    """ :return: pd.Series per stage, slope of log(seconds) over log(rows) """
+    def slope(df):
+        if df.shape[0] < 2:
+            return np.nan
+        return np.polyfit(np.log(df['rows']), np.log(df['seconds']), 1)[0]
+    return pd.Series({stage: slope(df) for stage, df in results.groupby('stage', sort=False)}, name='scaling')
+
+
+def compare(results, baseline, tolerance=1.5, minSeconds=1e-3):
+    """ :return: results with the run time ratio to the baseline and a regression flag """
+    base = baseline.set_index(['stage', 'rows'])['seconds'].rename('baseline')
+    out = results.join(base, on=['stage', 'rows'])
+    out['ratio'] = out['seconds'] / out['baseline']
+    out['regression'] = (out['ratio'] > tolerance) & (out['baseline'] >= minSeconds)
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1e4, 1e5, 1e6])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--save', type=Path, default=None, help='write the results as a new baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    parser.add_argument('--min-seconds', type=float, default=1e-3)
+    args = parser.parse_args(argv)
+
+    sizes = [int(n) for n in args.sizes]
+    # compile the numba kernels before timing
+    run([min(sizes)], repeat=1, seed=args.seed)
+    results = run(sizes, args.repeat, args.seed)
+
+    pd.set_option('display.width', 160)
+    print(results.pivot(index='stage', columns='rows', values='throughput').loc[results.stage.unique()]
+          .join(scaling(results)).to_string(float_format='{:.3g}'.format))
+    print(results.pivot(index='stage', columns='rows', values='memory').loc[results.stage.unique()]
+          .to_string(float_format='{:.1f}'.format))
+
+    status = 0
+    if args.baseline.exists() and args.save != args.baseline:
+        out = compare(results, pd.read_json(args.baseline), args.tolerance, args.min_seconds)
+        print(out[['stage', 'rows', 'seconds', 'baseline', 'ratio']].to_string(index=False, float_format='{:.3g}'.format))
+        regressions = out[out['regression']]
+        if regressions.shape[0] > 0:
+            print(f"{regressions.shape[0]} regressions over {args.tolerance}x the baseline")
+            status = 1
+    if args.save is not None:
+        results.to_json(args.save, orient='records', indent=1)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
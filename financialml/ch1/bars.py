@@ -3,19 +3,12 @@
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
-
-def load_bars(path):
-    cols = list(map(str.lower, ['Date', 'Time', 'Price', 'Bid', 'Ask', 'Size']))
-    df = (pd.read_csv(path, header=None)
-            .rename(columns=dict(zip(range(len(cols)), cols)))
-            .assign(dates=lambda df: (pd.to_datetime(df['date'] + df['time'], format='%m/%d/%Y%H:%M:%S')))
-            .assign(v=lambda df: df['size'])  # volume
-            .assign(dv=lambda df: df['price'] * df['size'])  # dollar volume
-            .drop(['date', 'time'], axis=1)
-            .set_index('dates')
-            .drop_duplicates())
-    return df
+from financialml.ch1.loader import load_bars
+from financialml.ch1.sampling import sample_bars_idx
+from financialml.ch1.tickstore import TickStore
+from financialml.ch1.builder import OHLCV
+from financialml.ch1.ticks import TickFrame, BarView, take_bars
+from financialml.utils.metrics import instrument
 
 def mad_outlier(y, threshold=3.):
     """
@@ -36,33 +29,36 @@ def mad_outlier(y, threshold=3.):
     return modified_z_score > threshold
 
 """ Tick Bars """
-def get_tick_bars_idx(df, price_col, m):
+def get_tick_bars_idx(df, price_col, m, progress=False):
     """ :param df: pd.DataFrame
         :param price_col:
         :param m: ticks threshold
-        :return: indices """
-    t = df[price_col]
-    ts = 0
-    idx = []
-    for i, x in enumerate(tqdm(t)):
-        ts += 1
-        if ts >= m:
-            idx.append(i)
-            ts = 0
-    return idx
+        :param progress: show a progress bar
+        :return: np.ndarray of indices """
+    return sample_bars_idx(df[price_col], m, 'tick', progress=progress)
 
 def get_tick_bars(df, price_col, m):
     """
-    :param df: bid-ask data with price
+    :param df: bid-ask data with price, pd.DataFrame or TickFrame
     :param price_col:
     :param m: tick size threshold
-    :return:
+    :return: pd.DataFrame, BarView for a TickFrame
     """
     idx = get_tick_bars_idx(df, price_col, m)
-    return df.iloc[idx].drop_duplicates()
+    return take_bars(df, idx)
 
 def get_sample_data(ref, sub, price_col, date):
-    xdf = ref[price_col].loc[date]
+    """
+    :param ref: tick data, pd.DataFrame or TickStore (only the day is read)
+    :param sub: bars
+    :param price_col:
+    :param date: day to sample
+    :return: ticks and bars of the day
+    """
+    if isinstance(ref, TickStore):
+        xdf = ref.read_day(date, columns=[price_col])[price_col]
+    else:
+        xdf = ref[price_col].loc[date]
     xtdf = sub[price_col].loc[date]
     return xdf, xtdf
 
@@ -80,74 +76,124 @@ def plot_sample_data(ref, sub, bar_type, *args, **kwds):
     for ax in axes[1:]: ax.legend()
     plt.tight_layout()
 
-def get_ohlc(ref, sub):
+def get_ohlc(ref, sub, price_col='price'):
     """
-    :param ref:
-    :param sub:
-    :return:
+    OHLC between consecutive bar timestamps, both ends inclusive.
+    High/low of every [start, end] window come from one reduceat over the
+    positional ranges of the windows in ref.
+    :param ref: tick prices, pd.Series (or pd.DataFrame/TickFrame holding price_col)
+    :param sub: bar prices, pd.Series (or pd.DataFrame/BarView holding price_col)
+    :param price_col: price column used when ref/sub are DataFrames
+    :return: pd.DataFrame end, start, open, high, low, close
     """
-    ohlc = []
-    for i in tqdm(range(sub.index.shape[0]-1)):
-        start, end = sub.index[i], sub.index[i+1]
-        tmp_ref = ref.loc[start:end]
-        max_px, min_px = tmp_ref.max(), tmp_ref.min()
-        o, h, l, c = sub.iloc[i], max_px, min_px, sub.iloc[i+1]
-        ohlc.append((end, start, o, h, l, c))
+    if not isinstance(ref, pd.Series):
+        ref = ref[price_col]
+    if not isinstance(sub, pd.Series):
+        sub = sub[price_col]
     cols = ["end", "start", "open", "high", "low", "close"]
-    return pd.DataFrame(ohlc, columns=cols)
+    if sub.shape[0] < 2:
+        return pd.DataFrame([], columns=cols)
+
+    starts, ends = sub.index[:-1], sub.index[1:]
+    lo = ref.index.searchsorted(starts, side='left')
+    hi = ref.index.searchsorted(ends, side='right')
+    # reduceat needs every boundary to be a valid position
+    px = np.append(ref.values.astype(np.float64), np.nan)
+    bounds = np.column_stack([lo, hi]).ravel()
+    empty = lo >= hi
+    with np.errstate(invalid='ignore'):
+        high = np.fmax.reduceat(px, bounds)[::2]
+        low = np.fmin.reduceat(px, bounds)[::2]
+    high[empty], low[empty] = np.nan, np.nan
+
+    return pd.DataFrame({"end": ends, "start": starts,
+                         "open": sub.values[:-1], "high": high, "low": low,
+                         "close": sub.values[1:]}, columns=cols)
+
+def get_bar_ids(n, idx):
+    """
+    Bar id of every tick, bar k spans the ticks (idx[k-1], idx[k]].
+    Ticks after the last bar close get id len(idx).
+    :param n: number of ticks
+    :param idx: positional bar closes from the *_bars_idx functions
+    :return: np.ndarray int64
+    """
+    return np.searchsorted(np.asarray(idx, dtype=np.int64), np.arange(n), side='left')
+
+@instrument('ch1.get_ohlcv', rows=lambda out, df, *args, **kwds: len(df))
+def get_ohlcv(df, idx, price_col='price', volume_col='v', dv_col='dv'):
+    """
+    OHLCV bars from positional bar closes. Every statistic is a single
+    grouped reduction over the tick arrays, grouped by bar id.
+    :param df: tick data
+    :param idx: positional bar closes from the *_bars_idx functions
+    :param price_col:
+    :param volume_col:
+    :param dv_col:
+    :return: pd.DataFrame end, start, open, high, low, close, volume, dollar_volume, vwap, ticks
+    """
+    idx = np.asarray(idx, dtype=np.int64)
+    cols = OHLCV
+    if idx.shape[0] == 0:
+        return pd.DataFrame([], columns=cols)
+
+    # incomplete trailing bar is dropped
+    n = idx[-1] + 1
+    first = np.r_[0, idx[:-1] + 1]
+    px = df[price_col].values[:n].astype(np.float64)
+    volume = np.add.reduceat(df[volume_col].values[:n], first)
+    dollar_volume = np.add.reduceat(df[dv_col].values[:n].astype(np.float64), first)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vwap = dollar_volume / volume
+
+    return pd.DataFrame({"end": df.index[idx], "start": df.index[first],
+                         "open": px[first],
+                         "high": np.fmax.reduceat(px, first),
+                         "low": np.fmin.reduceat(px, first),
+                         "close": px[idx],
+                         "volume": volume, "dollar_volume": dollar_volume,
+                         "vwap": vwap, "ticks": idx - first + 1}, columns=cols)
 
 """ Volume bars """
-def volume_bars_idx(df, volume_column, m):
+def volume_bars_idx(df, volume_column, m, progress=False, numThreads=1):
     """
     :param df:
     :param volume_columm:
     :param m: threshold
-    :return: list of indices
-    """
-    t = df[volume_column]
-    ts = 0
-    idx = []
-    for i, x in enumerate(tqdm(t)):
-        ts += x
-        if ts >= m:
-            idx.append(i)
-            ts = 0
-    return idx
+    :param progress: show a progress bar
+    :param numThreads: worker processes, see sampling.parallel_bars_idx
+    :return: np.ndarray of indices
+    """
+    return sample_bars_idx(df[volume_column], m, 'volume', progress=progress, numThreads=numThreads)
 
 def get_volume_bars(df, volume_column, m):
     """
     :param df:
     :param volume_column:
     :param m:
-    :return:
+    :return: pd.DataFrame, BarView for a TickFrame
     """
     idx = volume_bars_idx(df, volume_column, m)
-    return df.iloc[idx].drop_duplicates()
+    return take_bars(df, idx)
 
 """ Dollar Bars"""
-def dollar_bars_idx(df, dv_column, m):
+def dollar_bars_idx(df, dv_column, m, progress=False, numThreads=1):
     """
     :param df:
     :param dv_column:
     :param m:
-    :return:
-    """
-    t = df[dv_column]
-    ts = 0
-    idx = []
-    for i, x in enumerate(tqdm(t)):
-        ts += x
-        if ts >= m:
-            idx.append(i)
-            ts = 0
-    return idx
+    :param progress: show a progress bar
+    :param numThreads: worker processes, see sampling.parallel_bars_idx
+    :return: np.ndarray of indices
+    """
+    return sample_bars_idx(df[dv_column], m, 'dollar', progress=progress, numThreads=numThreads)
 
 def get_dollar_bars(df, dv_column, m):
     """
     :param df:
     :param dv_column:
     :param m:
-    :return:
+    :return: pd.DataFrame, BarView for a TickFrame
     """
     idx = dollar_bars_idx(df, dv_column, m)
-    return df.iloc[idx].drop_duplicates()
+    return take_bars(df, idx)
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Incremental tick, volume and dollar bars for live tick streams. The sampling
+rule is the one of get_tick_bars/get_volume_bars/get_dollar_bars, so feeding
+a history through a BarBuilder closes bars on the same ticks.
+"""
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from financialml.ch1.sampling import threshold_kernel, tick_bars_idx
+
+OHLCV = ["end", "start", "open", "high", "low", "close",
+         "volume", "dollar_volume", "vwap", "ticks"]
+
+Bar = namedtuple('Bar', OHLCV)
+
+
+class BarBuilder(object):
+    def __init__(self, bar_type, m, price_col='price', size_col='size'):
+        """
+        :param bar_type: 'tick', 'volume' or 'dollar'
+        :param m: threshold
+        :param price_col: price column of the batches passed to update_batch
+        :param size_col: size column of the batches passed to update_batch
+        """
+        object.__init__(self)
+        if bar_type not in ('tick', 'volume', 'dollar'):
+            raise ValueError(f"unknown bar_type: {bar_type}")
+        self._bar_type = bar_type
+        self._m = m
+        self._price_col = price_col
+        self._size_col = size_col
+        self._reset()
+        self._ts = 0
+
+    def _reset(self):
+        # partial bar
+        self._start = None
+        self._open = self._high = self._low = self._close = np.nan
+        self._volume = 0
+        self._dollar_volume = 0.
+        self._ticks = 0
+
+    def _value(self, price, size):
+        if self._bar_type == 'tick':
+            return 1
+        elif self._bar_type == 'volume':
+            return size
+        return price * size
+
+    def _close_bar(self, end):
+        vwap = self._dollar_volume / self._volume if self._volume != 0 else np.nan
+        bar = Bar(end, self._start, self._open, self._high, self._low, self._close,
+                  self._volume, self._dollar_volume, vwap, self._ticks)
+        self._reset()
+        return bar
+
+    def update(self, timestamp, price, size):
+        """
+        Add one tick
+        :param timestamp: pd.Timestamp
+        :param price:
+        :param size:
+        :return: Bar if the tick closes a bar, None otherwise
+        """
+        if self._ticks == 0:
+            self._start, self._open = pd.Timestamp(timestamp), price
+            self._high = self._low = price
+        else:
+            self._high, self._low = max(self._high, price), min(self._low, price)
+        self._close = price
+        self._volume += size
+        self._dollar_volume += price * size
+        self._ticks += 1
+
+        self._ts += self._value(price, size)
+        if self._ts >= self._m:
+            self._ts = 0
+            return self._close_bar(pd.Timestamp(timestamp))
+        return None
+
+    def update_batch(self, df):
+        """
+        Add a micro-batch of ticks
+        :param df: pd.DataFrame indexed by timestamp with price and size columns
+        :return: pd.DataFrame of the bars closed by the batch, columns as get_ohlcv
+        """
+        n = df.shape[0]
+        if n == 0:
+            return pd.DataFrame([], columns=OHLCV)
+        px = df[self._price_col].values.astype(np.float64)
+        size = df[self._size_col].values
+        dv = px * size
+
+        if self._bar_type == 'tick':
+            idx, self._ts = tick_bars_idx(n, self._m, self._ts)
+        else:
+            values = size if self._bar_type == 'volume' else dv
+            idx, self._ts = threshold_kernel(np.ascontiguousarray(values, dtype=np.float64),
+                                             float(self._m), float(self._ts))
+
+        if idx.shape[0] > 0:
+            first = np.r_[0, idx[:-1] + 1]
+            high = np.fmax.reduceat(px[:idx[-1] + 1], first)
+            low = np.fmin.reduceat(px[:idx[-1] + 1], first)
+            volume = np.add.reduceat(size[:idx[-1] + 1], first)
+            dollar_volume = np.add.reduceat(dv[:idx[-1] + 1], first)
+            index = df.index
+            # the first bar of the batch completes the carried partial bar
+            if self._ticks > 0:
+                start, open_ = self._start, self._open
+                high[0], low[0] = max(high[0], self._high), min(low[0], self._low)
+                volume[0] += self._volume
+                dollar_volume[0] += self._dollar_volume
+                ticks0 = self._ticks
+            else:
+                start, open_, ticks0 = index[0], px[0], 0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                vwap = dollar_volume / volume
+            ticks = idx - first + 1
+            ticks[0] += ticks0
+            starts = index[first].values.copy()
+            starts[0] = pd.Timestamp(start).to_datetime64()
+            opens = px[first]
+            opens[0] = open_
+            bars = pd.DataFrame({"end": index[idx], "start": starts,
+                                 "open": opens, "high": high, "low": low, "close": px[idx],
+                                 "volume": volume, "dollar_volume": dollar_volume,
+                                 "vwap": vwap, "ticks": ticks}, columns=OHLCV)
+            self._reset()
+            rest = slice(idx[-1] + 1, n)
+        else:
+            bars = pd.DataFrame([], columns=OHLCV)
+            rest = slice(0, n)
+
+        # ticks after the last close become the partial bar
+        if rest.start < n:
+            p, s, d = px[rest], size[rest], dv[rest]
+            if self._ticks == 0:
+                self._start, self._open = df.index[rest.start], p[0]
+                self._high, self._low = np.nanmax(p), np.nanmin(p)
+            else:
+                self._high, self._low = max(self._high, np.nanmax(p)), min(self._low, np.nanmin(p))
+            self._close = p[-1]
+            self._volume += s.sum()
+            self._dollar_volume += d.sum()
+            self._ticks += p.shape[0]
+        return bars
+
+    @property
+    def partial(self):
+        """ :return: Bar of the ticks received since the last close, None if empty """
+        if self._ticks == 0:
+            return None
+        vwap = self._dollar_volume / self._volume if self._volume != 0 else np.nan
+        return Bar(None, self._start, self._open, self._high, self._low, self._close,
+                   self._volume, self._dollar_volume, vwap, self._ticks)
+
+    def get_state(self):
+        """
+        Checkpoint of the builder, json serializable
+        :return: dict
+        """
+        def _num(x):
+            return x.item() if isinstance(x, np.generic) else x
+        return {'bar_type': self._bar_type, 'm': _num(self._m),
+                'price_col': self._price_col, 'size_col': self._size_col,
+                'ts': _num(self._ts),
+                'start': None if self._start is None else pd.Timestamp(self._start).value,
+                'open': _num(self._open), 'high': _num(self._high), 'low': _num(self._low),
+                'close': _num(self._close), 'volume': _num(self._volume),
+                'dollar_volume': _num(self._dollar_volume), 'ticks': _num(self._ticks)}
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Restore a builder from get_state()
+        :param state: dict
+        :return: BarBuilder
+        """
+        builder = cls(state['bar_type'], state['m'], state['price_col'], state['size_col'])
+        builder._ts = state['ts']
+        builder._start = None if state['start'] is None else pd.Timestamp(state['start'])
+        builder._open, builder._high = state['open'], state['high']
+        builder._low, builder._close = state['low'], state['close']
+        builder._volume = state['volume']
+        builder._dollar_volume = state['dollar_volume']
+        builder._ticks = state['ticks']
+        return builder
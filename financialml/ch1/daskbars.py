@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Out-of-core bars on Dask for tick histories larger than RAM.
+
+load_bars_dask reads tick files (a path, a glob or a list) in blocks of
+blocksize bytes, one partition per block; nothing is read before compute.
+
+The bar samplers are sequential: whether a tick closes a bar depends on the
+running sum of every tick before it. Partition k is sampled by one task
+taking the state (running sum, ticks seen) left by partition k-1, so the
+tasks form a chain while reading and parsing the partitions stays parallel.
+Only the partition being sampled and the bar rows are held in memory, the
+bars are those of get_tick_bars/get_volume_bars/get_dollar_bars on the
+whole frame.
+
+    from dask.distributed import Client, LocalCluster
+    client = Client(LocalCluster(n_workers=4, memory_limit='4GB'))
+    ticks = load_bars_dask('archive/IVE_*.txt')
+    bars = get_dollar_bars_dask(ticks, 'dv', 1e6).compute()
+    ohlc = get_ohlc_dask(ticks, bars)
+
+Without a client the default dask scheduler (threads) is used, the kernels
+release the GIL.
+"""
+import numpy as np
+import pandas as pd
+import dask
+import dask.dataframe as dd
+from financialml.ch1.loader import COLUMNS, _to_ticks, _drop_repeated
+from financialml.ch1.sampling import threshold_kernel, tick_bars_idx
+
+BLOCKSIZE = '64MB'
+
+
+def _drop_repeated_partition(df):
+    # map_overlap prepends the last row of the previous partition and trims it afterwards,
+    # _drop_repeated always keeps the first row
+    return _drop_repeated(df)[0]
+
+
+def load_bars_dask(path, blocksize=BLOCKSIZE):
+    """
+    Lazy tick frame, partitioned by blocks of the files. Repeated records
+    are dropped across partition boundaries, as load_bars does by default
+    (duplicates='repeated').
+    :param path: tick file, glob or list of files (kibot layout, see load_bars)
+    :param blocksize: bytes per partition
+    :return: dd.DataFrame indexed by timestamp with price, bid, ask, size, v, dv
+    """
+    raw = dd.read_csv(path, header=None, names=COLUMNS, dtype={'date': str, 'time': str}, blocksize=blocksize)
+    ticks = raw.map_partitions(_to_ticks, meta=_to_ticks(raw._meta))
+    return ticks.map_overlap(_drop_repeated_partition, before=1, after=0, meta=ticks._meta)
+
+
+def _bars_partition(df, col, m, bar_type, state):
+    """
+    :param state: (running sum, ticks carried) after the previous partition
+    :return: (rows of df closing a bar, state after df)
+    """
+    if bar_type == 'tick':
+        idx, ts = tick_bars_idx(df.shape[0], m, state)
+    else:
+        idx, ts = threshold_kernel(np.ascontiguousarray(df[col].values, dtype=np.float64), float(m), state)
+    return df.iloc[idx], ts
+
+
+def sample_bars_dask(ddf, col, m, bar_type='tick'):
+    """
+    Rows closing a bar, partitions are sampled in order with the state of the previous one
+    :param ddf: dd.DataFrame of ticks
+    :param col: column driving the sampling, unused for tick bars
+    :param m: threshold
+    :param bar_type: 'tick', 'volume' or 'dollar'
+    :return: dd.DataFrame of the rows closing a bar, one partition per tick partition
+    """
+    if bar_type not in ('tick', 'volume', 'dollar'):
+        raise ValueError(f"unknown bar_type: {bar_type}")
+    state = 0 if bar_type == 'tick' else 0.
+    out = []
+    for part in ddf.to_delayed():
+        bars, state = dask.delayed(_bars_partition, nout=2)(part, col, m, bar_type, state)
+        out.append(bars)
+    return dd.from_delayed(out, meta=ddf._meta)
+
+
+def _bars(ddf, col, m, bar_type):
+    # duplicated rows dropped over all partitions, in order
+    return sample_bars_dask(ddf, col, m, bar_type).drop_duplicates(split_out=1)
+
+
+def get_tick_bars_dask(ddf, price_col, m):
+    """ get_tick_bars of a dd.DataFrame, :return: dd.DataFrame """
+    return _bars(ddf, price_col, m, 'tick')
+
+
+def get_volume_bars_dask(ddf, volume_column, m):
+    """ get_volume_bars of a dd.DataFrame, :return: dd.DataFrame """
+    return _bars(ddf, volume_column, m, 'volume')
+
+
+def get_dollar_bars_dask(ddf, dv_column, m):
+    """ get_dollar_bars of a dd.DataFrame, :return: dd.DataFrame """
+    return _bars(ddf, dv_column, m, 'dollar')
+
+
+def _ohlc_partition(ref, starts, ends, price_col):
+    """
+    High and low of the ticks of one partition in every [start, end] window
+    :return: pd.DataFrame high, low indexed by window number, windows without ticks dropped
+    """
+    if isinstance(ref, pd.DataFrame):
+        ref = ref[price_col]
+    lo = ref.index.searchsorted(starts, side='left')
+    hi = ref.index.searchsorted(ends, side='right')
+    windows = np.flatnonzero(lo < hi)
+    if windows.shape[0] == 0:
+        return pd.DataFrame({'high': np.empty(0), 'low': np.empty(0)}, index=pd.Index([], dtype=np.int64))
+    px = np.append(ref.values.astype(np.float64), np.nan)
+    bounds = np.column_stack([lo[windows], hi[windows]]).ravel()
+    with np.errstate(invalid='ignore'):
+        high = np.fmax.reduceat(px, bounds)[::2]
+        low = np.fmin.reduceat(px, bounds)[::2]
+    return pd.DataFrame({'high': high, 'low': low}, index=windows)
+
+
+def get_ohlc_dask(ref, sub, price_col='price'):
+    """
+    get_ohlc with tick prices on Dask. Every partition reduces the windows it
+    overlaps, the partial highs and lows are merged per window.
+    :param ref: dd.DataFrame (or dd.Series) of ticks sorted by time over the partitions
+    :param sub: bars, pd.DataFrame/pd.Series or dd.DataFrame (computed, it is small)
+    :param price_col: price column of DataFrames
+    :return: pd.DataFrame end, start, open, high, low, close
+    """
+    if isinstance(sub, (dd.DataFrame, dd.Series)):
+        sub = sub.compute()
+    if isinstance(sub, pd.DataFrame):
+        sub = sub[price_col]
+    cols = ["end", "start", "open", "high", "low", "close"]
+    if sub.shape[0] < 2:
+        return pd.DataFrame([], columns=cols)
+
+    starts, ends = sub.index[:-1], sub.index[1:]
+    meta = pd.DataFrame({'high': np.empty(0), 'low': np.empty(0)}, index=pd.Index([], dtype=np.int64))
+    windows = dask.delayed((starts, ends))
+    parts = [dask.delayed(_ohlc_partition)(part, windows[0], windows[1], price_col) for part in ref.to_delayed()]
+    partial = dd.from_delayed(parts, meta=meta).compute()
+    agg = partial.groupby(level=0).agg({'high': 'max', 'low': 'min'}).reindex(np.arange(starts.shape[0]))
+
+    return pd.DataFrame({"end": ends, "start": starts,
+                         "open": sub.values[:-1], "high": agg['high'].values, "low": agg['low'].values,
+                         "close": sub.values[1:]}, columns=cols)
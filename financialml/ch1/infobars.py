@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+2.3.2. Information-driven bars: tick/volume/dollar imbalance and run bars.
+
+With the tick rule b_t and v_t = 1, size or price * size (tick, volume,
+dollar), a bar closes at the first T where
+    imbalance: |sum b_t v_t| >= E[T] |E[b v]|
+    run:       max(sum_{b=1} v_t, -sum_{b=-1} v_t) >= E[T] max(E[v 1{b=1}], E[v 1{b=-1}])
+E[T] is an EWMA of past bar lengths, the flow expectations are EWMAs over ticks.
+"""
+import numpy as np
+from financialml.ch1.ticks import take_bars
+from financialml.utils.jit import njit
+from financialml.utils.metrics import instrument
+
+IMBALANCE, RUN = 0, 1
+
+
+def tick_rule(prices, b0=0., p0=np.nan):
+    """
+    b_t = sign(p_t - p_t-1), or b_t-1 when the price did not change
+    :param prices: np.ndarray
+    :param b0: sign carried in from the previous block
+    :param p0: last price of the previous block, nan=none
+    :return: np.ndarray float64 of -1, 0, 1
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    if prices.shape[0] == 0:
+        return np.empty(0, dtype=np.float64)
+    b = np.sign(np.diff(prices, prepend=p0))
+    if not b[0] in (-1., 1.):
+        b[0] = b0
+    # forward fill the zero moves
+    pos = np.where(b != 0, np.arange(b.shape[0]), 0)
+    np.maximum.accumulate(pos, out=pos)
+    return b[pos]
+
+
+@njit(cache=True, nogil=True)
+def info_kernel(b, v, kind, alpha_t, alpha_v, min_ticks, max_ticks, state):
+    """
+    :param b: tick rule signs
+    :param v: tick contribution (1, size or dollar volume)
+    :param kind: IMBALANCE or RUN
+    :param alpha_t: EWMA weight of the expected bar length
+    :param alpha_v: EWMA weight of the expected signed flow, per tick
+    :param min_ticks: lower bound of E[T]
+    :param max_ticks: upper bound of E[T]
+    :param state: float64[6] buy sum, sell sum, ticks in bar, E[T], E[buy flow], E[sell flow]
+        updated in place so consecutive blocks can be chained
+    :return: (indices of bar closes, threshold at each close)
+    """
+    n = b.shape[0]
+    idx = np.empty(n, dtype=np.int64)
+    thresholds = np.empty(n, dtype=np.float64)
+    buy, sell, ticks, e_t, e_buy, e_sell = state[0], state[1], state[2], state[3], state[4], state[5]
+    k = 0
+    for i in range(n):
+        x_buy = v[i] if b[i] > 0 else 0.
+        x_sell = v[i] if b[i] < 0 else 0.
+        buy += x_buy
+        sell += x_sell
+        ticks += 1.
+        e_buy += alpha_v * (x_buy - e_buy)
+        e_sell += alpha_v * (x_sell - e_sell)
+        if kind == IMBALANCE:
+            theta = abs(buy - sell)
+            threshold = e_t * abs(e_buy - e_sell)
+        else:
+            theta = max(buy, sell)
+            threshold = e_t * max(e_buy, e_sell)
+        if theta >= threshold:
+            idx[k] = i
+            thresholds[k] = threshold
+            k += 1
+            e_t = min(max(e_t + alpha_t * (ticks - e_t), min_ticks), max_ticks)
+            buy, sell, ticks = 0., 0., 0.
+    state[0], state[1], state[2], state[3], state[4], state[5] = buy, sell, ticks, e_t, e_buy, e_sell
+    return idx[:k], thresholds[:k]
+
+
+def init_state(b, v, expected_ticks):
+    """
+    Initial kernel state, flow expectations are estimated on the first expected_ticks ticks
+    :return: np.ndarray float64[6]
+    """
+    warm = max(int(expected_ticks), 1)
+    b, v = b[:warm], v[:warm]
+    e_buy = float(np.mean(np.where(b > 0, v, 0.))) if b.shape[0] > 0 else 0.
+    e_sell = float(np.mean(np.where(b < 0, v, 0.))) if b.shape[0] > 0 else 0.
+    return np.array([0., 0., 0., float(expected_ticks), e_buy, e_sell])
+
+
+def _tick_values(df, bar_type, price_col, size_col):
+    if bar_type == 'tick':
+        return np.ones(df.shape[0], dtype=np.float64)
+    elif bar_type == 'volume':
+        return df[size_col].values.astype(np.float64)
+    elif bar_type == 'dollar':
+        return (df[price_col].values * df[size_col].values).astype(np.float64)
+    raise ValueError(f"unknown bar_type: {bar_type}")
+
+
+@instrument('ch1.info_bars_idx', rows=lambda out, df, *args, **kwds: len(df))
+def info_bars_idx(df, bar_type='tick', kind='imbalance', expected_ticks=100, span_bars=20, span_ticks=None,
+                  min_ticks=1, max_ticks=np.inf, price_col='price', size_col='size', state=None):
+    """
+    :param df: tick data
+    :param bar_type: 'tick', 'volume' or 'dollar'
+    :param kind: 'imbalance' or 'run'
+    :param expected_ticks: initial E[T]
+    :param span_bars: EWMA span of E[T], in bars
+    :param span_ticks: EWMA span of the flow expectations in ticks, None=expected_ticks
+    :param min_ticks: lower bound of E[T], keeps E[T] from collapsing when E[b v] is near zero
+    :param max_ticks: upper bound of E[T]
+    :param price_col:
+    :param size_col:
+    :param state: kernel state from a previous call, None=start afresh
+    :return: (np.ndarray int64 indices, np.ndarray thresholds, state)
+    """
+    kinds = {'imbalance': IMBALANCE, 'run': RUN}
+    if kind not in kinds:
+        raise ValueError(f"unknown kind: {kind}")
+    if state is None:
+        b = tick_rule(df[price_col].values)
+    else:
+        b = tick_rule(df[price_col].values, state['b'], state['price'])
+    v = _tick_values(df, bar_type, price_col, size_col)
+    kernel_state = init_state(b, v, expected_ticks) if state is None else state['kernel'].copy()
+
+    span_ticks = expected_ticks if span_ticks is None else span_ticks
+    idx, thresholds = info_kernel(b, v, kinds[kind], 2. / (span_bars + 1.), 2. / (span_ticks + 1.),
+                                  float(min_ticks), float(max_ticks), kernel_state)
+    out_state = {'kernel': kernel_state, 'b': 0., 'price': np.nan}
+    if df.shape[0] > 0:
+        out_state['b'], out_state['price'] = b[-1], float(df[price_col].values[-1])
+    elif state is not None:
+        out_state['b'], out_state['price'] = state['b'], state['price']
+    return idx, thresholds, out_state
+
+
+def get_imbalance_bars(df, bar_type='tick', expected_ticks=100, span_bars=20, span_ticks=None,
+                       min_ticks=1, max_ticks=np.inf, price_col='price', size_col='size'):
+    """
+    Tick, volume or dollar imbalance bars
+    :param df: tick data
+    :param bar_type: 'tick', 'volume' or 'dollar'
+    :param expected_ticks: initial expected ticks per bar
+    :param span_bars: EWMA span of the expected bar length
+    :param span_ticks: EWMA span of the expected imbalance, None=expected_ticks
+    :param min_ticks: lower bound of the expected bar length
+    :param max_ticks: upper bound of the expected bar length
+    :return: pd.DataFrame, BarView for a TickFrame
+    """
+    idx, _, _ = info_bars_idx(df, bar_type, 'imbalance', expected_ticks, span_bars, span_ticks,
+                              min_ticks, max_ticks, price_col, size_col)
+    return take_bars(df, idx)
+
+
+def get_run_bars(df, bar_type='tick', expected_ticks=100, span_bars=20, span_ticks=None,
+                 min_ticks=1, max_ticks=np.inf, price_col='price', size_col='size'):
+    """
+    Tick, volume or dollar run bars
+    :param df: tick data
+    :param bar_type: 'tick', 'volume' or 'dollar'
+    :param expected_ticks: initial expected ticks per bar
+    :param span_bars: EWMA span of the expected bar length
+    :param span_ticks: EWMA span of the expected buy/sell flows, None=expected_ticks
+    :param min_ticks: lower bound of the expected bar length
+    :param max_ticks: upper bound of the expected bar length
+    :return: pd.DataFrame, BarView for a TickFrame
+    """
+    idx, _, _ = info_bars_idx(df, bar_type, 'run', expected_ticks, span_bars, span_ticks,
+                              min_ticks, max_ticks, price_col, size_col)
+    return take_bars(df, idx)
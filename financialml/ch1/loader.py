@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Chunked tick loader for kibot style tick files:
+    date, time, price, bid, ask, size
+    09/28/2009,09:30:00,50.79,50.70,50.79,100
+"""
+import numpy as np
+import pandas as pd
+from financialml.ch1.ticks import TickFrame, TICK_SIZE
+from financialml.utils.metrics import instrument
+
+COLUMNS = ['date', 'time', 'price', 'bid', 'ask', 'size']
+CHUNK_SIZE = 1000000
+DUPLICATES = ('repeated', 'all', None)
+
+_DATE_FORMAT = '%m/%d/%Y%H:%M:%S'
+
+
+def _digits(arr, width):
+    """ Fixed width unicode array as an (N, width) int array of code points """
+    return arr.view(np.uint32).reshape(-1, width).astype(np.int64)
+
+
+def parse_timestamps(date, time):
+    """
+    Fast path for fixed format '%m/%d/%Y' + '%H:%M:%S' fields. The strings are
+    viewed as fixed width code point arrays and the fields are decoded with
+    integer arithmetic. Anything that does not fit the layout goes through
+    pd.to_datetime instead.
+    :param date: array-like of 'mm/dd/YYYY' strings
+    :param time: array-like of 'HH:MM:SS' strings
+    :return: pd.DatetimeIndex
+    """
+    d = np.asarray(date, dtype=str)
+    t = np.asarray(time, dtype=str)
+    if d.shape[0] == 0:
+        return pd.DatetimeIndex([], dtype='datetime64[ns]', name='dates')
+    if d.dtype.itemsize != 40 or t.dtype.itemsize != 32:
+        return _parse_timestamps_slow(date, time)
+
+    dc, tc = _digits(d, 10), _digits(t, 8)
+    dsep, tsep = dc[:, [2, 5]], tc[:, [2, 5]]
+    dc, tc = dc - 48, tc - 48
+    ddig, tdig = dc[:, [0, 1, 3, 4, 6, 7, 8, 9]], tc[:, [0, 1, 3, 4, 6, 7]]
+    if not ((dsep == ord('/')).all() and (tsep == ord(':')).all()
+            and ((ddig >= 0) & (ddig <= 9)).all() and ((tdig >= 0) & (tdig <= 9)).all()):
+        return _parse_timestamps_slow(date, time)
+
+    month = dc[:, 0] * 10 + dc[:, 1]
+    day = dc[:, 3] * 10 + dc[:, 4]
+    year = dc[:, 6] * 1000 + dc[:, 7] * 100 + dc[:, 8] * 10 + dc[:, 9]
+    hour = tc[:, 0] * 10 + tc[:, 1]
+    minute = tc[:, 3] * 10 + tc[:, 4]
+    second = tc[:, 6] * 10 + tc[:, 7]
+    if ((month < 1) | (month > 12) | (day < 1) | (day > 31)
+            | (hour > 23) | (minute > 59) | (second > 59)).any():
+        return _parse_timestamps_slow(date, time)
+
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    # day overflow (e.g. 02/30) would silently roll into the next month
+    if (days.astype('datetime64[M]') != months).any():
+        return _parse_timestamps_slow(date, time)
+    seconds = hour * 3600 + minute * 60 + second
+    stamps = days.astype('datetime64[ns]') + seconds.astype('timedelta64[s]')
+    return pd.DatetimeIndex(stamps, name='dates')
+
+
+def _parse_timestamps_slow(date, time):
+    date = pd.Series(np.asarray(date, dtype=object))
+    time = pd.Series(np.asarray(time, dtype=object))
+    return pd.DatetimeIndex(pd.to_datetime(date + time, format=_DATE_FORMAT), name='dates')
+
+
+def _read_csv(path, **kwds):
+    return pd.read_csv(path, header=None, names=COLUMNS,
+                       dtype={'date': str, 'time': str}, **kwds)
+
+
+def _to_ticks(raw):
+    """ Raw csv frame -> tick frame indexed by timestamp with v, dv columns """
+    dates = parse_timestamps(raw['date'].values, raw['time'].values)
+    df = raw.drop(['date', 'time'], axis=1)
+    df.index = dates
+    df['v'] = df['size']  # volume
+    df['dv'] = df['price'] * df['size']  # dollar volume
+    return df
+
+
+def _drop_repeated(df, last=None):
+    """
+    Drop records identical (timestamp and values) to the preceding record.
+    :param df: tick frame
+    :param last: last record of the previous chunk, pd.DataFrame of 1 row or None
+    :return: (deduplicated frame, last record of this chunk)
+    """
+    if df.shape[0] == 0:
+        return df, last
+    values = df.values
+    idx = df.index.values
+    keep = np.ones(df.shape[0], dtype=bool)
+    same = (values[1:] == values[:-1]) | (pd.isna(values[1:]) & pd.isna(values[:-1]))
+    keep[1:] = ~(same.all(axis=1) & (idx[1:] == idx[:-1]))
+    if last is not None:
+        prev = last.values[0]
+        first = values[0]
+        same = (first == prev) | (pd.isna(first) & pd.isna(prev))
+        keep[0] = not (same.all() and idx[0] == last.index.values[0])
+    return df.loc[keep], df.iloc[-1:]
+
+
+def _drop_seen(df, seen=None):
+    """
+    Drop records whose values (timestamp ignored) appeared earlier, the
+    df.drop_duplicates() of the whole file chunk by chunk.
+    :param df: tick frame
+    :param seen: sorted np.ndarray of the row hashes of the previous chunks or None
+    :return: (deduplicated frame, row hashes seen so far)
+    """
+    h = pd.util.hash_pandas_object(df, index=False).values
+    keep = ~pd.Series(h).duplicated().values
+    if seen is not None and seen.shape[0] > 0:
+        pos = np.minimum(np.searchsorted(seen, h), seen.shape[0] - 1)
+        keep &= seen[pos] != h
+    seen = np.union1d(seen, h) if seen is not None else np.unique(h)
+    return df.loc[keep], seen
+
+
+def _dedup_chunks(chunks, duplicates):
+    """ Apply a duplicates rule (see load_bars) over a stream of tick frames """
+    if duplicates not in DUPLICATES:
+        raise ValueError(f"unknown duplicates: {duplicates}")
+    state = None
+    for df in chunks:
+        if duplicates == 'repeated':
+            df, state = _drop_repeated(df, state)
+        elif duplicates == 'all':
+            df, state = _drop_seen(df, state)
+        yield df
+
+
+def _prepare_outliers(path, outliers, chunksize, duplicates):
+    # two pass filters (SketchMad) see every price of the deduplicated stream before flagging any
+    if outliers is not None and outliers.two_pass:
+        with _read_csv(path, chunksize=chunksize) as reader:
+            for df in _dedup_chunks((_to_ticks(raw) for raw in reader), duplicates):
+                outliers.update(df['price'].values)
+
+
+def _drop_outliers(df, outliers):
+    if outliers is None or df.shape[0] == 0:
+        return df
+    return df.loc[~outliers.mask(df['price'].values)]
+
+
+def iter_bars(path, chunksize=CHUNK_SIZE, outliers=None, duplicates='repeated'):
+    """
+    Stream a tick file in fixed size chunks. v/dv are computed per chunk and
+    duplicates are dropped within a chunk and across chunk boundaries, so
+    only one chunk is held in memory at a time.
+    :param path: tick file
+    :param chunksize: rows per chunk
+    :param outliers: outlier filter (RollingMad, SketchMad) or None, flagged
+        ticks are dropped after the duplicates
+    :param duplicates: see load_bars
+    :return: generator of pd.DataFrame
+    """
+    _prepare_outliers(path, outliers, chunksize, duplicates)
+    with _read_csv(path, chunksize=chunksize) as reader:
+        for df in _dedup_chunks((_to_ticks(raw) for raw in reader), duplicates):
+            df = _drop_outliers(df, outliers)
+            if df.shape[0] > 0:
+                yield df
+
+
+@instrument('ch1.load_bars')
+def load_bars(path, chunksize=None, iterator=False, outliers=None, compact=None, tick=TICK_SIZE,
+              duplicates='repeated'):
+    """
+    Load a tick file, the same ticks whatever the chunksize
+    :param path: tick file
+    :param chunksize: None loads the whole file at once, otherwise the file is
+        streamed in chunks of chunksize rows (see iter_bars)
+    :param iterator: return the chunk generator instead of a single frame
+    :param outliers: outlier filter (see ch1.outliers) or None, the ticks it
+        flags are dropped during ingestion
+    :param compact: None, or the price dtype of a TickFrame ('int32' stores
+        prices in tick units, 'float32'), chunks are compacted as they are read
+    :param tick: price increment of integer prices
+    :param duplicates: 'repeated' drops records identical (timestamp and
+        values) to the preceding record, 'all' drops records whose values
+        appeared anywhere before, timestamp ignored (the former full-frame
+        drop_duplicates, streaming keeps a hash of every distinct record),
+        None keeps every record
+    :return: pd.DataFrame or generator of pd.DataFrame (TickFrame when compact)
+    """
+    if iterator or chunksize is not None:
+        chunks = iter_bars(path, chunksize or CHUNK_SIZE, outliers, duplicates)
+        if compact is not None:
+            chunks = (TickFrame.from_frame(c, compact, tick=tick) for c in chunks)
+        if iterator:
+            return chunks
+        chunks = list(chunks)
+        if len(chunks) == 0:
+            df = _to_ticks(_read_csv(path, nrows=0))
+            return df if compact is None else TickFrame.from_frame(df, compact, tick=tick)
+        return pd.concat(chunks) if compact is None else TickFrame.concat(chunks)
+    df = _drop_outliers(next(_dedup_chunks([_to_ticks(_read_csv(path))], duplicates)), outliers)
+    return df if compact is None else TickFrame.from_frame(df, compact, tick=tick)
@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Chunk compatible MAD outlier filters, see mad_outlier for the whole-array version.
+
+A tick is an outlier when its modified z-score
+    0.6745 * |p - median| / MAD
+is above a threshold.
+
+RollingMad: a trailing window version that follows the price level. The
+    median is the rolling median of the prices, the MAD is approximated by
+    the rolling median of the deviations |p - median| taken when each tick
+    arrived (each against the median of its own window, not the current
+    one), so a tick costs O(log window) instead of a pass over the window.
+    Both rolling medians use two indexed heaps over a ring buffer whose
+    state carries over from one chunk to the next.
+SketchMad: one global median and MAD from a histogram of prices at a fixed
+    resolution, memory grows with the number of price levels rather than
+    ticks and the error is at most half the resolution.
+
+Filters passed to load_bars drop the ticks they flag during ingestion.
+"""
+import numpy as np
+from financialml.utils.jit import njit
+
+
+@njit(cache=True, nogil=True)
+def _up(heap, i, vals, where, sgn):
+    # sift up, sgn=1 max-heap, sgn=-1 min-heap
+    while i > 0:
+        parent = (i - 1) // 2
+        if sgn * vals[heap[i]] <= sgn * vals[heap[parent]]:
+            break
+        heap[i], heap[parent] = heap[parent], heap[i]
+        where[heap[i]], where[heap[parent]] = i, parent
+        i = parent
+
+
+@njit(cache=True, nogil=True)
+def _down(heap, n, i, vals, where, sgn):
+    while True:
+        top, left = i, 2 * i + 1
+        if left < n and sgn * vals[heap[left]] > sgn * vals[heap[top]]:
+            top = left
+        if left + 1 < n and sgn * vals[heap[left + 1]] > sgn * vals[heap[top]]:
+            top = left + 1
+        if top == i:
+            break
+        heap[i], heap[top] = heap[top], heap[i]
+        where[heap[i]], where[heap[top]] = i, top
+        i = top
+
+
+@njit(cache=True, nogil=True)
+def _move_top(src, nsrc, ssrc, dst, ndst, sdst, vals, where, side, to_side):
+    # pop the top of src and push it on dst, return the new sizes
+    slot = src[0]
+    nsrc -= 1
+    src[0] = src[nsrc]
+    where[src[0]] = 0
+    _down(src, nsrc, 0, vals, where, ssrc)
+    dst[ndst] = slot
+    where[slot] = ndst
+    side[slot] = to_side
+    _up(dst, ndst, vals, where, sdst)
+    return nsrc, ndst + 1
+
+
+@njit(cache=True, nogil=True)
+def rolling_median_kernel(x, vals, lo, hi, where, side, meta):
+    """
+    Running median of a trailing window with two indexed heaps: lo (max-heap,
+    lower half) and hi (min-heap, upper half) hold the ring buffer slots of the
+    window, so the oldest value is replaced in place in O(log window).
+    :param x: np.ndarray float64, NaN values are skipped
+    :param vals: np.ndarray float64 (window size,) ring buffer
+    :param lo, hi: np.ndarray int64 (window size,) heaps of slots
+    :param where: np.ndarray int64 (window size,) position of each slot in its heap
+    :param side: np.ndarray int64 (window size,) 0=lo, 1=hi
+    :param meta: np.ndarray int64 [count, oldest slot, size of lo, size of hi]
+    all state arrays are updated in place
+    :return: np.ndarray float64 median of the trailing window at every value
+    """
+    w = vals.shape[0]
+    out = np.full(x.shape[0], np.nan)
+    count, slot, nlo, nhi = meta[0], meta[1], meta[2], meta[3]
+    for i in range(x.shape[0]):
+        v = x[i]
+        if np.isnan(v):
+            continue
+        if count < w:
+            # grow: push on lo, then restore the size balance
+            vals[slot] = v
+            lo[nlo] = slot
+            where[slot] = nlo
+            side[slot] = 0
+            _up(lo, nlo, vals, where, 1)
+            nlo += 1
+            count += 1
+            if nlo > nhi + 1:
+                nlo, nhi = _move_top(lo, nlo, 1, hi, nhi, -1, vals, where, side, 1)
+        else:
+            # replace the oldest value in its heap
+            old = vals[slot]
+            vals[slot] = v
+            if side[slot] == 0:
+                if v > old:
+                    _up(lo, where[slot], vals, where, 1)
+                else:
+                    _down(lo, nlo, where[slot], vals, where, 1)
+            else:
+                if v < old:
+                    _up(hi, where[slot], vals, where, -1)
+                else:
+                    _down(hi, nhi, where[slot], vals, where, -1)
+        # halves out of order: exchange the tops
+        if nhi > 0 and vals[lo[0]] > vals[hi[0]]:
+            a, b = lo[0], hi[0]
+            lo[0], hi[0] = b, a
+            side[a], side[b] = 1, 0
+            where[a], where[b] = 0, 0
+            _down(lo, nlo, 0, vals, where, 1)
+            _down(hi, nhi, 0, vals, where, -1)
+        slot = (slot + 1) % w
+        out[i] = vals[lo[0]] if nlo > nhi else (vals[lo[0]] + vals[hi[0]]) / 2.
+    meta[0], meta[1], meta[2], meta[3] = count, slot, nlo, nhi
+    return out
+
+
+class _RollingMedian(object):
+    def __init__(self, window):
+        object.__init__(self)
+        self.vals = np.zeros(window)
+        self.lo = np.zeros(window, dtype=np.int64)
+        self.hi = np.zeros(window, dtype=np.int64)
+        self.where = np.zeros(window, dtype=np.int64)
+        self.side = np.zeros(window, dtype=np.int64)
+        self.meta = np.zeros(4, dtype=np.int64)
+
+    def __call__(self, x):
+        return rolling_median_kernel(x, self.vals, self.lo, self.hi, self.where, self.side, self.meta)
+
+
+class RollingMad(object):
+    two_pass = False
+
+    def __init__(self, window=10000, threshold=3., min_periods=None, min_mad=0.):
+        """
+        Streaming modified z-score: the deviation of a tick from the rolling
+        median over the rolling median of the past deviations, which
+        approximates the MAD of the window
+        :param window: ticks in the trailing window
+        :param threshold: modified z-score above which a tick is an outlier
+        :param min_periods: ticks seen before any tick is flagged, default window // 10
+        :param min_mad: floor of the MAD, e.g. the tick size, flat windows have a zero MAD
+        """
+        object.__init__(self)
+        self.threshold = threshold
+        self.min_periods = window // 10 if min_periods is None else min_periods
+        self.min_mad = min_mad
+        self._median = _RollingMedian(window)
+        self._mad = _RollingMedian(window)
+        self._seen = 0
+
+    def mask(self, prices):
+        """
+        Flag the next chunk of prices
+        :param prices: array-like
+        :return: np.ndarray bool, True for outliers
+        """
+        prices = np.ascontiguousarray(prices, dtype=np.float64).ravel()
+        dev = np.abs(prices - self._median(prices))
+        mad = np.maximum(self._mad(dev), self.min_mad)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out = 0.6745 * dev / mad > self.threshold
+        seen = self._seen + np.arange(prices.shape[0])
+        self._seen += prices.shape[0]
+        return out & (seen >= self.min_periods)
+
+
+def _weighted_median(values, counts):
+    # np.median of values repeated counts times, values sorted
+    cum = np.cumsum(counts)
+    n = cum[-1]
+    lo = values[np.searchsorted(cum, (n - 1) // 2, side='right')]
+    hi = values[np.searchsorted(cum, n // 2, side='right')]
+    return (lo + hi) / 2.
+
+
+class SketchMad(object):
+    two_pass = True
+
+    def __init__(self, threshold=3., resolution=1e-2):
+        """
+        :param threshold: modified z-score above which a tick is an outlier
+        :param resolution: histogram bin width in price units, e.g. the tick size
+        """
+        object.__init__(self)
+        self.threshold = threshold
+        self.resolution = resolution
+        self._levels = np.empty(0, dtype=np.int64)
+        self._counts = np.empty(0, dtype=np.int64)
+        self._stats = None
+
+    def update(self, prices):
+        """ Add prices to the histogram """
+        prices = np.asarray(prices, dtype=np.float64).ravel()
+        levels = np.round(prices[~np.isnan(prices)] / self.resolution).astype(np.int64)
+        levels, inverse = np.unique(np.concatenate([self._levels, levels]), return_inverse=True)
+        counts = np.bincount(inverse, minlength=levels.shape[0])
+        counts[inverse[:self._levels.shape[0]]] += self._counts - 1
+        self._levels, self._counts = levels, counts
+        self._stats = None
+
+    @property
+    def median(self):
+        return self.stats[0]
+
+    @property
+    def mad(self):
+        return self.stats[1]
+
+    @property
+    def stats(self):
+        """ :return: (median, MAD) of the prices added so far """
+        if self._stats is None:
+            if self._counts.shape[0] == 0:
+                return np.nan, np.nan
+            values = self._levels * self.resolution
+            median = _weighted_median(values, self._counts)
+            dev = np.abs(values - median)
+            order = np.argsort(dev, kind='stable')
+            self._stats = median, _weighted_median(dev[order], self._counts[order])
+        return self._stats
+
+    def mask(self, prices):
+        """
+        Flag prices against the histogram, which is filled with them first when empty
+        :param prices: array-like
+        :return: np.ndarray bool, True for outliers
+        """
+        prices = np.asarray(prices, dtype=np.float64).ravel()
+        if self._counts.shape[0] == 0:
+            self.update(prices)
+        median, mad = self.stats
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 0.6745 * np.abs(prices - median) / mad > self.threshold
+
+
+def rolling_mad_outlier(y, window=10000, threshold=3., min_periods=None, min_mad=0.):
+    """
+    mad_outlier over a trailing window of ticks, with the streaming MAD of RollingMad
+    :param y: array-like of prices, (N,) or (N,1)
+    :return: np.ndarray bool, True for outliers
+    """
+    return RollingMad(window, threshold, min_periods, min_mad).mask(y)
+
+
+def approx_mad_outlier(y, threshold=3., resolution=1e-2):
+    """
+    mad_outlier with the median and MAD of a price histogram
+    :param y: array-like of prices, (N,) or (N,1)
+    :return: np.ndarray bool, True for outliers
+    """
+    return SketchMad(threshold, resolution).mask(y)
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Shared sampling engine for tick, volume and dollar bars.
+All samplers return int64 positional indices of the ticks that close a bar.
+"""
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from financialml.utils.jit import njit
+from financialml.utils.mp import mp_pandas_obj
+from financialml.utils.metrics import instrument
+
+CHUNK_SIZE = 1 << 20
+
+
+@njit(cache=True, nogil=True)
+def threshold_kernel(values, m, ts=0.):
+    """
+    Accumulate values and close a bar whenever the running sum reaches m,
+    resetting the sum to zero afterwards.
+    :param values: np.ndarray float64
+    :param m: threshold
+    :param ts: running sum carried in from the previous block
+    :return: (indices of bar closes, running sum after the last value)
+    """
+    idx = np.empty(values.shape[0], dtype=np.int64)
+    k = 0
+    for i in range(values.shape[0]):
+        ts += values[i]
+        if ts >= m:
+            idx[k] = i
+            k += 1
+            ts = 0.
+    return idx[:k], ts
+
+
+@njit(cache=True, nogil=True)
+def sync_kernel(values, m, ts, local_idx):
+    """
+    Rerun threshold_kernel on a block from the true carried-in sum until it
+    closes a bar on a tick where the block's own run (started from zero) also
+    closed one. Both runs reset to zero there, so the rest of the block's run
+    is already correct.
+    :param values: np.ndarray float64 of the block
+    :param m: threshold
+    :param ts: running sum carried in from the previous block
+    :param local_idx: bar closes of the block computed from a zero sum
+    :return: (corrected closes up to the sync point, position in local_idx to resume from,
+              running sum, synced flag)
+    """
+    idx = np.empty(values.shape[0], dtype=np.int64)
+    k, j = 0, 0
+    for i in range(values.shape[0]):
+        ts += values[i]
+        if ts >= m:
+            idx[k] = i
+            k += 1
+            ts = 0.
+            while j < local_idx.shape[0] and local_idx[j] < i:
+                j += 1
+            if j < local_idx.shape[0] and local_idx[j] == i:
+                return idx[:k], j + 1, ts, True
+    return idx[:k], local_idx.shape[0], ts, False
+
+
+def tick_bars_idx(n, m, ts=0):
+    """
+    Tick bars close every ceil(m) ticks; the tick count is a cumulative sum of
+    ones so bar closes are found with a single searchsorted.
+    :param n: number of ticks
+    :param m: ticks threshold
+    :param ts: ticks carried in from the previous block
+    :return: (indices of bar closes, ticks carried out)
+    """
+    step = max(int(np.ceil(m)), 1)
+    count = np.arange(ts + 1, ts + n + 1, dtype=np.int64)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), ts
+    targets = np.arange(step, count[-1] + 1, step, dtype=np.int64)
+    idx = np.searchsorted(count, targets[targets >= count[0]])
+    rest = n - 1 - idx[-1] if idx.shape[0] > 0 else ts + n
+    return idx.astype(np.int64), int(rest)
+
+
+def threshold_bars_idx(values, m, progress=False, chunksize=CHUNK_SIZE):
+    """
+    Volume and dollar bar sampler
+    :param values: array-like of volume or dollar volume per tick
+    :param m: threshold
+    :param progress: show a progress bar, updated once per chunk
+    :param chunksize: ticks per kernel call when progress is enabled
+    :return: np.ndarray int64 indices
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    if not progress:
+        return threshold_kernel(values, float(m), 0.)[0]
+
+    out, ts = [], 0.
+    with tqdm(total=values.shape[0], unit='tick') as pbar:
+        for start in range(0, values.shape[0], chunksize):
+            block = values[start:start + chunksize]
+            idx, ts = threshold_kernel(block, float(m), ts)
+            out.append(idx + start)
+            pbar.update(block.shape[0])
+    return np.concatenate(out) if out else np.empty(0, dtype=np.int64)
+
+
+def _block_threshold_idx(molecule, m):
+    # worker: bar closes of one block assuming a zero carried-in sum
+    values = np.ascontiguousarray(molecule.values, dtype=np.float64)
+    idx, ts = threshold_kernel(values, float(m), 0.)
+    return molecule.index[0], values.shape[0], idx, ts
+
+
+def parallel_bars_idx(values, m, numThreads=2, mpBatches=1):
+    """
+    Volume and dollar bar sampler over numThreads worker processes. Blocks are
+    sampled independently from a zero sum, then a sequential fix-up pass
+    carries the running sum across block boundaries (see sync_kernel). The
+    result is identical to threshold_bars_idx.
+    :param values: array-like of volume or dollar volume per tick
+    :param m: threshold
+    :param numThreads: worker processes
+    :param mpBatches: blocks per worker
+    :return: np.ndarray int64 indices
+    """
+    values = pd.Series(np.asarray(values, dtype=np.float64))
+    if values.shape[0] == 0:
+        return np.empty(0, dtype=np.int64)
+    blocks = mp_pandas_obj(_block_threshold_idx, ('molecule', values), numThreads, mpBatches=mpBatches,
+                           shared=True, m=m)
+    blocks = sorted(blocks, key=lambda x: x[0])
+
+    out, ts = [], 0.
+    for start, n, local_idx, local_ts in blocks:
+        if ts == 0.:
+            out.append(local_idx + start)
+            ts = local_ts
+            continue
+        block = values.values[start:start + n]
+        idx, j, ts, synced = sync_kernel(block, float(m), ts, local_idx)
+        out.append(idx + start)
+        if synced:
+            out.append(local_idx[j:] + start)
+            ts = local_ts
+    return np.concatenate(out)
+
+
+@instrument('ch1.sample_bars_idx', rows=lambda out, values, *args, **kwds: len(values))
+def sample_bars_idx(values, m, bar_type='tick', progress=False, numThreads=1):
+    """
+    Entry point used by the bar functions in bars.py
+    :param values: column driving the sampling, only its length is used for tick bars
+    :param m: threshold
+    :param bar_type: 'tick', 'volume' or 'dollar'
+    :param progress: show a progress bar
+    :param numThreads: >1 samples volume and dollar bars with parallel_bars_idx
+    :return: np.ndarray int64 indices
+    """
+    if bar_type == 'tick':
+        return tick_bars_idx(len(values), m)[0]
+    elif bar_type in ('volume', 'dollar'):
+        if numThreads > 1:
+            return parallel_bars_idx(values, m, numThreads)
+        return threshold_bars_idx(values, m, progress=progress)
+    raise ValueError(f"unknown bar_type: {bar_type}")
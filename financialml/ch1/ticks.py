@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Compact in-memory tick frames.
+
+A load_bars frame holds float64 price/bid/ask, int64 size, a v column that
+duplicates size and a float64 dv, 56 bytes per tick with the timestamp.
+TickFrame keeps
+    dates       int64 nanoseconds
+    price, bid, ask
+                float32, or integers of tick units (exact for prices on
+                the tick grid, e.g. cents read from a kibot file)
+    size        int32
+and computes v and dv when they are asked for, 24 bytes per tick with int32
+or float32 prices. Column access returns float64/int64 pd.Series, so the
+bar functions of bars.py take a TickFrame where they take a frame.
+
+Bars sampled from a TickFrame are BarViews: the positions of the bar closes
+in the ticks, columns are decoded for those positions only when accessed.
+"""
+import numpy as np
+import pandas as pd
+
+PRICES = ['price', 'bid', 'ask']
+DERIVED = ['v', 'dv']
+TICK_SIZE = 0.01
+
+
+def _encode_int(values, dtype, scale, col):
+    out = np.round(np.asarray(values, dtype=np.float64) * scale)
+    info = np.iinfo(dtype)
+    if out.shape[0] > 0 and (np.nanmin(out) < info.min or np.nanmax(out) > info.max):
+        raise OverflowError(f"{col} does not fit in {np.dtype(dtype).name}")
+    if np.isnan(out).any():
+        raise ValueError(f"{col} has missing values, use float32 prices")
+    return out.astype(dtype)
+
+
+class TickFrame(object):
+    def __init__(self, dates, columns, scale=None):
+        """
+        :param dates: np.ndarray int64 nanoseconds since the epoch, sorted
+        :param columns: dict name -> np.ndarray of stored columns
+        :param scale: prices are stored as integers of 1/scale, None=float prices
+        """
+        object.__init__(self)
+        self._dates = np.asarray(dates, dtype=np.int64)
+        self._columns = dict(columns)
+        self._scale = scale
+        self._index = None
+
+    @classmethod
+    def from_frame(cls, df, price_dtype='int32', size_dtype='int32', tick=TICK_SIZE):
+        """
+        :param df: tick frame (see load_bars)
+        :param price_dtype: 'float32', or an integer dtype storing prices in tick units
+        :param size_dtype: dtype of size
+        :param tick: price increment of integer prices
+        :return: TickFrame
+        """
+        integer = np.issubdtype(np.dtype(price_dtype), np.integer)
+        scale = 1. / tick if integer else None
+        columns = {}
+        for col in df.columns:
+            if col in DERIVED:
+                continue
+            values = df[col].values
+            if col in PRICES:
+                values = _encode_int(values, price_dtype, scale, col) if integer else values.astype(price_dtype)
+            elif col == 'size':
+                values = _encode_int(values, size_dtype, 1., col)
+            columns[col] = values
+        return cls(df.index.values.astype('datetime64[ns]').view(np.int64), columns, scale)
+
+    @classmethod
+    def concat(cls, frames):
+        """ :param frames: list of TickFrames with the same layout """
+        frames = list(frames)
+        if len(frames) == 0:
+            raise ValueError("no frames to concatenate")
+        columns = {c: np.concatenate([f._columns[c] for f in frames]) for c in frames[0]._columns}
+        return cls(np.concatenate([f._dates for f in frames]), columns, frames[0]._scale)
+
+    @property
+    def index(self):
+        """ :return: pd.DatetimeIndex sharing the int64 timestamps """
+        if self._index is None:
+            self._index = pd.DatetimeIndex(self._dates.view('datetime64[ns]'), name='dates', copy=False)
+        return self._index
+
+    @property
+    def columns(self):
+        return list(self._columns) + [c for c in DERIVED if 'size' in self._columns]
+
+    @property
+    def shape(self):
+        return self._dates.shape[0], len(self.columns)
+
+    @property
+    def nbytes(self):
+        """ :return: bytes held by the stored columns and timestamps """
+        return self._dates.nbytes + sum(a.nbytes for a in self._columns.values())
+
+    def __len__(self):
+        return self._dates.shape[0]
+
+    def values(self, col, positions=None):
+        """
+        Decoded column, float64 prices and dv, int64 sizes and v
+        :param col: stored or derived column
+        :param positions: np.ndarray of rows to decode, None=all
+        :return: np.ndarray
+        """
+        def raw(c):
+            return self._columns[c] if positions is None else self._columns[c][positions]
+        if col == 'v':
+            col = 'size'
+        if col == 'dv':
+            return self.values('price', positions) * raw('size')
+        if col not in self._columns:
+            raise KeyError(col)
+        values = raw(col)
+        if col in PRICES:
+            return values / self._scale if self._scale is not None else values.astype(np.float64)
+        if col == 'size':
+            return values.astype(np.int64)
+        return values
+
+    def __getitem__(self, col):
+        if isinstance(col, list):
+            return pd.DataFrame({c: self.values(c) for c in col}, index=self.index, columns=col)
+        return pd.Series(self.values(col), index=self.index, name=col)
+
+    def to_frame(self, columns=None):
+        """ :return: pd.DataFrame laid out like load_bars """
+        return self[self.columns if columns is None else list(columns)]
+
+    def take(self, idx):
+        """ :return: BarView of the rows at positions idx """
+        return BarView(self, idx)
+
+    def bars(self, idx):
+        """
+        Rows at the bar closes with duplicated rows dropped, the compact
+        df.iloc[idx].drop_duplicates(). v and dv follow from the stored
+        columns so only those are compared.
+        :return: BarView
+        """
+        idx = np.asarray(idx, dtype=np.int64)
+        stored = pd.DataFrame({c: a[idx] for c, a in self._columns.items()})
+        return BarView(self, idx[~stored.duplicated().values])
+
+
+class BarView(object):
+    def __init__(self, ticks, idx):
+        """
+        :param ticks: TickFrame
+        :param idx: positions of the rows in ticks
+        """
+        object.__init__(self)
+        self.ticks = ticks
+        self.idx = np.asarray(idx, dtype=np.int64)
+
+    @property
+    def index(self):
+        return self.ticks.index[self.idx]
+
+    @property
+    def columns(self):
+        return self.ticks.columns
+
+    @property
+    def shape(self):
+        return self.idx.shape[0], len(self.columns)
+
+    def __len__(self):
+        return self.idx.shape[0]
+
+    def values(self, col):
+        return self.ticks.values(col, self.idx)
+
+    def __getitem__(self, col):
+        if isinstance(col, list):
+            return pd.DataFrame({c: self.values(c) for c in col}, index=self.index, columns=col)
+        return pd.Series(self.values(col), index=self.index, name=col)
+
+    def to_frame(self, columns=None):
+        """ :return: pd.DataFrame of the bar rows """
+        return self[self.columns if columns is None else list(columns)]
+
+
+def take_bars(df, idx):
+    """
+    Rows of the ticks at the bar closes, duplicated rows dropped
+    :param df: pd.DataFrame or TickFrame
+    :param idx: positional bar closes
+    :return: pd.DataFrame, or BarView for a TickFrame
+    """
+    if isinstance(df, TickFrame):
+        return df.bars(idx)
+    return df.iloc[idx].drop_duplicates()
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Day partitioned columnar tick store.
+
+    root/
+        _index.json           day -> (file, row group, row offset, rows)
+        2009-09-0.parquet     one file per month per write, one row group per day
+        2009-10-0.parquet
+
+Derived columns (v, dv) are not stored, they are rebuilt on read. Opening a
+store only reads the index.
+"""
+import json
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+INDEX_FILE = '_index.json'
+DERIVED = ['v', 'dv']
+
+
+def _compact(df, dtypes):
+    """ Tick frame -> arrow table with the store dtypes """
+    out = {'dates': df.index.values.astype('datetime64[ns]')}
+    for col, dtype in dtypes.items():
+        values = df[col].values
+        if np.issubdtype(np.dtype(dtype), np.integer):
+            info = np.iinfo(dtype)
+            if values.shape[0] > 0 and (values.min() < info.min or values.max() > info.max):
+                raise OverflowError(f"{col} does not fit in {dtype}")
+        out[col] = values.astype(dtype)
+    return pa.table(out)
+
+
+class _MonthWriter(object):
+    """ Writes the days of one month into a single file, one row group per day """
+    def __init__(self, root, fname, schema):
+        object.__init__(self)
+        self.fname = fname
+        self.row_group = 0
+        self.offset = 0
+        self._writer = pq.ParquetWriter(root / fname, schema)
+
+    def write(self, table):
+        self._writer.write_table(table, row_group_size=max(table.num_rows, 1))
+        entry = {'file': self.fname, 'row_group': self.row_group,
+                 'offset': self.offset, 'rows': table.num_rows}
+        self.row_group += 1
+        self.offset += table.num_rows
+        return entry
+
+    def close(self):
+        self._writer.close()
+
+
+class TickStore(object):
+    def __init__(self, root):
+        """
+        Open an existing store, only the index is read
+        :param root: store directory
+        """
+        object.__init__(self)
+        self._root = Path(root)
+        with open(self._root / INDEX_FILE) as f:
+            meta = json.load(f)
+        self._price_dtype = meta['price_dtype']
+        self._size_dtype = meta['size_dtype']
+        self._dtypes = meta['dtypes'] or None
+        self._entries = meta['days']
+        self._days = pd.DatetimeIndex([e['day'] for e in self._entries])
+        self._files = {}
+
+    @classmethod
+    def create(cls, root, data, price_dtype='float64', size_dtype='int32'):
+        """
+        Write a new store
+        :param root: store directory, must not hold a store already
+        :param data: pd.DataFrame of ticks (see load_bars) or an iterable of them
+        :param price_dtype: dtype of price, bid and ask
+        :param size_dtype: dtype of size
+        :return: TickStore
+        """
+        root = Path(root)
+        if (root / INDEX_FILE).exists():
+            raise FileExistsError(f"tick store already exists: {root}")
+        root.mkdir(parents=True, exist_ok=True)
+        cls._write_index(root, {'price_dtype': price_dtype, 'size_dtype': size_dtype,
+                                'dtypes': {}, 'days': []})
+        store = cls(root)
+        store.append(data)
+        return store
+
+    @staticmethod
+    def _write_index(root, meta):
+        tmp = root / (INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp, root / INDEX_FILE)
+
+    def _init_dtypes(self, df):
+        dtypes = {}
+        for col in df.columns:
+            if col in DERIVED:
+                continue
+            if col in ('price', 'bid', 'ask'):
+                dtypes[col] = self._price_dtype
+            elif col == 'size':
+                dtypes[col] = self._size_dtype
+            else:
+                dtypes[col] = df[col].dtype.str
+        self._dtypes = dtypes
+
+    def append(self, data):
+        """
+        Append ticks strictly after the last stored day
+        :param data: pd.DataFrame of ticks or an iterable of them
+        """
+        if isinstance(data, pd.DataFrame):
+            data = [data]
+
+        writer, pending = None, None
+        try:
+            for chunk in data:
+                if chunk.shape[0] == 0:
+                    continue
+                if self._dtypes is None:
+                    self._init_dtypes(chunk)
+                if pending is not None:
+                    chunk = pd.concat([pending, chunk])
+                # the last day of a chunk may continue in the next chunk
+                days = chunk.index.normalize()
+                pending = chunk[days == days[-1]]
+                complete = chunk[days != days[-1]]
+                for day, group in complete.groupby(days[days != days[-1]], sort=False):
+                    writer = self._write_day(day, group, writer)
+            if pending is not None:
+                writer = self._write_day(pending.index[0].normalize(), pending, writer)
+        finally:
+            if writer is not None:
+                writer.close()
+            self._write_index(self._root, {'price_dtype': self._price_dtype, 'size_dtype': self._size_dtype,
+                                           'dtypes': self._dtypes or {}, 'days': self._entries})
+            self._days = pd.DatetimeIndex([e['day'] for e in self._entries])
+            self._files = {}
+
+    def _write_day(self, day, group, writer):
+        key = day.strftime('%Y-%m-%d')
+        if len(self._entries) > 0 and key <= self._entries[-1]['day']:
+            raise ValueError(f"day {key} is not after the last stored day {self._entries[-1]['day']}")
+        table = _compact(group, self._dtypes)
+        if writer is None or not writer.fname.startswith(key[:7] + '-'):
+            if writer is not None:
+                writer.close()
+            # appends never reopen a file, a month written twice gets a new file
+            n = sum(1 for e in self._entries if e['day'][:7] == key[:7] and e['row_group'] == 0)
+            writer = _MonthWriter(self._root, f"{key[:7]}-{n}.parquet", table.schema)
+        entry = writer.write(table)
+        entry['day'] = key
+        self._entries.append(entry)
+        return writer
+
+    @property
+    def root(self):
+        return self._root
+
+    @property
+    def days(self):
+        """ :return: pd.DatetimeIndex of stored days """
+        return self._days
+
+    @property
+    def columns(self):
+        """ :return: stored and derived columns """
+        return list(self._dtypes or {}) + DERIVED
+
+    def __len__(self):
+        return int(sum(e['rows'] for e in self._entries))
+
+    def locate(self, day):
+        """
+        :param day: date-like
+        :return: dict(file, row_group, offset, rows) of the day
+        """
+        pos = self._days.get_loc(pd.Timestamp(day).normalize())
+        return self._entries[pos]
+
+    def _file(self, fname):
+        if fname not in self._files:
+            self._files[fname] = pq.ParquetFile(self._root / fname)
+        return self._files[fname]
+
+    def read(self, start=None, end=None, columns=None):
+        """
+        Read the ticks of the days in [start, end]
+        :param start: first day, None=first stored day
+        :param end: last day (inclusive), None=last stored day
+        :param columns: subset of columns, None=all including v and dv
+        :return: pd.DataFrame indexed by timestamp
+        """
+        lo = 0 if start is None else self._days.searchsorted(pd.Timestamp(start).normalize())
+        hi = len(self._entries) if end is None else \
+            self._days.searchsorted(pd.Timestamp(end).normalize(), side='right')
+        cols = self.columns if columns is None else list(columns)
+        stored = [c for c in (self._dtypes or {}) if c in cols or
+                  (c in ('price', 'size') and any(d in cols for d in DERIVED))]
+
+        tables, groups = [], {}
+        for e in self._entries[lo:hi]:
+            groups.setdefault(e['file'], []).append(e['row_group'])
+        for fname, row_groups in groups.items():
+            tables.append(self._file(fname).read_row_groups(row_groups, columns=['dates'] + stored))
+        if len(tables) == 0:
+            schema = pa.schema([('dates', pa.timestamp('ns'))] +
+                               [(c, pa.from_numpy_dtype(np.dtype(self._dtypes[c]))) for c in stored])
+            tables.append(schema.empty_table())
+
+        df = pa.concat_tables(tables).to_pandas()
+        df = df.set_index(pd.DatetimeIndex(df.pop('dates'), name='dates'))
+        if 'v' in cols:
+            df['v'] = df['size']  # volume
+        if 'dv' in cols:
+            df['dv'] = df['price'] * df['size']  # dollar volume
+        return df[cols]
+
+    def read_day(self, day, columns=None):
+        """ :return: pd.DataFrame of a single day """
+        return self.read(day, day, columns)
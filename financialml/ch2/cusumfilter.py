@@ -3,8 +3,12 @@
 import numpy as np
 import pandas as pd
 import numbers
+from financialml.utils.jit import njit
+from financialml.utils.metrics import instrument
+from financialml.ch2.dailyvol import DailyVol
 
 
+@instrument('ch2.get_daily_vol')
 def get_daily_vol(close, span=100):
     """
     3.3. Set profit taking and stop-loss limits that are a function of risk
@@ -15,23 +19,78 @@ def get_daily_vol(close, span=100):
     3.4 Creates the lower(stop-loss limit) and upper(profit-taking limit) barrier in Triple Barrier Method
 
     :param close:
-    :param span: rolling window for moving average
-    :return: pd.Series positive values only
-    """
-    # sort data index for intra-day
-    use_idx = close.index.searchsorted(close.index - pd.Timedelta(days=1))
-    use_idx = use_idx[use_idx > 0]
+    :param span: rolling window for moving average, or list of spans computed in one pass
+    :return: pd.Series positive values only (pd.DataFrame, one column per span, for a list)
 
-    # Get rid of duplications in index
-    use_idx = np.unique(use_idx)
+    Use DailyVol directly to keep the estimate current as new bars arrive.
+    """
+    return DailyVol(span).update_batch(close)
 
-    # get % returns
-    prev_idx = pd.Series(close.index[use_idx - 1], index=close.index[use_idx])
-    ret = close.loc[prev_idx.index] / close.loc[prev_idx.values].values - 1
 
-    # weighted moving average
-    vol = ret.ewm(span=span).std()
-    return vol
+@njit(cache=True, nogil=True)
+def cusum_kernel(diff, h, neg_first=False):
+    """
+    Symmetric CUSUM over positional arrays
+    :param diff: np.ndarray float64 of increments
+    :param h: np.ndarray float64 of thresholds, aligned with diff
+    :param neg_first: test the negative sum before the positive one
+    :return: np.ndarray int64 positions of the events
+    """
+    idx = np.empty(diff.shape[0], dtype=np.int64)
+    sPos, sNeg, k = 0., 0., 0
+    for i in range(diff.shape[0]):
+        x = sPos + diff[i]
+        sPos = x if x > 0. else 0.
+        x = sNeg + diff[i]
+        sNeg = x if x < 0. else 0.
+        if neg_first:
+            if sNeg < -h[i]:
+                sNeg = 0.
+                idx[k] = i
+                k += 1
+            elif sPos > h[i]:
+                sPos = 0.
+                idx[k] = i
+                k += 1
+        else:
+            if sPos > h[i]:
+                sPos = 0.
+                idx[k] = i
+                k += 1
+            elif sNeg < -h[i]:
+                sNeg = 0.
+                idx[k] = i
+                k += 1
+    return idx[:k]
+
+
+@njit(cache=True, nogil=True)
+def cusum_batch_kernel(diff, h, multipliers):
+    """
+    cusum_kernel for several threshold multipliers in one pass over the data
+    :param diff: np.ndarray float64 of increments
+    :param h: np.ndarray float64 of thresholds, aligned with diff
+    :param multipliers: np.ndarray float64, threshold of run j is multipliers[j] * h
+    :return: np.ndarray bool (len(multipliers), len(diff)), True at the events of each run
+    """
+    nh = multipliers.shape[0]
+    events = np.zeros((nh, diff.shape[0]), dtype=np.bool_)
+    sPos = np.zeros(nh)
+    sNeg = np.zeros(nh)
+    for i in range(diff.shape[0]):
+        for j in range(nh):
+            hj = multipliers[j] * h[i]
+            x = sPos[j] + diff[i]
+            sPos[j] = x if x > 0. else 0.
+            x = sNeg[j] + diff[i]
+            sNeg[j] = x if x < 0. else 0.
+            if sPos[j] > hj:
+                sPos[j] = 0.
+                events[j, i] = True
+            elif sNeg[j] < -hj:
+                sNeg[j] = 0.
+                events[j, i] = True
+    return events
 
 
 def cusum_filter(gRaw, h):
@@ -47,20 +106,28 @@ def cusum_filter(gRaw, h):
     :param h: volatility
     :return: pd.DateTimeIndex
     """
-    tEvents, sPos, sNeg = [], 0, 0
     diff = gRaw.diff()
-    for i in diff.index[1:]:
-        sPos, sNeg = max(0, sPos, + diff.loc[i]), min(0, sNeg + diff.loc[i])
-        if sNeg < -h:
-            sNeg = 0
-            tEvents.append(i)
-        elif sPos > h:
-            sPos = 0
-            tEvents.append(i)
+    d = np.ascontiguousarray(diff.values[1:], dtype=np.float64)
+    h = np.full(d.shape[0], h, dtype=np.float64)
+    idx = cusum_kernel(d, h, True)
+    return pd.DatetimeIndex(diff.index[1:][idx])
+
+
+def _cusum_inputs(close, h):
+    # positional increments and thresholds of cusum_filter_close
+    ret = close.pct_change().dropna()
+    diff = ret.diff().dropna()
+
+    if isinstance(h, numbers.Number):
+        h = pd.Series(h, index=diff.index)
 
-    return pd.DataTimeIndex(tEvents)
+    h = h.reindex(diff.index, method='bfill')
+    h = h.dropna()
+    d = diff.values if h.shape[0] == diff.shape[0] else diff.loc[h.index].values
+    return h.index, np.ascontiguousarray(d, dtype=np.float64), np.ascontiguousarray(h.values, dtype=np.float64)
 
 
+@instrument('ch2.cusum_filter_close', rows=lambda out, close, *args, **kwds: len(close))
 def cusum_filter_close(close, h):
     """
     Modified cusum_filter using close
@@ -68,24 +135,56 @@ def cusum_filter_close(close, h):
     :param h: volatility
     :return: pd.DateTimeIndex
     """
-    tEvents, sPos, sNeg = [], 0, 0
-    ret = close.pct_change().dropna()
-    diff = ret.diff().dropna()
+    index, diff, h = _cusum_inputs(close, h)
+    idx = cusum_kernel(diff, h, False)
+    return pd.DatetimeIndex(index[idx])
 
-    if isinstance(h, numbers.Number):
-        h = pd.Series(h, index=diff.index)
 
-    h = h.reindex(diff.index, method='bfill')
-    h = h.dropna()
-
-    for t in h.index:
-        sPos = max(0, sPos + diff.loc[t])
-        sNeg = min(0, sNeg + diff.loc[t])
-        if sPos > h.loc[t]:
-            sPos = 0
-            tEvents.append(t)
-        elif sNeg < -h.loc[t]:
-            sNeg = 0
-            tEvents.append(t)
-
-    return pd.DatetimeIndex(tEvents)
+@instrument('ch2.cusum_filter_close_batch', rows=lambda out, close, *args, **kwds: len(close))
+def cusum_filter_close_batch(close, h, multipliers):
+    """
+    cusum_filter_close for several thresholds multipliers * h, in one pass
+    :param close:
+    :param h: volatility
+    :param multipliers: list of threshold multipliers
+    :return: dict multiplier -> pd.DateTimeIndex
+    """
+    index, diff, h = _cusum_inputs(close, h)
+    events = cusum_batch_kernel(diff, h, np.asarray(multipliers, dtype=np.float64))
+    return {k: pd.DatetimeIndex(index[events[j]]) for j, k in enumerate(multipliers)}
+
+
+class CusumFilter(object):
+    def __init__(self):
+        """
+        cusum_filter_close one bar at a time: the increments are the changes
+        of the bar returns, the threshold is given with every bar
+        """
+        object.__init__(self)
+        self._price = np.nan
+        self._ret = np.nan
+        self._sPos, self._sNeg = 0., 0.
+
+    def update(self, price, h):
+        """
+        Add the next bar
+        :param price: close
+        :param h: threshold, NaN skips the bar like a missing volatility in cusum_filter_close
+        :return: True when the bar is an event
+        """
+        ret = price / self._price - 1.
+        diff = ret - self._ret
+        self._price, self._ret = price, ret
+        if np.isnan(diff) or np.isnan(h):
+            return False
+        x = self._sPos + diff
+        self._sPos = x if x > 0. else 0.
+        x = self._sNeg + diff
+        self._sNeg = x if x < 0. else 0.
+        if self._sPos > h:
+            self._sPos = 0.
+            return True
+        elif self._sNeg < -h:
+            self._sNeg = 0.
+            return True
+        return False
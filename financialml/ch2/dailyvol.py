@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Online daily volatility, the streaming form of get_daily_vol.
+
+For every bar t, get_daily_vol takes the first bar j at or after t - 1 day
+and the return of j over its previous bar; the returns (one per distinct j)
+go through ewm(span).std(). j only moves forward with t, so the lookup is a
+pointer into the bars of the last day and every new bar costs O(1) amortized.
+The EWM standard deviation follows the pandas recurrence (adjust=True,
+bias=False) and keeps one state row per span.
+"""
+import numpy as np
+import pandas as pd
+from financialml.utils.jit import njit
+
+# nobs, mean, cov, sum of weights, sum of squared weights, weight of the mean
+STATE_SIZE = 6
+
+
+@njit(cache=True, nogil=True)
+def ewm_std_kernel(x, alphas, state):
+    """
+    :param x: np.ndarray float64 observations, NaN=missing
+    :param alphas: np.ndarray float64 smoothing factor of each span
+    :param state: np.ndarray float64 (len(alphas), STATE_SIZE), updated in place
+    :return: np.ndarray float64 (len(x), len(alphas)) standard deviations
+    """
+    out = np.full((x.shape[0], alphas.shape[0]), np.nan)
+    for k in range(alphas.shape[0]):
+        f = 1. - alphas[k]
+        nobs, mean, cov, sw, sw2, ow = state[k, 0], state[k, 1], state[k, 2], state[k, 3], state[k, 4], state[k, 5]
+        for i in range(x.shape[0]):
+            cur = x[i]
+            is_obs = cur == cur
+            if nobs > 0:
+                # weights decay on missing observations too (ignore_na=False)
+                sw *= f
+                sw2 *= f * f
+                ow *= f
+                if is_obs:
+                    old_mean = mean
+                    if mean != cur:
+                        mean = (ow * old_mean + cur) / (ow + 1.)
+                    cov = (ow * (cov + (old_mean - mean) * (old_mean - mean)) + (cur - mean) * (cur - mean)) / (ow + 1.)
+                    sw += 1.
+                    sw2 += 1.
+                    ow += 1.
+                    nobs += 1
+            elif is_obs:
+                nobs, mean, cov, sw, sw2, ow = 1., cur, 0., 1., 1., 1.
+            if nobs > 0:
+                num = sw * sw
+                den = num - sw2
+                if den > 0:
+                    var = num / den * cov
+                    out[i, k] = np.sqrt(var) if var > 0 else 0.
+        state[k, 0], state[k, 1], state[k, 2], state[k, 3], state[k, 4], state[k, 5] = nobs, mean, cov, sw, sw2, ow
+    return out
+
+
+class DailyVol(object):
+    def __init__(self, span=100, lag=pd.Timedelta(days=1)):
+        """
+        :param span: EWM span, or list of spans computed in one pass
+        :param lag: look back of the returns
+        """
+        object.__init__(self)
+        self.spans = list(span) if np.ndim(span) else [span]
+        self._scalar = not np.ndim(span)
+        self._alphas = np.array([2. / (s + 1.) for s in self.spans], dtype=np.float64)
+        self._state = np.zeros((len(self.spans), STATE_SIZE), dtype=np.float64)
+        self._lag = pd.Timedelta(lag).value
+        # bars from position _base on, enough to look up j - 1
+        self._times, self._prices, self._base = [], [], 0
+        self._n = 0     # bars seen
+        self._j = 0     # first bar at or after t - lag of the last bar
+        self._last = 0  # last j a return was taken at
+        self.timestamp = None
+        self.value = np.full(len(self.spans), np.nan)
+
+    def _out(self, vol):
+        return vol[0] if self._scalar else pd.Series(vol, index=self.spans)
+
+    @property
+    def vol(self):
+        """ :return: latest volatility, float (Series per span for a list of spans) """
+        return self._out(self.value)
+
+    def _trim(self):
+        # keep bars from j - 1 on
+        drop = self._j - 1 - self._base
+        if drop > 1024 and drop * 2 > len(self._times):
+            del self._times[:drop], self._prices[:drop]
+            self._base += drop
+
+    def update(self, timestamp, price):
+        """
+        Add the next bar, O(1) amortized
+        :param timestamp: bar time, not before the previous bar
+        :param price: close
+        :return: volatility when the bar produced a new return, otherwise None
+        """
+        t = pd.Timestamp(timestamp).value
+        self._times.append(t)
+        self._prices.append(float(price))
+        self._n += 1
+        while self._times[self._j - self._base] < t - self._lag:
+            self._j += 1
+        j = self._j
+        if j <= self._last or j == 0:
+            return None
+        self._last = j
+        ret = self._prices[j - self._base] / self._prices[j - 1 - self._base] - 1.
+        self.value = ewm_std_kernel(np.array([ret]), self._alphas, self._state)[0]
+        self.timestamp = pd.Timestamp(self._times[j - self._base], tz=pd.Timestamp(timestamp).tz)
+        self._trim()
+        return self.vol
+
+    def update_batch(self, close):
+        """
+        Add many bars at once
+        :param close: pd.Series with a sorted DatetimeIndex
+        :return: pd.Series of the new volatilities indexed by return time
+            (pd.DataFrame, one column per span, for a list of spans)
+        """
+        n = close.shape[0]
+        new_times = close.index.as_unit('ns').asi8
+        times = np.concatenate([np.asarray(self._times, dtype=np.int64), new_times])
+        prices = np.concatenate([np.asarray(self._prices, dtype=np.float64),
+                                 np.asarray(close.values, dtype=np.float64)])
+        offset = len(self._times)
+        # j of every new bar, absolute positions
+        j = np.searchsorted(times, new_times - self._lag) + self._base
+        j = np.maximum(j, self._j)
+        # j is sorted, distinct values without np.unique
+        use = j[(j > self._last) & (j > 0)]
+        use = use[np.r_[True, use[1:] != use[:-1]]] if use.shape[0] > 0 else use
+        ret = prices[use - self._base] / prices[use - 1 - self._base] - 1.
+        vol = ewm_std_kernel(ret, self._alphas, self._state)
+
+        # a return can be taken at a bar of an earlier batch
+        index = pd.DatetimeIndex(times[use - self._base], name=close.index.name)
+        if close.index.tz is not None:
+            index = index.tz_localize('UTC').tz_convert(close.index.tz)
+        index = index.as_unit(close.index.unit)
+        if n > 0:
+            self._j = int(j[-1])
+        if use.shape[0] > 0:
+            self._last = int(use[-1])
+            self.value = vol[-1]
+            self.timestamp = index[-1]
+        # keep bars from j - 1 on
+        base = max(self._j - 1, self._base)
+        self._times = times[base - self._base:].tolist()
+        self._prices = prices[base - self._base:].tolist()
+        self._base = base
+        self._n += n
+
+        if self._scalar:
+            return pd.Series(vol[:, 0], index=index)
+        return pd.DataFrame(vol, index=index, columns=self.spans)
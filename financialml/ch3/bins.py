@@ -2,8 +2,47 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import pandas as pd
+from financialml.utils.metrics import instrument
 
 
+def _bfill_prices(close, times):
+    """
+    close.reindex(times, method='bfill') by position: first price at or after each time
+    :param close: pd.Series with a sorted index
+    :param times: array-like of timestamps
+    :return: np.ndarray float64, NaN after the last close
+    """
+    pos = close.index.searchsorted(times)
+    values = np.asarray(close.values, dtype=np.float64)
+    px = np.full(pos.shape[0], np.nan)
+    ok = pos < values.shape[0]
+    px[ok] = values[pos[ok]]
+    return px
+
+
+def _times(events):
+    # start times then end times of events
+    return events.index.append(pd.DatetimeIndex(events['t1']))
+
+
+def _label(events, ret, metalabel):
+    # ret/bin frame of events from the realized returns
+    if metalabel and 'side' in events:
+        ret = ret * events['side'].values
+    bin_ = np.sign(ret)
+    if metalabel and 'side' in events:
+        bin_[ret <= 0] = 0
+    return pd.DataFrame({'ret': ret, 'bin': bin_}, index=events.index)
+
+
+def _get_bins(events, close, metalabel):
+    events = events.dropna(subset=['t1'])
+    px = _bfill_prices(close, _times(events))
+    n = events.shape[0]
+    return _label(events, px[n:] / px[:n] - 1., metalabel)
+
+
+@instrument('ch3.get_bins')
 def get_bins(events, close):
     """
     Construct labels
@@ -15,19 +54,10 @@ def get_bins(events, close):
         out['ret']: realized return
         out['bin']: sign of return
     """
-    # Prices aligned with events
-    events = events.dropna(subset=['t1'])
-    px = events.index.union(events['t1'].values).drop_duplicates()
-    px = close.reindex(px, method='bfill')
-
-    # Create output object
-    out = pd.DataFrame(index=events.index)
-    out['ret'] = px.loc[events['t1'].values].values / px.loc[events.index] - 1.
-    out['bin'] = np.sign(out['ret'])
-
-    return out
+    return _get_bins(events, close, False)
 
 
+@instrument('ch3.get_bins_w_metalabel')
 def get_bins_w_metalabel(events, close):
     """
     Construct labels
@@ -43,21 +73,26 @@ def get_bins_w_metalabel(events, close):
         out['ret']: realized return
         out['bin']: (see above)
     """
-    # Prices aligned with events
-    events = events.dropna(subset=['t1'])
-    px = events.index.union(events['t1'].values).drop_duplicates()
-    px = close.reindex(px, method='bfill')
+    return _get_bins(events, close, True)
 
-    # Create output object
-    out = pd.DataFrame(index=events.index)
-    out['ret'] = px.loc[events['t1'].values].values / px.loc[events.index] - 1.
 
-    if 'side' in events:
-        out['ret'] *= events['side']
-
-    out['bin'] = np.sign(out['ret'])
-
-    if 'side' in events:
-        out.loc[out['ret'] <= 0, 'bin'] = 0
+@instrument('ch3.get_bins_batch', rows=lambda out, events, *args, **kwds: sum(len(e) for e in events.values()))
+def get_bins_batch(events, close, metalabel=False):
+    """
+    get_bins (get_bins_w_metalabel) of many events frames, e.g. one per ptsl
+    configuration, with a single price lookup
+    :param events: dict key -> events frame
+    :param close:
+    :param metalabel: label like get_bins_w_metalabel
+    :return: dict key -> out frame
+    """
+    events = {k: e.dropna(subset=['t1']) for k, e in events.items()}
+    times = [_times(e) for e in events.values()]
+    bounds = np.cumsum([0] + [t.shape[0] for t in times])
+    px = _bfill_prices(close, times[0].append(times[1:])) if times else np.empty(0)
 
+    out = {}
+    for (k, e), start in zip(events.items(), bounds[:-1]):
+        n = e.shape[0]
+        out[k] = _label(e, px[start + n:start + 2 * n] / px[start:start + n] - 1., metalabel)
     return out
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+First passage search for the horizontal barriers of the Triple Barrier Method.
+
+Over a window [t0, t1] the barrier test of apply_ptslt1 is
+    (p / p0 - 1) * side < sl        stop-loss
+    (p / p0 - 1) * side > pt        profit-taking
+The return is monotone in p, so a window holds a touch iff its min (or max)
+price does. Range min/max come from a segment tree and the first touch is
+found by descending the tree, O(log n) per event instead of a scan of the
+holding window.
+"""
+import numpy as np
+from financialml.utils.jit import njit
+
+
+@njit(cache=True, nogil=True)
+def build_tree(prices):
+    """
+    :param prices: np.ndarray float64
+    :return: (min tree, max tree, number of leaves) NaN prices are ignored
+    """
+    n = prices.shape[0]
+    size = 1
+    while size < max(n, 1):
+        size *= 2
+    tmin = np.full(2 * size, np.inf)
+    tmax = np.full(2 * size, -np.inf)
+    for i in range(n):
+        if not np.isnan(prices[i]):
+            tmin[size + i] = prices[i]
+            tmax[size + i] = prices[i]
+    for i in range(size - 1, 0, -1):
+        tmin[i] = min(tmin[2 * i], tmin[2 * i + 1])
+        tmax[i] = max(tmax[2 * i], tmax[2 * i + 1])
+    return tmin, tmax, size
+
+
+@njit(cache=True, nogil=True)
+def _hit(tmin, tmax, node, p0, side, thr, below, use_min):
+    # barrier test on the node aggregate, evaluated exactly as apply_ptslt1 does
+    agg = tmin[node] if use_min else tmax[node]
+    if np.isinf(agg):
+        return False
+    r = (agg / p0 - 1.) * side
+    return r < thr if below else r > thr
+
+
+@njit(cache=True, nogil=True)
+def _first(tmin, tmax, size, a, b, p0, side, thr, below, use_min):
+    # first position in [a, b) whose price touches the barrier, -1 if none
+    if a >= b:
+        return -1
+    stack = np.empty(64, dtype=np.int64)
+    top = 0
+    node = -1
+    l, r = a + size, b + size
+    while l < r:
+        if l & 1:
+            if _hit(tmin, tmax, l, p0, side, thr, below, use_min):
+                node = l
+                break
+            l += 1
+        if r & 1:
+            r -= 1
+            stack[top] = r
+            top += 1
+        l >>= 1
+        r >>= 1
+    if node < 0:
+        # nodes on the right edge, leftmost first
+        for k in range(top - 1, -1, -1):
+            if _hit(tmin, tmax, stack[k], p0, side, thr, below, use_min):
+                node = stack[k]
+                break
+    if node < 0:
+        return -1
+    while node < size:
+        node = 2 * node if _hit(tmin, tmax, 2 * node, p0, side, thr, below, use_min) else 2 * node + 1
+    return node - size
+
+
+@njit(cache=True, nogil=True)
+def first_touch_kernel(tmin, tmax, size, starts, ends, p0, side, sl, pt):
+    """
+    :param tmin, tmax, size: from build_tree
+    :param starts: np.ndarray int64 first position of each window
+    :param ends: np.ndarray int64 one past the last position of each window
+    :param p0: np.ndarray float64 base price of each event
+    :param side: np.ndarray float64
+    :param sl: np.ndarray float64 stop-loss return (negative), NaN=disabled
+    :param pt: np.ndarray float64 profit-taking return, NaN=disabled
+    :return: (first stop-loss position, first profit-taking position) -1 if untouched
+    """
+    n = starts.shape[0]
+    out_sl = np.full(n, -1, dtype=np.int64)
+    out_pt = np.full(n, -1, dtype=np.int64)
+    for i in range(n):
+        # (p / p0 - 1) * side is increasing in p when p0 and side have the same sign
+        increasing = (p0[i] > 0) == (side[i] >= 0)
+        out_sl[i] = _first(tmin, tmax, size, starts[i], ends[i], p0[i], side[i], sl[i], True, increasing)
+        out_pt[i] = _first(tmin, tmax, size, starts[i], ends[i], p0[i], side[i], pt[i], False, not increasing)
+    return out_sl, out_pt
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Triple barrier parameter sweep.
+
+Labeling one configuration is get_daily_vol -> cusum_filter_close -> get_t1
+-> get_events -> get_bins. Across a grid most of that work is shared:
+    - the volatility of every span comes from one DailyVol pass
+    - the CUSUM events depend on the span only, the vertical barriers on
+      (span, numDays) only
+    - the price path of every event is the same whatever the barriers, so
+      the min/max segment tree of first_touch_kernel is built once over the
+      whole close series and every ptsl configuration is a tree search
+    - minRet only drops events, the touches of the remaining ones are reused
+Configurations (one per ptsl of every (span, numDays) event set) are spread
+over mp_pandas_obj workers, weighted by their number of events. The event
+sets are concatenated into flat arrays published once with the close
+prices and the tree (shared=True), a configuration only carries the range
+of its event set.
+"""
+import itertools
+import numpy as np
+import pandas as pd
+from financialml.ch2.cusumfilter import get_daily_vol, cusum_filter_close
+from financialml.ch3.firsttouch import build_tree, first_touch_kernel
+from financialml.utils.mp import mp_pandas_obj
+
+COLUMNS = ['span', 'numDays', 'pt', 'sl', 'minRet', 'events', 'labeled', 'bin_neg', 'bin_zero', 'bin_pos',
+           'ret_mean', 'ret_std', 'pt_hits', 'sl_hits', 't1_hits']
+
+
+def _event_sets(close, spans, numDays):
+    """
+    Events of every (span, numDays), concatenated
+    :return: (dict (span, numDays) -> (start, stop) range of its events,
+        positions of the events, their vertical barrier (-1=none), their target)
+    """
+    vols = get_daily_vol(close, list(spans))
+    ranges, locs, vposs, trgts = {}, [], [], []
+    start = 0
+    for span in spans:
+        vol = vols[span]
+        tEvents = cusum_filter_close(close, vol)
+        loc = close.index.get_indexer(tEvents)
+        trgt = vol.reindex(tEvents).values
+        for days in numDays:
+            vpos = close.index.searchsorted(tEvents + pd.Timedelta(days=days))
+            vpos[vpos >= close.shape[0]] = -1
+            ranges[(span, days)] = (start, start + loc.shape[0])
+            start += loc.shape[0]
+            locs.append(loc)
+            vposs.append(vpos)
+            trgts.append(trgt)
+    return (ranges, np.concatenate(locs).astype(np.int64), np.concatenate(vposs).astype(np.int64),
+            np.concatenate(trgts).astype(np.float64))
+
+
+def _label_stats(span, days, ptsl, minRet, prices, loc, touch, trgt, sl_pos, pt_pos, vpos):
+    # one results row, events kept by minRet
+    keep = trgt > minRet
+    touch, loc = touch[keep], loc[keep]
+    labeled = touch >= 0
+    ret = prices[touch[labeled]] / prices[loc[labeled]] - 1.
+    bins = np.sign(ret)
+    return [span, days, ptsl[0], ptsl[1], minRet, int(keep.sum()), int(labeled.sum()),
+            int((bins < 0).sum()), int((bins == 0).sum()), int((bins > 0).sum()),
+            ret.mean() if ret.shape[0] > 0 else np.nan, ret.std(ddof=1) if ret.shape[0] > 1 else np.nan,
+            int((touch[labeled] == pt_pos[keep][labeled]).sum()),
+            int((touch[labeled] == sl_pos[keep][labeled]).sum()),
+            int((touch[labeled] == vpos[keep][labeled]).sum())]
+
+
+def _grid_molecule(molecule, tasks, minRets, prices, tmin, tmax, size, loc, vpos, trgt):
+    """
+    :param molecule: task numbers
+    :param tasks: list of (span, numDays, ptsl, start, stop), the events of a
+        task are loc, vpos, trgt[start:stop]
+    :param loc, vpos, trgt: events of every task, see _event_sets
+    :return: pd.DataFrame results rows indexed by task * len(minRets) + minRet number
+    """
+    rows, index = [], []
+    events = loc, vpos, trgt
+    for i in molecule:
+        span, days, ptsl, start, stop = tasks[i]
+        loc, vpos, trgt = (a[start:stop] for a in events)
+        # barriers of get_events with the smallest minRet, larger ones only drop events
+        valid = trgt > min(minRets)
+        loc_, vpos_, trgt_ = loc[valid], vpos[valid], trgt[valid]
+        ends = np.where(vpos_ >= 0, vpos_ + 1, prices.shape[0])
+        pt = ptsl[0] * trgt_ if ptsl[0] > 0 else np.full(trgt_.shape[0], np.nan)
+        sl = -ptsl[1] * trgt_ if ptsl[1] > 0 else np.full(trgt_.shape[0], np.nan)
+        sl_pos, pt_pos = first_touch_kernel(tmin, tmax, size, loc_, ends.astype(np.int64), prices[loc_],
+                                            np.ones(trgt_.shape[0]), sl, pt)
+        # first of stop-loss, profit-taking and vertical barrier, -1=none
+        first = np.stack([sl_pos, pt_pos, vpos_])
+        touch = np.where(first >= 0, first, np.iinfo(np.int64).max).min(axis=0)
+        touch[touch == np.iinfo(np.int64).max] = -1
+        for k, minRet in enumerate(minRets):
+            rows.append(_label_stats(span, days, ptsl, minRet, prices, loc_, touch, trgt_, sl_pos, pt_pos, vpos_))
+            index.append(i * len(minRets) + k)
+    return pd.DataFrame(rows, index=index, columns=COLUMNS)
+
+
+def triple_barrier_grid(close, spans=(100,), ptsls=((1, 1),), numDays=(1,), minRets=(0.,), numThreads=1,
+                        backend='process'):
+    """
+    Label counts and return statistics of every barrier configuration, the
+    same labels as get_events (side=1) followed by get_bins
+    :param close: pd.Series with a sorted DatetimeIndex
+    :param spans: get_daily_vol spans, the volatility is the CUSUM threshold and the target
+    :param ptsls: list of [profit-taking, stop-loss] widths, 0=disabled
+    :param numDays: get_t1 vertical barriers
+    :param minRets: get_events minimum targets
+    :param numThreads: number of configurations labeled in parallel
+    :param backend: 'process' or 'thread' workers when numThreads > 1
+    :return: pd.DataFrame one row per (span, numDays, ptsl, minRet)
+        events: events kept, labeled: events with a label
+        bin_neg, bin_zero, bin_pos: label counts
+        ret_mean, ret_std: realized returns
+        pt_hits, sl_hits, t1_hits: labels set by each barrier (ties count for each)
+    """
+    minRets = list(minRets)
+    ranges, loc, vpos, trgt = _event_sets(close, spans, numDays)
+    tasks = [(span, days, list(ptsl)) + ranges[(span, days)]
+             for (span, days), ptsl in itertools.product(itertools.product(spans, numDays), ptsls)]
+    prices = np.ascontiguousarray(close.values, dtype=np.float64)
+    tmin, tmax, size = build_tree(prices)
+
+    kwargs = dict(tasks=tasks, minRets=minRets, prices=prices, tmin=tmin, tmax=tmax, size=size,
+                  loc=loc, vpos=vpos, trgt=trgt)
+    if numThreads == 1:
+        out = _grid_molecule(range(len(tasks)), **kwargs)
+    else:
+        out = mp_pandas_obj(_grid_molecule, ('molecule', pd.RangeIndex(len(tasks))), numThreads,
+                            backend=backend, shared=True, weights=[1 + t[4] - t[3] for t in tasks], **kwargs)
+    return out.sort_index().reset_index(drop=True)
@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Live labeling on asyncio: tick stream -> bars -> CUSUM -> triple barrier labels.
+
+    source (async iterable of (timestamp, price, size), e.g. FileReplaySource)
+      -> bounded queue
+      -> BarBuilder -> DailyVol -> CusumFilter -> BarrierBook -> on_label
+
+Every tick costs O(1) up to the bar close. A closed bar updates the
+volatility and the CUSUM sums in O(1), and the open events in O(log n) per
+event it resolves: the barrier of every event is turned into the exact price
+level at which the test of apply_ptslt1 flips, and the levels and vertical
+barriers are kept in heaps. A label is emitted while its resolving tick is
+processed.
+
+The live path is causal: the threshold and target of a bar are the latest
+DailyVol estimate. get_daily_vol stamps an estimate with the time its
+return starts and cusum_filter_close backfills it, the batch events use
+volatility known up to a day later.
+
+Backpressure: the source waits while the queue is full. stats reports the
+queue high water mark, the time the source spent blocked and the tick
+latency (queued to processed) and processing time, also sent to the metrics callbacks as
+progress events of 'ch3.live'.
+"""
+import asyncio
+import heapq
+import time
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from financialml.ch1.builder import BarBuilder
+from financialml.ch1.loader import iter_bars
+from financialml.ch2.cusumfilter import CusumFilter
+from financialml.ch2.dailyvol import DailyVol
+from financialml.utils import metrics
+
+Label = namedtuple('Label', ['t0', 't1', 'trgt', 'side', 'ret', 'bin', 'barrier'])
+LABEL_COLUMNS = ['t1', 'trgt', 'side', 'ret', 'bin']
+
+
+class FileReplaySource(object):
+    def __init__(self, path, speed=None, chunksize=100000):
+        """
+        Ticks of a tick file as an async stream, a stand-in for a feed
+        :param path: tick file (see load_bars)
+        :param speed: None replays as fast as the consumer takes the ticks,
+            otherwise market time runs speed times faster than wall time
+        :param chunksize: rows read at a time, in a thread
+        """
+        object.__init__(self)
+        self.path, self.speed, self.chunksize = path, speed, chunksize
+
+    async def __aiter__(self):
+        chunks = iter_bars(self.path, self.chunksize)
+        start = wall = None
+        while True:
+            df = await asyncio.to_thread(next, chunks, None)
+            if df is None:
+                return
+            for t, price, size in zip(df.index, df['price'].values, df['size'].values):
+                if self.speed is not None:
+                    if start is None:
+                        start, wall = t, time.perf_counter()
+                    delay = (t - start).total_seconds() / self.speed - (time.perf_counter() - wall)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                yield t, price, size
+
+
+def _touch_price(p0, thr, above):
+    """
+    Price level of a horizontal barrier: the smallest p with p / p0 - 1 > thr
+    (above) or the largest p with p / p0 - 1 < thr, the test of apply_ptslt1
+    is monotone in p so a few ulps around p0 * (1 + thr) settle it exactly
+    """
+    p = p0 * (1. + thr)
+    if above:
+        while p / p0 - 1. > thr:
+            p = np.nextafter(p, -np.inf)
+        while not p / p0 - 1. > thr:
+            p = np.nextafter(p, np.inf)
+    else:
+        while p / p0 - 1. < thr:
+            p = np.nextafter(p, np.inf)
+        while not p / p0 - 1. < thr:
+            p = np.nextafter(p, -np.inf)
+    return p
+
+
+class BarrierBook(object):
+    def __init__(self, ptsl=(1, 1), numDays=1, minRet=0.):
+        """
+        Open triple barrier events (side=1) resolved bar by bar, the labels
+        of get_events followed by get_bins_w_metalabel
+        :param ptsl: profit-taking and stop-loss widths in units of the target, 0=disabled
+        :param numDays: vertical barrier, the first bar at or after t0 + numDays
+        :param minRet: events with a target at or below minRet are not opened
+        """
+        object.__init__(self)
+        self.ptsl, self.minRet = list(ptsl), minRet
+        self._lifetime = pd.Timedelta(days=numDays).value
+        self._open = {}         # id -> (t0, p0, trgt)
+        self._pt, self._sl, self._t1 = [], [], []
+        self._id = 0
+
+    def __len__(self):
+        return len(self._open)
+
+    def open(self, t0, p0, trgt):
+        """ :return: True when an event was opened at the bar (t0, p0) """
+        if not trgt > self.minRet:
+            return False
+        i = self._id
+        self._id += 1
+        self._open[i] = (t0, p0, trgt)
+        if self.ptsl[0] > 0:
+            heapq.heappush(self._pt, (_touch_price(p0, self.ptsl[0] * trgt, True), i))
+        if self.ptsl[1] > 0:
+            heapq.heappush(self._sl, (-_touch_price(p0, -self.ptsl[1] * trgt, False), i))
+        heapq.heappush(self._t1, (pd.Timestamp(t0).value + self._lifetime, i))
+        return True
+
+    def _resolve(self, i, t, price, barrier, out):
+        if i not in self._open:
+            return  # already resolved by another barrier
+        t0, p0, trgt = self._open.pop(i)
+        ret = price / p0 - 1.
+        out.append(Label(t0, t, trgt, 1., ret, 1. if ret > 0 else 0., barrier))
+
+    def update(self, t, price):
+        """
+        Resolve the events touched by the bar (t, price)
+        :return: list of Label
+        """
+        out = []
+        while self._pt and self._pt[0][0] <= price:
+            self._resolve(heapq.heappop(self._pt)[1], t, price, 'pt', out)
+        while self._sl and -self._sl[0][0] >= price:
+            self._resolve(heapq.heappop(self._sl)[1], t, price, 'sl', out)
+        tn = pd.Timestamp(t).value
+        while self._t1 and self._t1[0][0] <= tn:
+            self._resolve(heapq.heappop(self._t1)[1], t, price, 't1', out)
+        # entries of resolved events are dropped lazily, compact when they dominate
+        for heap in (self._pt, self._sl):
+            if len(heap) > 2 * len(self._open) + 64:
+                heap[:] = [x for x in heap if x[1] in self._open]
+                heapq.heapify(heap)
+        return out
+
+
+class LivePipeline(object):
+    def __init__(self, bar_type='dollar', m=1e6, span=100, numDays=1, ptsl=(1, 1), minRet=0., maxQueue=10000,
+                 on_label=None, reportEvery=1000):
+        """
+        :param bar_type: 'tick', 'volume' or 'dollar'
+        :param m: bar threshold
+        :param span: DailyVol span
+        :param numDays: vertical barrier
+        :param ptsl: barrier widths
+        :param minRet: minimum target
+        :param maxQueue: ticks buffered between the source and the pipeline
+        :param on_label: called with every Label as it is resolved
+        :param reportEvery: bars between two progress events
+        """
+        object.__init__(self)
+        self.builder = BarBuilder(bar_type, m)
+        self.vol = DailyVol(span)
+        self.cusum = CusumFilter()
+        self.book = BarrierBook(ptsl, numDays, minRet)
+        self.maxQueue, self.on_label, self.reportEvery = maxQueue, on_label, reportEvery
+        self.labels = []
+        self._stats = dict(ticks=0, bars=0, events=0, labels=0, queue_max=0, blocked_seconds=0.,
+                           latency_max=0., latency_sum=0., process_max=0.)
+
+    @property
+    def stats(self):
+        """ :return: dict of counters, queue and latency statistics (seconds) """
+        out = dict(self._stats, open=len(self.book))
+        latency_sum = out.pop('latency_sum')
+        out['latency_mean'] = latency_sum / out['ticks'] if out['ticks'] > 0 else np.nan
+        return out
+
+    def on_tick(self, t, price, size):
+        """ Process one tick, :return: list of the Labels it resolved """
+        self._stats['ticks'] += 1
+        bar = self.builder.update(t, price, size)
+        return [] if bar is None else self.on_bar(bar.end, bar.close)
+
+    def on_bar(self, t, price):
+        """ Process one bar close, :return: list of the Labels it resolved """
+        self._stats['bars'] += 1
+        self.vol.update(t, price)
+        h = self.vol.value[0]
+        labels = self.book.update(t, price)
+        if self.cusum.update(price, h) and self.book.open(t, price, h):
+            self._stats['events'] += 1
+        for label in labels:
+            self.labels.append(label)
+            if self.on_label is not None:
+                self.on_label(label)
+        self._stats['labels'] += len(labels)
+        if self._stats['bars'] % self.reportEvery == 0:
+            metrics.emit('progress', 'ch3.live', None, self._stats['ticks'], **self.stats)
+        return labels
+
+    async def _produce(self, source, queue):
+        # ends the stream with None, or with the exception of the source
+        try:
+            async for tick in source:
+                if queue.full():
+                    time0 = time.perf_counter()
+                    await queue.put((tick, time.perf_counter()))
+                    self._stats['blocked_seconds'] += time.perf_counter() - time0
+                else:
+                    queue.put_nowait((tick, time.perf_counter()))
+                self._stats['queue_max'] = max(self._stats['queue_max'], queue.qsize())
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    async def run(self, source):
+        """
+        Consume a tick stream until it ends
+        :param source: async iterable of (timestamp, price, size)
+        :return: pd.DataFrame of the labels
+        """
+        queue = asyncio.Queue(self.maxQueue)
+        time0 = time.perf_counter()
+        with metrics.MemoryPeak() as peak:
+            producer = asyncio.create_task(self._produce(source, queue))
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    (t, price, size), queued = item
+                    start = time.perf_counter()
+                    self.on_tick(t, price, size)
+                    done = time.perf_counter()
+                    latency = done - queued
+                    self._stats['process_max'] = max(self._stats['process_max'], done - start)
+                    self._stats['latency_sum'] += latency
+                    self._stats['latency_max'] = max(self._stats['latency_max'], latency)
+                await producer
+            finally:
+                if not producer.done():
+                    producer.cancel()
+        metrics.emit('stage', 'ch3.live', time.perf_counter() - time0, self._stats['ticks'], peak.memory,
+                     **self.stats)
+        return self.to_frame()
+
+    def to_frame(self):
+        """ :return: pd.DataFrame of the labels indexed by t0, the layout of label_symbol """
+        df = pd.DataFrame(self.labels, columns=Label._fields)
+        df = df.set_index(pd.DatetimeIndex(df.pop('t0'), name=None)).sort_index(kind='stable')
+        return df[LABEL_COLUMNS]
@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Nightly labeling of a universe of symbols.
+
+Every symbol goes through
+    bars -> get_daily_vol -> cusum_filter_close -> get_t1
+         -> get_events_w_metalabel -> get_bins_w_metalabel
+in one worker, symbols are labeled in parallel and the stages of a symbol
+run sequentially. The process backend runs on a concurrent.futures process
+pool rather than the session executors (see utils.executor): a worker killed
+while labeling (e.g. out of memory) fails the symbols in flight with
+BrokenProcessPool instead of blocking the run forever, they are recorded as
+failed and a fresh pool carries on with the others.
+
+    root/
+        _manifest.json      symbol -> status, checkpoint key, events, seconds, error
+        IVE.parquet         labels of one symbol
+        SPY.parquet
+
+Memory: at most maxInFlight symbols are handed to the workers at a time,
+sources given as paths or TickStores are read by the worker, and labels go
+to disk from the worker, the caller only keeps one summary row per symbol.
+Failures: an exception labeling a symbol is recorded in the manifest with
+its traceback, the other symbols carry on.
+Resuming: a symbol is skipped when its checkpoint was written with the same
+key, a hash of the parameters and of the source content (file sizes and
+modification times for paths and stores), so a rerun after an interruption
+or a failure only labels what is missing or changed.
+Side: process workers receive the parameters pickled, so side is either a
+name of SIDES or a function defined at module level. Functions are hashed by
+their qualified name, lambdas and local functions have no stable one: the
+symbols are then labeled again on every run.
+"""
+import importlib
+import json
+import os
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+import pandas as pd
+from financialml.ch1.loader import load_bars, CHUNK_SIZE
+from financialml.ch1.sampling import sample_bars_idx
+from financialml.ch1.ticks import take_bars
+from financialml.ch1.tickstore import TickStore
+from financialml.ch2.cusumfilter import get_daily_vol, cusum_filter_close
+from financialml.ch3.triplebarrier import get_t1, get_events_w_metalabel
+from financialml.ch3.bins import get_bins_w_metalabel
+from financialml.utils.cache import hash_args
+from financialml.utils.executor import Executor, BACKENDS
+from financialml.utils import metrics
+
+MANIFEST_FILE = '_manifest.json'
+BAR_COLUMNS = {'tick': None, 'volume': 'v', 'dollar': 'dv'}
+# side names -> (module, function), imported by the worker (talib is only needed by macd)
+SIDES = {'macd': ('financialml.ch3.utils', 'macd_side')}
+
+
+def get_bar_close(source, bar_type='dollar', m=None, price_col='price'):
+    """
+    Close series of the bars of a symbol
+    :param source: pd.Series of closes (used as is), tick file, TickStore, tick frame or TickFrame
+    :param bar_type: 'tick', 'volume' or 'dollar'
+    :param m: bar threshold, None=every tick is a bar
+    :param price_col:
+    :return: pd.Series, the last bar of every timestamp
+    """
+    if isinstance(source, pd.Series):
+        return source
+    if bar_type not in BAR_COLUMNS:
+        raise ValueError(f"unknown bar_type: {bar_type}")
+    if isinstance(source, (str, os.PathLike)):
+        source = load_bars(source, chunksize=CHUNK_SIZE)
+    elif isinstance(source, TickStore):
+        source = source.read(columns=[price_col, 'v', 'dv'])
+    if m is None:
+        close = source[price_col]
+    else:
+        idx = sample_bars_idx(source[BAR_COLUMNS[bar_type] or price_col], m, bar_type)
+        close = take_bars(source, idx)[price_col]
+    return close[~close.index.duplicated(keep='last')]
+
+
+def get_side(side):
+    """
+    :param side: None, a function close -> side, or a name of SIDES
+    :return: the side function or None
+    """
+    if side is None or callable(side):
+        return side
+    if side not in SIDES:
+        raise ValueError(f"unknown side: {side}, expected a function or one of {list(SIDES)}")
+    module, name = SIDES[side]
+    return getattr(importlib.import_module(module), name)
+
+
+def label_symbol(source, bar_type='dollar', m=None, span=100, numDays=1, ptsl=(1, 1), minRet=0., side=None,
+                 price_col='price'):
+    """
+    Labels of one symbol
+    :param source: see get_bar_close
+    :param bar_type: see get_bar_close
+    :param m: see get_bar_close
+    :param span: get_daily_vol span, the volatility is the CUSUM threshold and the target
+    :param numDays: get_t1 vertical barrier
+    :param ptsl: barrier widths of get_events_w_metalabel
+    :param minRet: minimum target
+    :param side: None, a function close -> side (e.g. macd_side) or a name of SIDES ('macd') for meta-labeling
+    :param price_col:
+    :return: pd.DataFrame indexed by event start, t1, trgt, side, ret, bin (NaN when not labeled)
+    """
+    side = get_side(side)
+    close = get_bar_close(source, bar_type, m, price_col)
+    vol = get_daily_vol(close, span)
+    tEvents = cusum_filter_close(close, vol)
+    t1 = get_t1(close, tEvents, numDays)
+    events = get_events_w_metalabel(close, tEvents, list(ptsl), vol, minRet, t1=t1,
+                                    side=None if side is None else side(close))
+    bins = get_bins_w_metalabel(events, close)
+    return events.join(bins)
+
+
+def _label_job(job):
+    # worker: label one symbol and write its checkpoint, exceptions are returned
+    symbol, source, path, params = job
+    time0 = time.time()
+    try:
+        labels = label_symbol(source, **params)
+        tmp = path.with_name(path.name + '.tmp')
+        labels.to_parquet(tmp)
+        os.replace(tmp, path)
+        return symbol, 'done', labels.shape[0], time.time() - time0, None
+    except Exception:
+        return symbol, 'failed', 0, time.time() - time0, traceback.format_exc()
+
+
+def _key(source, params):
+    # None when the source or the parameters cannot be hashed, the symbol is then always labeled
+    if any(callable(v) and '<' in getattr(v, '__qualname__', '<') for v in params.values()):
+        return None  # lambdas and local functions are hashed by a name they share
+    if isinstance(source, str):
+        source = Path(source)  # hashed by file size and modification time
+    try:
+        return hash_args(source, params)
+    except TypeError:
+        return None
+
+
+def _cost(source):
+    # estimated labeling cost, symbols are submitted heaviest first
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source) if os.path.exists(source) else 0
+    if isinstance(source, TickStore):
+        return len(source)
+    return len(source) if hasattr(source, '__len__') else 0
+
+
+def read_manifest(root):
+    """ :return: dict symbol -> status, key, events, seconds, error """
+    try:
+        with open(Path(root) / MANIFEST_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(root, manifest):
+    tmp = root / (MANIFEST_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, root / MANIFEST_FILE)
+
+
+def run_universe(universe, root, numThreads=2, maxInFlight=None, backend='process', **params):
+    """
+    Label every symbol of a universe, see the module docstring
+    :param universe: dict symbol -> source (see get_bar_close)
+    :param root: checkpoint directory, created when missing
+    :param numThreads: symbols labeled in parallel
+    :param maxInFlight: symbols handed to the workers at a time, None=numThreads
+    :param backend: 'process', 'thread' or 'sequential', or an Executor whose apply is called from
+        numThreads threads (a worker it loses is not detected)
+    :param params: label_symbol parameters
+    :return: pd.DataFrame indexed by symbol, status ('done', 'skipped', 'failed'), events, seconds, error
+    """
+    if not isinstance(backend, Executor) and backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS} or an Executor, got {backend!r}")
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(root)
+    rows = {}
+    jobs = []
+    for symbol, source in universe.items():
+        key = _key(source, params)
+        entry = manifest.get(symbol, {})
+        path = root / f"{symbol}.parquet"
+        if key is not None and entry.get('status') == 'done' and entry.get('key') == key and path.exists():
+            rows[symbol] = ('skipped', entry['events'], 0., None)
+            continue
+        manifest[symbol] = {'status': 'pending', 'key': key}
+        jobs.append((_cost(source), symbol, (symbol, source, path, params)))
+    jobs = [job for _, _, job in sorted(jobs, key=lambda x: -x[0])]
+    _write_manifest(root, manifest)
+
+    def record(jobNum, symbol, status, events, seconds, error):
+        rows[symbol] = (status, events, seconds, error)
+        manifest[symbol].update({'status': status, 'events': events, 'seconds': seconds, 'error': error})
+        _write_manifest(root, manifest)
+        metrics.emit('job', 'ch3.run_universe', seconds, events, symbol=symbol, status=status)
+        metrics.emit('progress', 'ch3.run_universe', time.time() - time0, jobNum=jobNum, numJobs=len(jobs))
+
+    time0 = time.time()
+    if numThreads <= 1 or backend == 'sequential':
+        for jobNum, job in enumerate(jobs, 1):
+            record(jobNum, *_label_job(job))
+    else:
+        _run_pool(jobs, backend, numThreads, maxInFlight or numThreads, record)
+
+    out = pd.DataFrame.from_dict(rows, orient='index', columns=['status', 'events', 'seconds', 'error'])
+    return out.reindex(list(universe))
+
+
+def _new_pool(backend, numThreads):
+    return ProcessPoolExecutor(numThreads) if backend == 'process' else ThreadPoolExecutor(numThreads)
+
+
+def _run_pool(jobs, backend, numThreads, maxInFlight, record):
+    # at most maxInFlight symbols are submitted, a broken process pool is replaced
+    pending, running = deque(jobs), {}
+    pool, jobNum = None, 0
+    try:
+        while pending or running:
+            if pool is None:
+                pool = _new_pool(backend, numThreads)
+            while pending and len(running) < maxInFlight:
+                job = pending.popleft()
+                if isinstance(backend, Executor):
+                    future = pool.submit(backend.apply, _label_job, (job,))
+                else:
+                    future = pool.submit(_label_job, job)
+                running[future] = (job[0], time.time(), pool)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                symbol, submitted, owner = running.pop(future)
+                jobNum += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # the job did not reach a worker (e.g. a lambda side does not pickle) or its worker died
+                    result = symbol, 'failed', 0, time.time() - submitted, traceback.format_exc()
+                    if isinstance(e, BrokenProcessPool) and owner is pool:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = None
+                record(jobNum, *result)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+def read_labels(root, symbols=None):
+    """
+    :param root: checkpoint directory of run_universe
+    :param symbols: None=every labeled symbol
+    :return: pd.DataFrame indexed by (symbol, event start)
+    """
+    root = Path(root)
+    manifest = read_manifest(root)
+    if symbols is None:
+        symbols = [s for s, e in manifest.items() if e.get('status') == 'done']
+    return pd.concat({s: pd.read_parquet(root / f"{s}.parquet") for s in symbols}, names=['symbol', 'dates'])
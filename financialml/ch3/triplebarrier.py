@@ -1,6 +1,10 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
+import numpy as np
 import pandas as pd
+from financialml.ch3.firsttouch import build_tree, first_touch_kernel
+from financialml.utils.mp import mp_pandas_obj
+from financialml.utils.metrics import instrument
 
 
 def get_t1(close, tEvents, numDays=1):
@@ -35,6 +39,9 @@ def apply_ptslt1(close, events, ptsl, molecule):
     :return: pd.DataFrame of timestamps the barriers were touched
         t1:   Timestamp the barrier was first touched
         trgt: Volatility used to generate the barrier
+
+    First touches are found by a first passage search over positional arrays,
+    see firsttouch.py
     """
     # Sample a subset with specific indices
     _events = events.loc[molecule]
@@ -44,34 +51,80 @@ def apply_ptslt1(close, events, ptsl, molecule):
 
     # Set Profit Taking
     if ptsl[0] > 0:
-        pt = ptsl[0] * _events["trgt"]
+        pt = ptsl[0] * _events["trgt"].values
     else:
         # Switch off profit taking
-        pt = pd.Series(index=_events.index)
+        pt = np.full(_events.shape[0], np.nan)
     # Set Stop Loss limit
     if ptsl[1] > 0:
-        sl = -ptsl[1] * _events["trgt"]
+        sl = -ptsl[1] * _events["trgt"].values
     else:
         # Switch off stop loss
-        sl = pd.Series(index=_events.index)
+        sl = np.full(_events.shape[0], np.nan)
 
     # Replace undefined value with the last time index
     time_limits = _events["t1"].fillna(close.index[-1])
-    for loc, t1 in time_limits.iteritems():
-        df = close[loc:t1]
-        # Change the direction depending on the side
-        df = (df / close[loc] - 1) * _events.at[loc, 'side']
-        # print(df)
-        # print(loc, t1, df[df < sl[loc]].index.min(), df[df > pt[loc]].index.min())
-        out.at[loc, 'sl'] = df[df < sl[loc]].index.min()
-        out.at[loc, 'pt'] = df[df > pt[loc]].index.min()
 
+    # Positional window [loc, t1] of every event
+    loc = close.index.get_indexer(_events.index)
+    if (loc < 0).any():
+        raise KeyError(f"{_events.index[loc < 0][:5].tolist()} not in close index")
+    ends = close.index.searchsorted(pd.DatetimeIndex(time_limits), side='right')
+    ends = np.maximum(ends, loc)
+
+    # Only the span covered by the molecule is indexed
+    lo = loc.min() if loc.shape[0] > 0 else 0
+    hi = max(ends.max(), lo) if ends.shape[0] > 0 else 0
+    prices = np.ascontiguousarray(close.values[lo:hi], dtype=np.float64)
+    tmin, tmax, size = build_tree(prices)
+    sl_pos, pt_pos = first_touch_kernel(
+        tmin, tmax, size, (loc - lo).astype(np.int64), (ends - lo).astype(np.int64), prices[loc - lo],
+        np.ascontiguousarray(_events['side'].values, dtype=np.float64),
+        np.ascontiguousarray(sl, dtype=np.float64), np.ascontiguousarray(pt, dtype=np.float64))
+    sl_pos[sl_pos >= 0] += lo
+    pt_pos[pt_pos >= 0] += lo
+
+    out['sl'] = _positions_to_time(close.index, sl_pos)
+    out['pt'] = _positions_to_time(close.index, pt_pos)
     out['t1'] = _events['t1'].copy(deep=True)
 
     return out
 
 
-def get_events(close, tEvents, ptsl, trgt, minRet=0, numThreads=1, t1=False, side=None):
+def _positions_to_time(index, pos):
+    # -1 (barrier not touched) -> NaT
+    return index[np.maximum(pos, 0)].where(pos >= 0)
+
+
+def window_cost(close, events):
+    """
+    Estimated cost of labeling each event with apply_ptslt1, additive over
+    the events of a molecule. apply_ptslt1 builds the segment tree over the
+    bars spanned by its molecule and searches it once per event, so an event
+    costs the bars up to the next event start (the span of a run of events)
+    plus the log of its [t0, t1] window.
+    :param close: pd.Series
+    :param events: pd.DataFrame with a t1 column, sorted by index
+    :return: np.ndarray
+    """
+    t0 = close.index.searchsorted(events.index)
+    t1 = close.index.searchsorted(pd.DatetimeIndex(events['t1'].fillna(close.index[-1])), side='right')
+    window = np.maximum(t1 - t0, 0)
+    span = np.diff(t0, append=t1.max() if t1.shape[0] > 0 else 0)
+    return 1. + np.maximum(span, 0) + np.log2(1. + window)
+
+
+def _apply_ptslt1(close, events, ptsl, numThreads, backend, mpBatches=4):
+    # apply_ptslt1 over molecules of events balanced by window_cost, merged in index order
+    if numThreads == 1:
+        return apply_ptslt1(close, events, ptsl, events.index)
+    return mp_pandas_obj(apply_ptslt1, ('molecule', events.index), numThreads, mpBatches=mpBatches,
+                         backend=backend, shared=True, weights=window_cost(close, events),
+                         close=close, events=events, ptsl=ptsl)
+
+
+@instrument('ch3.get_events')
+def get_events(close, tEvents, ptsl, trgt, minRet=0, numThreads=1, t1=False, side=None, backend='process'):
     """
     3.5 Finds the the first time the barrier is touched
 
@@ -80,13 +133,14 @@ def get_events(close, tEvents, ptsl, trgt, minRet=0, numThreads=1, t1=False, sid
     :param ptsl: non-negative float that sets the two barriers, 0=disabled
     :param trgt: absolute returns
     :param minRet: minimum target return required when searching barrier
-    :param numThreads:
+    :param numThreads: number of molecules labeled in parallel
     :param t1: vertical barriers, false=disabled
     :param side:
+    :param backend: 'process' or 'thread' workers when numThreads > 1
     :return:
     """
     # 1. Get target
-    trgt = trgt[tEvents]
+    trgt = trgt.reindex(tEvents)
     trgt = trgt[trgt > minRet]
 
     # 2. Get t1 (max holding period)
@@ -96,7 +150,7 @@ def get_events(close, tEvents, ptsl, trgt, minRet=0, numThreads=1, t1=False, sid
     # 3. Form events object, apply stop loss on t1
     side = pd.Series(1., index=trgt.index)
     events = pd.concat({'t1': t1, 'trgt': trgt, 'side': side}, axis=1).dropna(subset=['trgt'])
-    df0 = apply_ptslt1(close, events, ptsl, events.index)
+    df0 = _apply_ptslt1(close, events, ptsl, numThreads, backend)
     df0_ = df0.dropna(how='all').min(axis=1)
     events['t1'] = df0_
 
@@ -106,7 +160,9 @@ def get_events(close, tEvents, ptsl, trgt, minRet=0, numThreads=1, t1=False, sid
     return events
 
 
-def get_events_w_metalabel(close, tEvents, ptsl, trgt, minRet=0, numThreads=1, t1=False, side=None):
+@instrument('ch3.get_events_w_metalabel')
+def get_events_w_metalabel(close, tEvents, ptsl, trgt, minRet=0, numThreads=1, t1=False, side=None,
+                           backend='process'):
     """
     3.6
     :param close:
@@ -114,12 +170,13 @@ def get_events_w_metalabel(close, tEvents, ptsl, trgt, minRet=0, numThreads=1, t
     :param ptsl:
     :param trgt:
     :param minRet:
-    :param numThreads:
+    :param numThreads: number of molecules labeled in parallel
     :param t1:
     :param side:
+    :param backend: 'process' or 'thread' workers when numThreads > 1
     :return:
     """
-    trgt = trgt[tEvents]
+    trgt = trgt.reindex(tEvents)
     assert (trgt.shape[0] == tEvents.shape[0])
     trgt = trgt[trgt > minRet]
     # Get time boundary t1
@@ -137,7 +194,7 @@ def get_events_w_metalabel(close, tEvents, ptsl, trgt, minRet=0, numThreads=1, t
     events = pd.concat({'t1': t1, 'trgt': trgt, 'side': side_}, axis=1)
     events = events.dropna(subset=['trgt'])
 
-    df0 = apply_ptslt1(close, events, ptsl_, events.index)
+    df0 = _apply_ptslt1(close, events, ptsl_, numThreads, backend)
 
     df0 = df0.dropna(how='all')
     events['t1'] = df0.min(axis=1)
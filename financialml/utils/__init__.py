@@ -1 +1,4 @@
 from .mp import mp_pandas_obj
+from .executor import get_executor, shutdown_executors
+from .metrics import add_callback, remove_callback, Recorder, ProgressLogger
+from .cache import Cache
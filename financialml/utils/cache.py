@@ -0,0 +1,335 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Content addressed on-disk cache of pipeline stage results.
+
+    root/
+        _index.json         key -> (bytes, last access)
+        _lock               serializes index updates of the processes sharing root
+        3f/3f9a.../         one directory per result
+            spec.pkl        structure of the result
+            0.parquet       frames, series and indexes
+            1.npy           numpy arrays
+
+A key hashes the function (name and bytecode), its version and the bound
+arguments. pandas and numpy arguments are hashed by content, numpy scalars
+as the Python scalars they hold. os.PathLike arguments (and str arguments
+named in paths) and TickStores are hashed by the size and modification time
+of their files, so a changed input misses the cache. The total size is
+bounded, least recently used results are evicted first.
+
+Results are written to a private directory renamed into place, and the
+index is re-read, merged and written under a file lock, so processes can
+share a cache directory. Hits only update the last access in memory, it is
+written with the next put.
+
+    cache = Cache('~/.cache/financialml')
+    get_daily_vol = cache.memoize(get_daily_vol)
+    get_events = cache.memoize(get_events, ignore=['numThreads', 'backend'])
+    load_bars = cache.memoize(load_bars, paths=['path'])
+"""
+import contextlib
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import time
+import uuid
+import warnings
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from financialml.ch1.tickstore import TickStore, INDEX_FILE as STORE_INDEX_FILE
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover, not available on windows, the index is then not locked
+    fcntl = None
+
+INDEX_FILE = '_index.json'
+LOCK_FILE = '_lock'
+SPEC_FILE = 'spec.pkl'
+MAX_BYTES = 1 << 30
+
+
+def _stat(path, h):
+    # size and modification time of a file, or of every file under a directory
+    path = Path(path)
+    files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+    for p in files:
+        st = p.stat()
+        h.update(f"{p}:{st.st_size}:{st.st_mtime_ns};".encode())
+
+
+def _code(code, h):
+    h.update(code.co_code)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            _code(const, h)
+        else:
+            h.update(repr(const).encode())
+
+
+def _update(h, obj):
+    """ Feed the content of obj to the hash h """
+    if isinstance(obj, np.generic) and not isinstance(obj, (np.datetime64, np.timedelta64)):
+        obj = obj.item()
+    if obj is None or isinstance(obj, (bool, int, float, complex, bytes, np.generic,
+                                       pd.Timestamp, pd.Timedelta, np.dtype)):
+        h.update(repr((type(obj).__name__, obj)).encode())
+    elif isinstance(obj, str):
+        h.update(repr(('str', obj)).encode())
+    elif isinstance(obj, os.PathLike):
+        h.update(repr(('path', os.fspath(obj))).encode())
+        if os.path.exists(obj):
+            _stat(obj, h)
+    elif isinstance(obj, pd.DataFrame):
+        h.update(b'frame')
+        _update(h, list(obj.columns))
+        _update(h, [str(d) for d in obj.dtypes])
+        _update(h, obj.index)
+        h.update(pd.util.hash_pandas_object(obj, index=False).values.tobytes())
+    elif isinstance(obj, pd.Series):
+        h.update(b'series')
+        _update(h, obj.name)
+        h.update(str(obj.dtype).encode())
+        _update(h, obj.index)
+        h.update(pd.util.hash_pandas_object(obj, index=False).values.tobytes())
+    elif isinstance(obj, pd.Index):
+        h.update(repr(('index', type(obj).__name__, str(obj.dtype), obj.names)).encode())
+        h.update(pd.util.hash_pandas_object(obj).values.tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(repr(('array', str(obj.dtype), obj.shape)).encode())
+        if obj.dtype.kind == 'O':
+            h.update(pd.util.hash_pandas_object(pd.Series(obj.ravel())).values.tobytes())
+        else:
+            h.update(np.ascontiguousarray(obj).view(np.uint8).data)
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"{type(obj).__name__}{len(obj)}".encode())
+        for x in obj:
+            _update(h, x)
+    elif isinstance(obj, dict):
+        h.update(f"dict{len(obj)}".encode())
+        for k in sorted(obj, key=repr):
+            _update(h, k)
+            _update(h, obj[k])
+    elif callable(obj) and hasattr(obj, '__qualname__'):
+        h.update(f"{obj.__module__}.{obj.__qualname__}".encode())
+    elif isinstance(obj, TickStore):
+        # the index changes with every write
+        h.update(repr(('store', os.fspath(obj.root))).encode())
+        _stat(obj.root / STORE_INDEX_FILE, h)
+    else:
+        raise TypeError(f"cannot hash {type(obj).__name__} for the cache")
+
+
+def hash_args(*args):
+    """ :return: hex digest of the content of args """
+    h = hashlib.blake2b(digest_size=20)
+    _update(h, args)
+    return h.hexdigest()
+
+
+def _dump(obj, path, files):
+    # write the leaves of obj under path, return its spec
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        fname = f"{len(files)}.parquet"
+        if isinstance(obj, pd.DataFrame):
+            spec = ('frame', fname, list(obj.columns))
+            frame = obj.set_axis([str(i) for i in range(obj.shape[1])], axis=1)
+        elif isinstance(obj, pd.Series):
+            spec = ('series', fname, obj.name)
+            frame = obj.to_frame('0')
+        else:
+            spec = ('index', fname, None)
+            frame = pd.DataFrame(index=obj)
+        frame.to_parquet(path / fname)
+    elif isinstance(obj, np.ndarray) and obj.dtype.kind != 'O':
+        fname = f"{len(files)}.npy"
+        spec = ('array', fname, None)
+        np.save(path / fname, obj)
+    elif isinstance(obj, (tuple, list)):
+        return (type(obj).__name__, None, [_dump(x, path, files) for x in obj])
+    elif isinstance(obj, dict):
+        return ('dict', None, [(k, _dump(v, path, files)) for k, v in obj.items()])
+    elif obj is None or isinstance(obj, (bool, int, float, str, np.generic, pd.Timestamp, pd.Timedelta)):
+        return ('value', None, obj)
+    else:
+        raise TypeError(f"cannot cache results of type {type(obj).__name__}")
+    files.append(fname)
+    return spec
+
+
+def _load(spec, path):
+    kind, fname, meta = spec
+    if kind == 'frame':
+        return pd.read_parquet(path / fname).set_axis(pd.Index(meta), axis=1)
+    if kind == 'series':
+        return pd.read_parquet(path / fname)['0'].rename(meta)
+    if kind == 'index':
+        return pd.read_parquet(path / fname).index
+    if kind == 'array':
+        return np.load(path / fname)
+    if kind == 'tuple':
+        return tuple(_load(s, path) for s in meta)
+    if kind == 'list':
+        return [_load(s, path) for s in meta]
+    if kind == 'dict':
+        return {k: _load(s, path) for k, s in meta}
+    return meta
+
+
+class Cache(object):
+    def __init__(self, root, maxBytes=MAX_BYTES):
+        """
+        :param root: cache directory, created when missing
+        :param maxBytes: size bound, least recently used results are evicted beyond it
+        """
+        object.__init__(self)
+        self._root = Path(os.path.expanduser(root))
+        self._root.mkdir(parents=True, exist_ok=True)
+        self.maxBytes = maxBytes
+        self.hits = self.misses = 0
+        self._index = self._read_index()
+        self._atime = {}    # last access of the hits since the last index write
+
+    def _read_index(self):
+        try:
+            with open(self._root / INDEX_FILE) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # exclusive access to the index and the result directories across processes
+        with open(self._root / LOCK_FILE, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _write_index(self):
+        tmp = self._root / (INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._root / INDEX_FILE)
+
+    def _path(self, key):
+        return self._root / key[:2] / key
+
+    @property
+    def nbytes(self):
+        return sum(e['bytes'] for e in self._index.values())
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        # results written by other processes count, the index is only the bookkeeping of sizes
+        return (self._path(key) / SPEC_FILE).exists()
+
+    def get(self, key):
+        """
+        :return: (True, result) on a hit, (False, None) otherwise
+        """
+        try:
+            with open(self._path(key) / SPEC_FILE, 'rb') as f:
+                out = _load(pickle.load(f), self._path(key))
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # missing, or evicted by another process while reading
+            self.misses += 1
+            return False, None
+        self._atime[key] = time.time()
+        self.hits += 1
+        return True, out
+
+    def put(self, key, value):
+        """
+        Store value (frames, series, indexes, arrays, scalars and tuples/lists/dicts of them)
+        """
+        path = self._path(key)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}-{uuid.uuid4().hex}.tmp")
+        tmp.mkdir(parents=True)
+        try:
+            spec = _dump(value, tmp, [])
+            with open(tmp / SPEC_FILE, 'wb') as f:
+                pickle.dump(spec, f)
+            size = sum(p.stat().st_size for p in tmp.iterdir())
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        with self._locked():
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp, path)
+            # entries and accesses of the other processes, then this one's
+            self._index = self._read_index()
+            for k, atime in self._atime.items():
+                if k in self._index:
+                    self._index[k]['atime'] = max(self._index[k]['atime'], atime)
+            self._atime = {}
+            self._index[key] = {'bytes': size, 'atime': time.time()}
+            self._evict()
+            self._write_index()
+
+    def _evict(self):
+        total = self.nbytes
+        for key in sorted(self._index, key=lambda k: self._index[k]['atime']):
+            if total <= self.maxBytes:
+                break
+            total -= self._index.pop(key)['bytes']
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def clear(self):
+        with self._locked():
+            for key in set(self._read_index()) | set(self._index):
+                shutil.rmtree(self._path(key), ignore_errors=True)
+            self._index, self._atime = {}, {}
+            self._write_index()
+
+    def key(self, func, args=(), kwds=None, version=None, ignore=(), paths=()):
+        """
+        :return: cache key of func(*args, **kwds), arguments in ignore do not change the result,
+            str arguments in paths are files hashed by size and modification time
+        """
+        func_ = inspect.unwrap(func)
+        bound = inspect.signature(func_).bind(*args, **(kwds or {}))
+        bound.apply_defaults()
+        arguments = {k: Path(v) if k in paths and isinstance(v, str) else v
+                     for k, v in bound.arguments.items() if k not in ignore}
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f"{func_.__module__}.{func_.__qualname__}:{version}".encode())
+        if hasattr(func_, '__code__'):
+            _code(func_.__code__, h)
+        _update(h, arguments)
+        return h.hexdigest()
+
+    def memoize(self, func=None, version=None, ignore=(), paths=()):
+        """
+        Decorator caching the results of func
+        :param version: change it to invalidate results when code called by func changes
+        :param ignore: names of arguments that do not change the result (numThreads, backend...)
+        :param paths: names of str arguments that are file or directory paths
+        """
+        if func is None:
+            return functools.partial(self.memoize, version=version, ignore=ignore, paths=paths)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwds):
+            key = self.key(func, args, kwds, version, ignore, paths)
+            hit, out = self.get(key)
+            if hit:
+                return out
+            out = func(*args, **kwds)
+            try:
+                self.put(key, out)
+            except TypeError as e:
+                warnings.warn(f"{func.__name__} not cached: {e}")
+            return out
+        return wrapper
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Persistent executors for mp_pandas_obj.
+
+Worker pools are started on first use and kept for the session, so pool
+startup and the import of the workers' modules are paid once instead of on
+every process_jobs call. Workers of a process pool are forked when the pool
+starts: functions sent to them must be importable (defined at module level)
+at that point, call shutdown_executors() to start fresh pools.
+"""
+import abc
+import atexit
+import multiprocessing as mp
+import threading
+from multiprocessing.pool import ThreadPool
+
+BACKENDS = ['process', 'thread', 'sequential']
+
+
+class Executor(abc.ABC):
+    def __init__(self, numThreads=1):
+        """
+        :param numThreads: number of workers
+        """
+        abc.ABC.__init__(self)
+        self.numThreads = numThreads
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @abc.abstractmethod
+    def imap_unordered(self, func, iterable):
+        """
+        :return: iterator over func(x) for x in iterable, in completion order
+        """
+
+    @abc.abstractmethod
+    def apply(self, func, args=(), kwds=None):
+        """
+        :return: func(*args, **kwds) evaluated by a worker
+        """
+
+    def close(self):
+        pass
+
+
+class SequentialExecutor(Executor):
+    # runs in the calling thread, for debugging and numThreads=1
+    def imap_unordered(self, func, iterable):
+        return map(func, iterable)
+
+    def apply(self, func, args=(), kwds=None):
+        return func(*args, **(kwds or {}))
+
+
+class _PoolExecutor(Executor):
+    def __init__(self, numThreads=2):
+        Executor.__init__(self, numThreads)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _new_pool(self):
+        """ :return: a started multiprocessing pool """
+
+    @property
+    def pool(self):
+        # started lazily, then reused
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._new_pool()
+            return self._pool
+
+    def imap_unordered(self, func, iterable):
+        return self.pool.imap_unordered(func, iterable)
+
+    def apply(self, func, args=(), kwds=None):
+        return self.pool.apply(func, args, kwds or {})
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+class ThreadExecutor(_PoolExecutor):
+    # shares memory with the caller, suits kernels that release the GIL
+    def _new_pool(self):
+        return ThreadPool(processes=self.numThreads)
+
+
+class ProcessExecutor(_PoolExecutor):
+    def _new_pool(self):
+        return mp.Pool(processes=self.numThreads)
+
+
+_EXECUTORS = {}
+_LOCK = threading.Lock()
+
+
+def get_executor(backend='process', numThreads=2):
+    """
+    Session wide executor, created on first use
+    :param backend: 'process', 'thread' or 'sequential', an Executor is returned as is
+    :param numThreads: number of workers
+    :return: Executor
+    """
+    if isinstance(backend, Executor):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS} or an Executor, got {backend!r}")
+    if backend == 'sequential':
+        return SequentialExecutor()
+    key = (backend, numThreads)
+    with _LOCK:
+        if key not in _EXECUTORS:
+            _EXECUTORS[key] = (ThreadExecutor if backend == 'thread' else ProcessExecutor)(numThreads)
+        return _EXECUTORS[key]
+
+
+def shutdown_executors():
+    """ Stop every session wide executor """
+    with _LOCK:
+        executors = list(_EXECUTORS.values())
+        _EXECUTORS.clear()
+    for executor in executors:
+        executor.close()
+
+
+atexit.register(shutdown_executors)
@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Optional numba support. Kernels decorated with njit are compiled when numba
+is installed and run as plain python over numpy arrays otherwise.
+"""
+try:
+    from numba import njit as _njit
+    HAS_NUMBA = True
+except ImportError:
+    _njit = None
+    HAS_NUMBA = False
+
+
+def njit(*args, **kwargs):
+    """
+    numba.njit when available, identity decorator otherwise
+    :param args: function to compile or positional numba options
+    :param kwargs: numba options (cache, nogil, ...)
+    :return: compiled function or decorator
+    """
+    if HAS_NUMBA:
+        return _njit(*args, **kwargs)
+    if len(args) == 1 and callable(args[0]) and not kwargs:
+        return args[0]
+    return lambda func: func
@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Progress and profiling events of the pipeline stages.
+
+Stages (loading, sampling, filtering, labeling) and process_jobs report into
+the callbacks registered with add_callback. With no callback registered the
+instrumentation is a single check per call.
+
+Events are
+    stage:    one call of an instrumented function
+    job:      one molecule finished by a worker of process_jobs
+    progress: jobs done so far in process_jobs
+
+The memory of stage and job events is the peak of the memory traced by
+tracemalloc (Python and numpy allocations) during the call, above its level
+when the call started, in MB (see MemoryPeak).
+"""
+import datetime as dt
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+import pandas as pd
+
+Event = namedtuple('Event', ['kind', 'name', 'seconds', 'rows', 'memory', 'info'])
+
+_CALLBACKS = []
+
+
+def enabled():
+    """ True when at least one callback is registered """
+    return bool(_CALLBACKS)
+
+
+def add_callback(callback):
+    """
+    :param callback: callback(event) called with every Event
+    :return: callback
+    """
+    _CALLBACKS.append(callback)
+    return callback
+
+
+def remove_callback(callback):
+    if callback in _CALLBACKS:
+        _CALLBACKS.remove(callback)
+
+
+def emit(kind, name, seconds=None, rows=None, memory=None, **info):
+    if not _CALLBACKS:
+        return
+    event = Event(kind, name, seconds, rows, memory, info)
+    for callback in list(_CALLBACKS):
+        callback(event)
+
+
+class MemoryPeak(object):
+    _lock = threading.Lock()
+    _users = 0
+    _owned = False
+    _local = threading.local()
+
+    def __init__(self, always=False):
+        """
+        Context manager measuring the traced memory peak of a stage, memory is
+        None when no callback is registered unless always is set (workers do
+        not see the callbacks of the caller). tracemalloc is started for the
+        outermost stage and stopped after it (unless it was already tracing).
+        Nested stages carry their peak to the enclosing one. Stages running
+        concurrently in threads share the process wide peak, so their figures
+        overlap.
+        """
+        object.__init__(self)
+        self.always = always
+        self.memory = None
+        self._base = None
+
+    @classmethod
+    def _stack(cls):
+        # per thread: peak so far of every open stage
+        if not hasattr(cls._local, 'stack'):
+            cls._local.stack = []
+        return cls._local.stack
+
+    def __enter__(self):
+        if not (_CALLBACKS or self.always):
+            return self
+        with MemoryPeak._lock:
+            if MemoryPeak._users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                MemoryPeak._owned = True
+            MemoryPeak._users += 1
+        stack = self._stack()
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1] = max(stack[-1], peak)
+        tracemalloc.reset_peak()
+        self._base = current
+        stack.append(current)
+        return self
+
+    def __exit__(self, *args):
+        if self._base is None:
+            return
+        stack = self._stack()
+        peak = max(stack.pop(), tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1] = max(stack[-1], peak)
+        self.memory = max(peak - self._base, 0) / (1 << 20)
+        with MemoryPeak._lock:
+            MemoryPeak._users -= 1
+            if MemoryPeak._users == 0 and MemoryPeak._owned:
+                tracemalloc.stop()
+                MemoryPeak._owned = False
+
+
+def _size(obj):
+    try:
+        return len(obj)
+    except TypeError:
+        return None
+
+
+def instrument(name, rows=None):
+    """
+    Decorator reporting a stage event for every call
+    :param name: stage name, e.g. 'ch1.load_bars'
+    :param rows: rows(out, *args, **kwds) -> number of rows processed, default len(out)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwds):
+            if not _CALLBACKS:
+                return func(*args, **kwds)
+            time0 = time.perf_counter()
+            with MemoryPeak() as peak:
+                out = func(*args, **kwds)
+            seconds = time.perf_counter() - time0
+            n = _size(out) if rows is None else rows(out, *args, **kwds)
+            emit('stage', name, seconds, n, peak.memory)
+            return out
+        return wrapper
+    return decorator
+
+
+def timed_call(func, *args, **kwds):
+    # worker side of process_jobs: output with its run time, worker id and traced memory peak
+    time0 = time.perf_counter()
+    with MemoryPeak(always=True) as peak:
+        out = func(*args, **kwds)
+    return out, time.perf_counter() - time0, os.getpid(), peak.memory
+
+
+class Recorder(object):
+    def __init__(self, kinds=('stage', 'job')):
+        """
+        Callback keeping the events, use as a context manager to register it
+        :param kinds: event kinds to keep
+        """
+        object.__init__(self)
+        self.kinds = kinds
+        self.events = []
+
+    def __call__(self, event):
+        if event.kind in self.kinds:
+            self.events.append(event)
+
+    def __enter__(self):
+        return add_callback(self)
+
+    def __exit__(self, *args):
+        remove_callback(self)
+
+    def to_frame(self):
+        """ :return: pd.DataFrame one row per event """
+        rows = [dict(kind=e.kind, name=e.name, seconds=e.seconds, rows=e.rows, memory=e.memory, **e.info)
+                for e in self.events]
+        return pd.DataFrame(rows, columns=None if rows else list(Event._fields[:-1]))
+
+    def summary(self):
+        """
+        :return: pd.DataFrame per (kind, name): calls, seconds, rows, rows per second
+            and the largest memory peak of a call (MB)
+        """
+        df = self.to_frame()
+        out = df.groupby(['kind', 'name']).agg(calls=('seconds', 'size'), seconds=('seconds', 'sum'),
+                                               rows=('rows', 'sum'), memory=('memory', 'max'))
+        out['throughput'] = out['rows'] / out['seconds']
+        return out
+
+
+class ProgressLogger(object):
+    def __init__(self, stream=None):
+        """
+        Callback writing process_jobs progress as one line per task
+        :param stream: default sys.stderr
+        """
+        object.__init__(self)
+        self.stream = stream
+
+    def __call__(self, event):
+        if event.kind != 'progress':
+            return
+        jobNum, numJobs, elapsed = event.info['jobNum'], event.info['numJobs'], event.seconds
+        msg = [float(jobNum)/numJobs, elapsed/60.]
+        msg.append(msg[1]*(1/msg[0]-1))
+        timeStamp = str(dt.datetime.fromtimestamp(time.time()))
+        msg = timeStamp + ' ' + str(round(msg[0]*100,2))+'% ' + event.name + ' done after '+ \
+            str(round(msg[1],2))+' minutes. Remaining '+str(round(msg[2],2))+' minutes.'
+        stream = self.stream or sys.stderr
+        stream.write(msg+('\r' if jobNum < numJobs else '\n'))
@@ -1,11 +1,12 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 import pandas as pd
-import multiprocessing as mp
-import datetime as dt
 import numpy as np
 import time
-import sys
+from financialml.utils.shm import SharedStore, resolve
+from financialml.utils.executor import get_executor, ProcessExecutor
+from financialml.utils import metrics
+from financialml.utils.metrics import timed_call
 
 def lin_parts(numAtoms, numThreads):
     # partition of atoms with a single loop
@@ -26,85 +27,201 @@ def nested_parts(numAtoms, numThreads, upperTriang=False):
         parts = np.append(np.array([0]),parts)
     return parts
 
+def _greedy_parts(cum, capacity):
+    # fewest contiguous molecules of at most capacity, cum = [0, cumulative weights]
+    parts = [0]
+    while parts[-1] < cum.shape[0]-1:
+        stop = np.searchsorted(cum, cum[parts[-1]]+capacity, side='right')-1
+        parts.append(max(stop, parts[-1]+1))
+    return np.array(parts)
+
+def weighted_parts(weights, numThreads):
+    # partition of atoms into contiguous molecules minimising the heaviest molecule (estimated cost)
+    weights = np.maximum(np.asarray(weights, dtype=np.float64), 0)
+    numAtoms = weights.shape[0]
+    cum = np.concatenate([[0.], np.cumsum(weights)])
+    if numAtoms == 0 or cum[-1] <= 0:
+        return lin_parts(numAtoms, numThreads)
+    numThreads_ = min(numThreads, numAtoms)
+    # bisection on the capacity, the greedy split is feasible iff it needs at most numThreads_ molecules
+    lo, hi = max(weights.max(), cum[-1]/numThreads_), cum[-1]
+    while hi-lo > 1e-9*hi:
+        mid = (lo+hi)/2.
+        if len(_greedy_parts(cum, mid))-1 <= numThreads_:
+            hi = mid
+        else:
+            lo = mid
+    parts = list(_greedy_parts(cum, hi))
+    # spare molecules split the heaviest ones, which keeps the maximum
+    while len(parts)-1 < numThreads_:
+        sizes = [(cum[b]-cum[a], b-a, i) for i, (a, b) in enumerate(zip(parts[:-1], parts[1:])) if b-a > 1]
+        if len(sizes) == 0:
+            break
+        _, _, i = max(sizes)
+        a, b = parts[i], parts[i+1]
+        cut = np.searchsorted(cum[a+1:b], (cum[a]+cum[b])/2.)+a+1
+        parts.insert(i+1, min(cut, b-1))
+    return np.array(parts, dtype=int)
+
 def expand_call(kwargs):
     # Expand the arguments of a callback function, kargs['func']
     func = kwargs['func']
     del kwargs['func']
+    # attach shared arguments as zero-copy views
+    kwargs = {k: resolve(v) for k, v in kwargs.items()}
     out = func(**kwargs)
     return out
 
-def process_jobs_(jobs):
+def expand_call_(args):
+    # (job number, job) -> (job number, output), so outputs can be put back in job order
+    i, kwargs = args
+    return i, expand_call(kwargs)
+
+def expand_call_timed_(args):
+    # expand_call_ with (output, seconds, worker id, peak memory) for metrics
+    i, kwargs = args
+    return i, timed_call(expand_call, kwargs)
+
+def reduce_outputs(outputs, numJobs, reducer=None, reducerInit=None):
+    # outputs: iterable of (job number, output) in completion order
+    # without a reducer, returns the outputs in job order
+    # with a reducer, folds each output into the accumulator as soon as it arrives
+    if reducer is None:
+        out = [None]*numJobs
+        for i, out_ in outputs:
+            out[i] = out_
+        return out
+    acc, first = reducerInit, reducerInit is None
+    for i, out_ in outputs:
+        if first:
+            acc, first = out_, False
+        else:
+            acc = reducer(acc, out_)
+    return acc
+
+def process_jobs_(jobs, reducer=None, reducerInit=None):
     # sequential
-    out = []
-    for job in jobs:
-        out_ = expand_call(job)
-        out.append(out_)
-    return out
+    outputs = (expand_call_(job) for job in enumerate(jobs))
+    return reduce_outputs(outputs, len(jobs), reducer, reducerInit)
 
 def report_progress(jobNum, numJobs, time0, task):
-    # Report progress as asynch jobs are completed
-    msg = [float(jobNum)/numJobs, (time.time()-time0)/60.]
-    msg.append(msg[1]*(1/msg[0]-1))
-    timeStamp = str(dt.datetime.fromtimestamp(time.time()))
-    msg = timeStamp + ' ' + str(round(msg[0]*100,2))+'% ' + task + ' done after '+ \
-        str(round(msg[1],2))+' minutes. Remaining '+str(round(msg[2],2))+' minutes.'
-    if jobNum < numJobs:
-        sys.stderr.write(msg+'\r')
-    else:
-        sys.stderr.write(msg+'\n')
-    return
+    # Report progress as asynch jobs are completed, to stderr when no metrics callback is registered
+    event = metrics.Event('progress', task, time.time()-time0, None, None, dict(jobNum=jobNum, numJobs=numJobs))
+    metrics.ProgressLogger()(event)
 
-def process_jobs(jobs, task=None, numThreads=2):
+def process_jobs(jobs, task=None, numThreads=2, backend='process', reducer=None, reducerInit=None):
     # jobs must contain a 'func' callback, for expand_call
+    # backend: 'process', 'thread' or 'sequential' (session wide executors) or an Executor,
+    # threads suit kernels that release the GIL
+    # reducer: see reduce_outputs
+    # progress, per job timing and worker utilization are reported to the metrics callbacks,
+    # without a callback progress goes to stderr (report_progress)
     if task is None: task = jobs[0]['func'].__name__
-    pool = mp.Pool(processes=numThreads)
-    outputs, out, time0 = pool.imap_unordered(expand_call,jobs),[],time.time()
-    # Process async output, report progress
-    for i,out_ in enumerate(outputs,1):
-        out.append(out_)
-        report_progress(i, len(jobs), time0, task)
-    pool.close()
-    pool.join() 
+    executor = get_executor(backend, numThreads)
+    if not metrics.enabled():
+        outputs, time0 = executor.imap_unordered(expand_call_,enumerate(jobs)),time.time()
+
+        def reported_():
+            for jobNum,out_ in enumerate(outputs,1):
+                yield out_
+                report_progress(jobNum, len(jobs), time0, task)
+
+        return reduce_outputs(reported_(), len(jobs), reducer, reducerInit)
+
+    outputs, time0 = executor.imap_unordered(expand_call_timed_,enumerate(jobs)),time.time()
+    busy, workers = [0.], set()
+
+    def reported():
+        # Process async output, report progress
+        for jobNum,(i,(out_,seconds,worker,memory)) in enumerate(outputs,1):
+            busy[0] += seconds
+            workers.add(worker)
+            metrics.emit('job', task, seconds, memory=memory, job=i, worker=worker)
+            metrics.emit('progress', task, time.time()-time0, jobNum=jobNum, numJobs=len(jobs))
+            yield i, out_
+
+    with metrics.MemoryPeak() as peak:
+        out = reduce_outputs(reported(), len(jobs), reducer, reducerInit)
+    elapsed = time.time()-time0
+    metrics.emit('stage', 'mp.process_jobs', elapsed, len(jobs), peak.memory, task=task,
+                 workers=len(workers), utilization=busy[0]/(elapsed*numThreads) if elapsed > 0 else None)
     return out
 
-def mp_pandas_obj(func, pdObj, numThreads=2, mpBatches=1, linMols=True, **kwargs):
+def mp_pandas_obj(func, pdObj, numThreads=2, mpBatches=1, linMols=True, backend='process', shared=False,
+                  reducer=None, reducerInit=None, weights=None, **kwargs):
     '''
     + func: function to be parallelized. Returns a DataFrame
     + pdObj[0]: Name of argument used to pass the molecule
     + pdObj[1]: List of atoms that will be grouped into molecules
+    + backend: 'process', 'thread' or 'sequential' workers, or an Executor
+    + shared: publish large numpy backed arguments (and the atoms) once through
+      memory-mapped files, jobs then only carry handles and molecule ranges
+    + reducer: reducer(acc, out) combining outputs as they arrive, e.g. operator.add
+      for counts and sums, instead of keeping every output for a final concat
+    + reducerInit: initial accumulator, None=first output
+    + weights: estimated cost of each atom, or a function of the atoms returning it.
+      Molecules are balanced by cost instead of count and submitted heaviest first;
+      with mpBatches > 1 idle workers keep pulling the remaining molecules, so one
+      slow molecule does not hold up the others
     + kwds: any other argument needed by func
-    + ret: dataframe or series
+    + ret: dataframe or series (in molecule order), or the reduced value
     Example: df = mp_pandas_obj(func, ('molecule',df0.index), 2, **kwargs)
     '''
     #if linMols:parts=lin_parts(len(argList[1]),numThreads*mpBatches)
     #else:parts=nested_parts(len(argList[1]),numThreads*mpBatches)
-    if linMols:
+    if weights is not None:
+        if callable(weights):
+            weights = weights(pdObj[1])
+        parts = weighted_parts(weights,numThreads*mpBatches)
+    elif linMols:
         parts = lin_parts(len(pdObj[1]),numThreads*mpBatches)
     else:
         parts = nested_parts(len(pdObj[1]),numThreads*mpBatches)
 
-    jobs=[]
-    for i in range(1,len(parts)):
-        job = {pdObj[0]:pdObj[1][parts[i-1]:parts[i]],'func':func}
-        job.update(kwargs)
-        jobs.append(job)
-    
-    if numThreads == 1:
-        out = process_jobs_(jobs)
-    else: 
-        out = process_jobs(jobs, numThreads=numThreads)
-    
-    if isinstance(out[0], pd.DataFrame):
-        df0 = pd.DataFrame()
-    elif isinstance(out[0],pd.Series):
-        df0 = pd.Series()
-    else:
+    # threads already share memory with the caller
+    executor = get_executor(backend, numThreads) if numThreads > 1 else None
+    store = SharedStore() if shared and isinstance(executor, ProcessExecutor) else None
+    try:
+        if store is not None:
+            molecules = store.share_slices(pdObj[1], parts)
+            kwargs = {k: store.share(v) for k, v in kwargs.items()}
+        else:
+            molecules = [pdObj[1][parts[i-1]:parts[i]] for i in range(1,len(parts))]
+
+        # longest processing time first, outputs are put back in molecule order below
+        order = np.arange(len(molecules))
+        if weights is not None:
+            cost = np.add.reduceat(np.maximum(np.asarray(weights, dtype=np.float64), 0), parts[:-1]) \
+                if len(molecules) > 0 else np.array([])
+            order = np.argsort(-cost, kind='stable')
+
+        jobs=[]
+        for i in order:
+            job = {pdObj[0]:molecules[i],'func':func}
+            job.update(kwargs)
+            jobs.append(job)
+
+        if executor is None:
+            out = process_jobs_(jobs, reducer, reducerInit)
+        else:
+            out = process_jobs(jobs, numThreads=numThreads, backend=executor,
+                               reducer=reducer, reducerInit=reducerInit)
+    finally:
+        if store is not None:
+            store.close()
+
+    if reducer is None:
+        out_ = [None]*len(out)
+        for j, i in enumerate(order):
+            out_[i] = out[j]
+        out = out_
+
+    if reducer is not None or not isinstance(out[0], (pd.DataFrame, pd.Series)):
         return out
-    
-    for i in out:
-        df0 = df0.append(i)
-    
-    df0 = df0.sort_index()
 
-    return df0
+    # outputs are in molecule order, one concat; sort only when atoms were not sorted
+    df0 = pd.concat(out)
+    if not df0.index.is_monotonic_increasing:
+        df0 = df0.sort_index()
 
+    return df0
@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Zero-copy transport of numpy backed arguments to worker processes.
+
+Arrays are written once to memory-mapped .npy files (under /dev/shm when
+available) and jobs carry small picklable handles. Workers resolve a handle
+to a copy-on-write memory map, so reading the data costs no copy and no
+pickling.
+"""
+import abc
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+SHARE_MIN_BYTES = 1 << 20
+
+
+class _Handle(abc.ABC):
+    @abc.abstractmethod
+    def resolve(self):
+        """ :return: the shared object, a view of the shared arrays """
+
+
+class _Array(_Handle):
+    def __init__(self, path):
+        _Handle.__init__(self)
+        self.path = path
+
+    def resolve(self):
+        # copy-on-write: pages are shared until a worker writes to them
+        return np.load(self.path, mmap_mode='c')
+
+
+class _Index(_Handle):
+    def __init__(self, values, name, tz):
+        _Handle.__init__(self)
+        self.values, self.name, self.tz = values, name, tz
+
+    def resolve(self):
+        values = resolve(self.values)
+        if values.dtype.kind == 'M':
+            index = pd.DatetimeIndex(values, name=self.name, copy=False)
+            return index if self.tz is None else index.tz_localize('UTC').tz_convert(self.tz)
+        return pd.Index(values, name=self.name, copy=False)
+
+
+class _Series(_Handle):
+    def __init__(self, values, index, name):
+        _Handle.__init__(self)
+        self.values, self.index, self.name = values, index, name
+
+    def resolve(self):
+        return pd.Series(resolve(self.values), index=resolve(self.index), name=self.name, copy=False)
+
+
+class _Frame(_Handle):
+    def __init__(self, columns, index):
+        _Handle.__init__(self)
+        self.columns, self.index = columns, index
+
+    def resolve(self):
+        index = resolve(self.index)
+        return pd.DataFrame({c: pd.Series(resolve(v), index=index, copy=False) for c, v in self.columns},
+                            copy=False)
+
+
+class _Slice(_Handle):
+    # positional slice of a shared object, e.g. the atoms of one molecule
+    def __init__(self, obj, start, stop):
+        _Handle.__init__(self)
+        self.obj, self.start, self.stop = obj, start, stop
+
+    def resolve(self):
+        obj = resolve(self.obj)
+        if isinstance(obj, (pd.Series, pd.DataFrame)):
+            return obj.iloc[self.start:self.stop]
+        return obj[self.start:self.stop]
+
+
+def resolve(obj):
+    """ Handle -> zero-copy view, anything else is returned as is """
+    return obj.resolve() if isinstance(obj, _Handle) else obj
+
+
+def _plain(values):
+    # numpy array that can be memory mapped, None for object/extension data
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biufcmM':
+        return values
+    return None
+
+
+class SharedStore(object):
+    def __init__(self, minBytes=SHARE_MIN_BYTES):
+        """
+        Owner of the shared arrays, remove them with close() (or use as a context manager)
+        :param minBytes: objects smaller than this are pickled as usual
+        """
+        object.__init__(self)
+        root = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        self._dir = tempfile.mkdtemp(prefix='financialml-', dir=root)
+        self._minBytes = minBytes
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _array(self, values):
+        path = os.path.join(self._dir, f"{self._count}.npy")
+        self._count += 1
+        np.save(path, np.ascontiguousarray(values))
+        return _Array(path)
+
+    def _index(self, index):
+        if isinstance(index, pd.DatetimeIndex):
+            tz = index.tz
+            values = (index.tz_convert('UTC').tz_localize(None) if tz is not None else index).values
+            return _Index(self._array(values), index.name, tz)
+        values = _plain(index.values)
+        if values is None or isinstance(index, pd.RangeIndex):
+            return index
+        return _Index(self._array(values), index.name, None)
+
+    def share(self, obj):
+        """
+        Publish obj when it is a large numpy backed ndarray, Index, Series or DataFrame
+        :param obj: any object
+        :return: handle to pass to workers, or obj itself when it is not shared
+        """
+        if isinstance(obj, np.ndarray):
+            if _plain(obj) is None or obj.nbytes < self._minBytes:
+                return obj
+            return self._array(obj)
+        if isinstance(obj, pd.Index):
+            if obj.memory_usage() < self._minBytes:
+                return obj
+            return self._index(obj)
+        if isinstance(obj, pd.Series):
+            values = _plain(obj.values)
+            if values is None or obj.memory_usage(index=True) < self._minBytes:
+                return obj
+            return _Series(self._array(values), self._index(obj.index), obj.name)
+        if isinstance(obj, pd.DataFrame):
+            columns = [(c, _plain(obj[c].values)) for c in obj.columns]
+            if not obj.columns.is_unique or any(v is None for _, v in columns) or \
+                    obj.memory_usage(index=True).sum() < self._minBytes:
+                return obj
+            return _Frame([(c, self._array(v)) for c, v in columns], self._index(obj.index))
+        return obj
+
+    def share_slices(self, obj, parts):
+        """
+        Publish obj once and return one positional slice handle per part
+        :param obj: sliceable object (e.g. the atoms of mp_pandas_obj)
+        :param parts: partition boundaries
+        :return: list of slice handles (or plain slices when obj is not shared)
+        """
+        shared = self.share(obj)
+        if shared is obj:
+            return [obj[parts[i - 1]:parts[i]] for i in range(1, len(parts))]
+        return [_Slice(shared, parts[i - 1], parts[i]) for i in range(1, len(parts))]
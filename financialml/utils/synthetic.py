@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Deterministic synthetic market data.
+
+Ticks follow a log random walk rounded to the tick size, with a fixed
+spread, heavy tailed trade sizes and rare bad prints (for mad_outlier).
+Every trading day is drawn from its own generator seeded by (seed, day),
+so the output only depends on the parameters, days can be produced in any
+chunking, and 10^9 rows are written in bounded memory.
+"""
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['date', 'time', 'price', 'bid', 'ask', 'size']
+SESSION_OPEN = 9 * 3600 + 1800  # 09:30:00
+SESSION_SECONDS = 23400         # until 16:00:00
+# HH:MM:SS of every second of the session
+_TIMES = np.array([f"{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d}"
+                   for t in range(SESSION_OPEN, SESSION_OPEN + SESSION_SECONDS)], dtype=object)
+
+
+class TickGenerator(object):
+    def __init__(self, n, start='2009-09-28', ticks_per_day=86000, seed=0, price0=50., sigma=2e-4,
+                 tick=0.01, spread=2, outliers=1e-4):
+        """
+        :param n: number of ticks
+        :param start: first trading day
+        :param ticks_per_day: ticks of a full day, the last day is cut at n
+        :param seed: random seed
+        :param price0: first price
+        :param sigma: standard deviation of the log return per tick
+        :param tick: price increment
+        :param spread: ask - bid, in ticks
+        :param outliers: probability of a bad print
+        """
+        object.__init__(self)
+        self.n, self.ticks_per_day, self.seed = n, ticks_per_day, seed
+        self.price0, self.sigma, self.tick, self.spread, self.outliers = price0, sigma, tick, spread, outliers
+        numDays = -(-n // ticks_per_day)
+        self.days = pd.bdate_range(start, periods=numDays)
+
+    def _round(self, price):
+        # k / 100 is the double closest to the decimal k/100 that gets written, k * .01 is not
+        scale = 1. / self.tick
+        return np.round(price * scale) / scale
+
+    def _day(self, i, logp):
+        # ticks of day i starting from log price logp, and the log price at the close
+        rows = min(self.ticks_per_day, self.n - i * self.ticks_per_day)
+        rng = np.random.default_rng([self.seed, i])
+        seconds = np.sort(rng.integers(0, SESSION_SECONDS, rows)) + SESSION_OPEN
+        path = logp + np.cumsum(rng.normal(0., self.sigma, rows))
+        bad = rng.random(rows) < self.outliers
+        price = self._round(np.exp(path) * np.where(bad, rng.choice([.5, 1.5], rows), 1.))
+        half = self.spread * self.tick / 2.
+        # odd lots and a heavy tail of block trades
+        size = np.where(rng.random(rows) < .99, rng.integers(1, 5000, rows),
+                        100 * rng.geometric(.01, rows)).astype(np.int64)
+        df = pd.DataFrame({'price': price, 'bid': self._round(price - half), 'ask': self._round(price + half),
+                           'size': size})
+        return seconds, df, path[-1]
+
+    def _days(self):
+        logp = np.log(self.price0)
+        for i in range(self.days.shape[0]):
+            seconds, df, logp = self._day(i, logp)
+            yield i, seconds, df
+
+    def __iter__(self):
+        """ :return: iterator over tick frames (index dates; price, bid, ask, size), one per day """
+        for i, seconds, df in self._days():
+            df.index = pd.DatetimeIndex(self.days[i] + pd.to_timedelta(seconds, unit='s'), name='dates')
+            yield df
+
+    def ticks(self):
+        """ :return: pd.DataFrame all ticks with v and dv, like load_bars """
+        df = pd.concat(list(self))
+        df['v'] = df['size']
+        df['dv'] = df['price'] * df['size']
+        return df
+
+    def write(self, path):
+        """ Write the ticks as a kibot style text file (see load_bars), one day at a time """
+        with open(path, 'w') as f:
+            for i, seconds, df in self._days():
+                df.insert(0, 'time', _TIMES[seconds - SESSION_OPEN])
+                df.insert(0, 'date', self.days[i].strftime('%m/%d/%Y'))
+                df.to_csv(f, header=False, index=False, columns=COLUMNS, float_format='%.2f')
+
+
+def daily_bars(n, start='2004-08-19', seed=0, price0=100., sigma=.02):
+    """
+    Daily OHLCV bars, the layout of Google.csv
+    :param n: number of business days
+    :param start: first day
+    :param seed: random seed
+    :param price0: first open
+    :param sigma: standard deviation of the daily log return
+    :return: pd.DataFrame columns Date, Open, High, Low, Close, Volume
+    """
+    rng = np.random.default_rng(seed)
+    close = price0 * np.exp(np.cumsum(rng.normal(0., sigma, n)))
+    open_ = np.concatenate([[price0], close[:-1]])
+    wick = np.abs(rng.normal(0., sigma / 2., (2, n)))
+    high = np.maximum(open_, close) * np.exp(wick[0])
+    low = np.minimum(open_, close) * np.exp(-wick[1])
+    volume = rng.integers(1000000, 10000000, n)
+    return pd.DataFrame({'Date': pd.bdate_range(start, periods=n).strftime('%Y-%m-%d'), 'Open': open_,
+                         'High': high, 'Low': low, 'Close': close, 'Volume': volume})
+
+
+def minute_close(n, start='2009-09-28', seed=0, price0=50., sigma=5e-4):
+    """
+    Close series with unique minute timestamps, the input of ch2 and ch3
+    :return: pd.Series
+    """
+    rng = np.random.default_rng(seed)
+    close = price0 * np.exp(np.cumsum(rng.normal(0., sigma, n)))
+    return pd.Series(close, index=pd.date_range(start, periods=n, freq='min', name='dates'))
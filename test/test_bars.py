@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 # -*- encoding: utf-8 -*-
-import unittest, sys
+import unittest, sys, tempfile, shutil
 sys.path.append("..")
 from financialml.ch1.bars import (
     load_bars,
@@ -10,47 +10,67 @@ from financialml.ch1.bars import (
     get_volume_bars,
     get_dollar_bars,
     get_sample_data,
-    plot_sample_data)
+    plot_sample_data,
+    volume_bars_idx,
+    dollar_bars_idx,
+    get_ohlcv,
+    get_bar_ids)
+from financialml.ch1.sampling import threshold_bars_idx, parallel_bars_idx
+from financialml.ch1.loader import parse_timestamps
+from financialml.ch1.tickstore import TickStore, INDEX_FILE
+from financialml.ch1.builder import BarBuilder
+from financialml.ch1.daskbars import load_bars_dask, get_tick_bars_dask, get_dollar_bars_dask, get_ohlc_dask
+from financialml.ch1.ticks import TickFrame, BarView
+from financialml.ch1.outliers import RollingMad, SketchMad, _RollingMedian
+from financialml.ch1.infobars import info_bars_idx, get_imbalance_bars, get_run_bars
+from financialml.utils.executor import get_executor
+from financialml.utils.synthetic import TickGenerator
 from pathlib import Path
 import matplotlib.pyplot as plt
 import pandas as pd
-from multiprocessing import Pool, cpu_count
+import numpy as np
+from multiprocessing import cpu_count
 
 
 class TestBase(unittest.TestCase):
     _data_filepath = "../data/IVE_tickbidask.txt"
-    _data_filepath_parq = "../data/IVE_tickbidask_clean.parq"
+    _data_filepath_store = "../data/IVE_tickbidask_clean"
 
     @classmethod
     def setUpClass(cls):
-        file = Path(cls._data_filepath_parq)
-        if file.exists():
-            cls._data = pd.read_parquet(file)
+        # plots and synthetic fixtures, removed with the class
+        cls._output = Path(tempfile.mkdtemp())
+        path_store = Path(cls._data_filepath_store)
+        if (path_store / INDEX_FILE).exists():
+            cls._store = TickStore(path_store)
         else:
             # load from raw data
             path = Path(cls._data_filepath)
+            if not path.exists():
+                # synthetic ticks when the kibot sample is not available, kept out of data/
+                path, path_store = cls._output / "synthetic_ticks.txt", cls._output / "synthetic_ticks_clean"
+                TickGenerator(300000).write(path)
             data = load_bars(path)
             # sns.boxplot(data.price)
             # plt.show()
             # clean data
             outliers = mad_outlier(data.price.values.reshape(-1, 1))
-            cls._data = data.loc[~outliers]
             # save to compact format
-            path_parq_clean = Path(cls._data_filepath_parq)
-            cls._data.to_parquet(path_parq_clean)
+            cls._store = TickStore.create(path_store, data.loc[~outliers])
+        cls._data = cls._store.read()
 
         cls._sample_date = "2009-10-01"
         cls._m = 100
-        cls._pool = Pool(cpu_count())
+        cls._pool = get_executor('process', cpu_count())
         cls._plot_enable = True
 
     @classmethod
     def tearDownClass(cls):
         try:
             cls._pool.close()
-            cls._pool.join()
         except Exception as e:
             print(str(e))
+        shutil.rmtree(cls._output, ignore_errors=True)
 
     def count_bars(self, df, price_col='price'):
         return df.groupby(pd.Grouper(freq='1W'))[price_col].count()
@@ -59,6 +79,109 @@ class TestBase(unittest.TestCase):
     def scale(self, df):
         return (df-df.min())/(df.max()-df.min())
 
+class TestLoader(unittest.TestCase):
+    def setUp(self):
+        self._root = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self._root, ignore_errors=True)
+
+    def test_synthetic_ticks(self):
+        ticks = TickGenerator(50000, ticks_per_day=20000, seed=1).ticks()
+        self.assertEqual(ticks.shape[0], 50000)
+        self.assertEqual(len(ticks.index.normalize().unique()), 3)
+        self.assertTrue(ticks.equals(TickGenerator(50000, ticks_per_day=20000, seed=1).ticks()))
+        self.assertFalse(ticks.equals(TickGenerator(50000, ticks_per_day=20000, seed=2).ticks()))
+        self.assertTrue((ticks.ask - ticks.bid).round(2).eq(0.02).all())
+        # written prices read back exactly
+        path = self._root / "synthetic_ticks.txt"
+        TickGenerator(50000, ticks_per_day=20000, seed=1).write(path)
+        data = pd.concat(list(load_bars(path, chunksize=10000, iterator=True)))
+        self.assertTrue(data.index.isin(ticks.index).all())
+        self.assertTrue(np.isin(data.price.values, ticks.price.values).all())
+
+    def test_outliers(self):
+        ticks = TickGenerator(100000, ticks_per_day=40000, seed=3).ticks()
+        prices = ticks.price.values
+        # rolling median state carries over chunks
+        for window in [1, 2, 7, 1000]:
+            median = _RollingMedian(window)
+            chunked = np.concatenate([median(prices[i:i + 30000]) for i in range(0, prices.shape[0], 30000)])
+            expected = pd.Series(prices).rolling(window, min_periods=1).median().values
+            self.assertTrue(np.array_equal(chunked, expected))
+        rolling = RollingMad(5000, threshold=10., min_mad=.01)
+        chunked = np.concatenate([rolling.mask(prices[i:i + 30000]) for i in range(0, prices.shape[0], 30000)])
+        self.assertTrue(np.array_equal(chunked, RollingMad(5000, threshold=10., min_mad=.01).mask(prices)))
+        # the bad prints of the generator, about one per 10^4 ticks
+        self.assertTrue(0 < chunked.sum() < 50)
+        # the histogram at the tick size gives the exact global median and MAD
+        self.assertTrue(np.array_equal(SketchMad().mask(prices), mad_outlier(prices.reshape(-1, 1))))
+        # ingestion drops the flagged ticks
+        path = self._root / "synthetic_ticks.txt"
+        TickGenerator(100000, ticks_per_day=40000, seed=3).write(path)
+        data = load_bars(path, chunksize=30000)
+        clean = load_bars(path, chunksize=30000, outliers=RollingMad(5000, threshold=10., min_mad=.01))
+        flagged = RollingMad(5000, threshold=10., min_mad=.01).mask(data.price.values)
+        self.assertTrue(clean.equals(data.loc[~flagged]))
+        sketch = load_bars(path, chunksize=30000, outliers=SketchMad())
+        self.assertTrue(sketch.equals(data.loc[~mad_outlier(data.price.values.reshape(-1, 1))]))
+        compact = load_bars(path, chunksize=30000, outliers=SketchMad(), compact='int32')
+        self.assertTrue(compact.to_frame().equals(sketch))
+        # the histogram is filled after the duplicates are dropped, repeated records do not move it
+        lines = path.read_text().splitlines(keepends=True)
+        repeated = self._root / "repeated_ticks.txt"
+        repeated.write_text(''.join(line * 4 if i < 30000 else line for i, line in enumerate(lines)))
+        raw = SketchMad()
+        raw.update(pd.read_csv(repeated, header=None).iloc[:, 2].values)
+        deduped = SketchMad()
+        deduped.update(data.price.values)
+        self.assertNotEqual(raw.stats, deduped.stats)
+        for chunksize in [None, 30000]:
+            filtered = SketchMad()
+            sketch = load_bars(repeated, chunksize=chunksize, outliers=filtered)
+            self.assertEqual(filtered.stats, deduped.stats)
+            self.assertTrue(sketch.equals(data.loc[~mad_outlier(data.price.values.reshape(-1, 1))]))
+
+    def test_dask_bars(self):
+        path = self._root / "synthetic_ticks.txt"
+        TickGenerator(100000, ticks_per_day=40000, seed=4).write(path)
+        ticks = load_bars_dask(path, blocksize=1 << 20)
+        self.assertTrue(ticks.npartitions > 2)
+        data = load_bars(path, chunksize=30000)
+        self.assertTrue(ticks.compute().equals(data))
+        # running sums carried over partitions give the in-memory bars
+        d_bars = get_dollar_bars_dask(ticks, "dv", 1000000).compute()
+        self.assertTrue(d_bars.equals(get_dollar_bars(data, "dv", 1000000)))
+        self.assertTrue(get_tick_bars_dask(ticks, "price", 333).compute().equals(get_tick_bars(data, "price", 333)))
+        self.assertTrue(get_ohlc_dask(ticks, d_bars).equals(get_ohlc(data, d_bars)))
+
+    def test_parse_timestamps(self):
+        date = ["09/28/2009", "12/31/1999", "02/29/2012", "1/2/2010"]
+        time = ["09:30:00", "23:59:59", "00:00:01", "9:30:00"]
+        expected = pd.to_datetime(pd.Series(date) + pd.Series(time), format="%m/%d/%Y%H:%M:%S")
+        # fixed layout fast path
+        self.assertTrue((parse_timestamps(date[:3], time[:3]) == expected[:3]).all())
+        # non padded fields fall back to pd.to_datetime
+        self.assertTrue((parse_timestamps(date, time) == expected).all())
+
+    def test_chunked_load(self):
+        rows = ["09/28/2009,09:30:00,50.79,50.70,50.79,100",
+                "09/28/2009,09:30:00,50.79,50.70,50.79,100",  # repeated record
+                "09/28/2009,09:30:01,50.80,50.70,50.80,200",
+                "09/28/2009,09:30:02,50.79,50.70,50.79,100",  # same values, later
+                "09/28/2009,09:30:02,50.79,50.70,50.79,100",
+                "09/28/2009,09:30:03,50.81,50.80,50.81,300"]
+        path = self._root / "ticks.txt"
+        path.write_text("\n".join(rows) + "\n")
+        for duplicates, n in [('repeated', 4), ('all', 3), (None, 6)]:
+            data = load_bars(path, duplicates=duplicates)
+            self.assertEqual(data.shape[0], n)
+            for chunksize in [1, 2, 3, 10]:
+                chunked = load_bars(path, chunksize=chunksize, duplicates=duplicates)
+                self.assertTrue(chunked.equals(data))
+        with self.assertRaises(ValueError):
+            load_bars(path, duplicates='first')
+
 """ Plotters """
 class PlotTicks(object):
     def __init__(self, fname=None):
@@ -71,6 +194,10 @@ class PlotTicks(object):
             plt.savefig(self._fname)
 
 class PlotTickCounts(object):
+    def __init__(self, fname):
+        object.__init__(self)
+        self._fname = fname
+
     def __call__(self, tc, vc, dc):
         f, ax = plt.subplots(figsize=(10,7))
         tc.plot(ax=ax, ls='-', label='tick count')
@@ -78,7 +205,7 @@ class PlotTickCounts(object):
         dc.plot(ax=ax, ls='-.', label='dollar count')
         ax.set_title('scaled bar counts')
         ax.legend()
-        plt.savefig("../data/tick_counts.pdf")
+        plt.savefig(self._fname)
 
 class TestBars(TestBase):
     #@unittest.skip
@@ -86,7 +213,7 @@ class TestBars(TestBase):
         t_bars = get_tick_bars(self._data, "price", m=self._m)
         xdf, xtdf = get_sample_data(self._data, t_bars, "price", self._sample_date)
         if self._plot_enable:
-            self._pool.apply_async(PlotTicks("../data/ch1_tbars.pdf"), (xdf, xtdf)).get()
+            self._pool.apply(PlotTicks(self._output / "ch1_tbars.pdf"), (xdf, xtdf))
 
         tick_bars_ohlc = get_ohlc(self._data, t_bars)
         print(tick_bars_ohlc.head())
@@ -99,7 +226,7 @@ class TestBars(TestBase):
         xdf, xtdf = get_sample_data(self._data, v_bars, 'price', self._sample_date)
         print(f'xdf shape: {xdf.shape}, xtdf shape: {xtdf.shape}')
         if self._plot_enable:
-            self._pool.apply_async(PlotTicks("../data/ch1_vbars.pdf"), (xdf, xtdf)).get()
+            self._pool.apply(PlotTicks(self._output / "ch1_vbars.pdf"), (xdf, xtdf))
         self.assertTrue(True)
 
     def test_dollar_bars(self):
@@ -108,7 +235,7 @@ class TestBars(TestBase):
         xdf, xtdf = get_sample_data(self._data, d_bars, 'price', self._sample_date)
         print(f'xdf shape: {xdf.shape}, xtdf shape: {xtdf.shape}')
         if self._plot_enable:
-            self._pool.apply_async(PlotTicks("../data/ch1_dbars.pdf"), (xdf, xtdf)).get()
+            self._pool.apply(PlotTicks(self._output / "ch1_dbars.pdf"), (xdf, xtdf))
         self.assertTrue(True)
 
     #@unittest.skip
@@ -122,7 +249,7 @@ class TestBars(TestBase):
         dfc = self.scale(self.count_bars(self._data))
 
         if self._plot_enable:
-           self._pool.apply_async(PlotTickCounts(), (tc, vc, dc)).get()
+           self._pool.apply(PlotTickCounts(self._output / "tick_counts.pdf"), (tc, vc, dc))
 
         # stable bar counts
         bar_types = ['tick', 'volume', 'dollar', 'df']
@@ -131,3 +258,100 @@ class TestBars(TestBase):
         counts = counts.sort_values()
         print(counts)
         self.assertTrue(True)
+
+    def test_ohlcv(self):
+        m = 1000000
+        idx = dollar_bars_idx(self._data, "dv", m)
+        ohlcv = get_ohlcv(self._data, idx)
+        ids = get_bar_ids(self._data.shape[0], idx)
+        ticks = self._data.assign(bar=ids)[ids < len(idx)]
+        expected = ticks.groupby('bar').agg(
+            high=('price', 'max'), low=('price', 'min'), dollar_volume=('dv', 'sum'), ticks=('price', 'size'))
+        for col in expected.columns:
+            self.assertTrue(np.allclose(ohlcv[col].values, expected[col].values))
+        self.assertTrue((ohlcv['dollar_volume'] >= m).all())
+        self.assertTrue((ohlcv['close'].values == self._data['price'].values[idx]).all())
+
+    def test_bar_builder(self):
+        m = 1000000
+        expected = get_ohlcv(self._data, dollar_bars_idx(self._data, "dv", m))
+        builder, out = BarBuilder('dollar', m), []
+        for i in range(0, self._data.shape[0], 10000):
+            out.append(builder.update_batch(self._data.iloc[i:i + 10000]))
+            # checkpoint / restore between batches
+            builder = BarBuilder.from_state(builder.get_state())
+        bars = pd.concat(out, ignore_index=True)
+        self.assertTrue((bars['end'].values == expected['end'].values).all())
+        self.assertTrue(np.allclose(bars['high'].values, expected['high'].values))
+        self.assertTrue((bars['ticks'].values == expected['ticks'].values).all())
+
+        # tick by tick
+        builder, ticks = BarBuilder('dollar', m), self._data.iloc[:10000]
+        closed = [builder.update(t, p, s) for t, p, s in zip(ticks.index, ticks['price'], ticks['size'])]
+        closed = [bar.end for bar in closed if bar is not None]
+        self.assertTrue((pd.DatetimeIndex(closed) == expected['end'].iloc[:len(closed)].values).all())
+
+    def test_parallel_bars(self):
+        expected = dollar_bars_idx(self._data, "dv", 1000000)
+        idx = dollar_bars_idx(self._data, "dv", 1000000, numThreads=2)
+        self.assertTrue(np.array_equal(idx, expected))
+        idx = parallel_bars_idx(self._data["dv"].values, 1000000, numThreads=2, mpBatches=4)
+        self.assertTrue(np.array_equal(idx, expected))
+
+    def test_info_bars(self):
+        for kind in ['imbalance', 'run']:
+            idx, thresholds, _ = info_bars_idx(self._data, 'dollar', kind, expected_ticks=self._m, min_ticks=10)
+            # state carried across blocks gives the single pass result
+            half = self._data.shape[0] // 2
+            idx0, _, state = info_bars_idx(self._data.iloc[:half], 'dollar', kind, self._m, min_ticks=10)
+            idx1, _, _ = info_bars_idx(self._data.iloc[half:], 'dollar', kind, self._m, min_ticks=10, state=state)
+            self.assertTrue(np.array_equal(idx, np.r_[idx0, idx1 + half]))
+            self.assertTrue((thresholds > 0).all())
+        print(get_imbalance_bars(self._data, 'tick', self._m, min_ticks=10).shape,
+              get_run_bars(self._data, 'volume', self._m).shape)
+
+    def test_compact_ticks(self):
+        ticks = TickFrame.from_frame(self._data)
+        self.assertTrue(ticks.nbytes <= self._data.memory_usage().sum() / 2)
+        # cent prices round trip exactly, v and dv are rebuilt
+        for col in self._data.columns:
+            self.assertTrue(np.array_equal(ticks[col].values, self._data[col].values))
+        self.assertTrue(ticks.index.equals(self._data.index))
+        bars = get_dollar_bars(ticks, "dv", 1000000)
+        self.assertTrue(isinstance(bars, BarView))
+        expected = get_dollar_bars(self._data, "dv", 1000000)
+        self.assertTrue(bars.index.equals(expected.index))
+        self.assertTrue(np.array_equal(bars['price'].values, expected['price'].values))
+        idx = dollar_bars_idx(ticks, "dv", 1000000)
+        self.assertTrue(get_ohlcv(ticks, idx).equals(get_ohlcv(self._data, idx)))
+        self.assertTrue(get_ohlc(ticks, bars).equals(get_ohlc(self._data, expected)))
+        # float32 prices are within float32 precision
+        ticks = TickFrame.from_frame(self._data, 'float32')
+        self.assertTrue(np.allclose(ticks['price'].values, self._data['price'].values, rtol=1e-6, atol=0))
+
+    def test_tick_store(self):
+        day = self._store.read_day(self._sample_date)
+        self.assertTrue(day.equals(self._data.loc[self._sample_date]))
+        entry = self._store.locate(self._sample_date)
+        self.assertEqual(entry['rows'], day.shape[0])
+        xdf, _ = get_sample_data(self._store, self._data, 'price', self._sample_date)
+        self.assertTrue(xdf.equals(day['price']))
+
+    def test_sampling_engine(self):
+        def reference(values, m):
+            ts, idx = 0, []
+            for i, x in enumerate(values):
+                ts += x
+                if ts >= m:
+                    idx.append(i)
+                    ts = 0
+            return idx
+
+        v_idx = volume_bars_idx(self._data, "v", 1000)
+        self.assertTrue(np.array_equal(v_idx, reference(self._data["v"].values, 1000)))
+        d_ref = reference(self._data["dv"].values, 1000000)
+        d_idx = dollar_bars_idx(self._data, "dv", 1000000)
+        self.assertTrue(np.array_equal(d_idx, d_ref))
+        # chunked evaluation carries the running sum across chunks
+        d_idx = threshold_bars_idx(self._data["dv"].values, 1000000, progress=True, chunksize=4096)
+        self.assertTrue(np.array_equal(d_idx, d_ref))
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+import unittest, sys, tempfile, shutil
+sys.path.append("..")
+from financialml.utils.cache import Cache, hash_args, INDEX_FILE
+from financialml.ch2.cusumfilter import get_daily_vol, cusum_filter_close_batch
+from financialml.ch3.triplebarrier import get_events, get_t1
+from financialml.utils.synthetic import daily_bars
+from pathlib import Path
+import pandas as pd
+import numpy as np
+
+
+class TestBase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = Path("../data/Google.csv")
+        # synthetic daily bars when the sample is not available, nothing is written to data/
+        df = pd.read_csv(path) if path.exists() else daily_bars(3400)
+        df.index = pd.DatetimeIndex(df['Date'].values)
+        cls._close = df["Close"]
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._root, ignore_errors=True)
+
+
+class TestCache(TestBase):
+    def test_memoize(self):
+        cache = Cache(self._root)
+        daily_vol = cache.memoize(get_daily_vol)
+        batch = cache.memoize(cusum_filter_close_batch)
+        events = cache.memoize(get_events, ignore=['numThreads', 'backend'])
+        for _ in range(2):
+            vol = daily_vol(self._close, span=[30, 100])
+            tEvents = batch(self._close, vol[30], [1., 2.])
+            t1 = get_t1(self._close, tEvents[1.], numDays=1)
+            events_ = events(self._close, tEvents[1.], [1, 1], vol[30], t1=t1)
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertTrue(vol.equals(get_daily_vol(self._close, span=[30, 100])))
+        self.assertTrue(tEvents[2.].equals(cusum_filter_close_batch(self._close, vol[30], [2.])[2.]))
+        self.assertTrue(events_.equals(get_events(self._close, tEvents[1.], [1, 1], vol[30], t1=t1)))
+        # ignored arguments hit, changed data misses
+        events(self._close, tEvents[1.], [1, 1], vol[30], t1=t1, numThreads=2)
+        self.assertEqual(cache.hits, 4)
+        close = self._close.copy()
+        close.iloc[10] += 1.
+        daily_vol(close, span=[30, 100])
+        self.assertEqual(cache.misses, 4)
+        # the index survives reopening
+        self.assertEqual(len(Cache(self._root)), 4)
+
+    def test_files_and_eviction(self):
+        path = Path(self._root) / 'close.csv'
+        self._close.to_csv(path)
+        cache = Cache(Path(self._root) / 'cache', maxBytes=1 << 20)
+        read = cache.memoize(lambda path: pd.read_csv(path, index_col=0).iloc[:, 0].values)
+        np.testing.assert_allclose(read(path), self._close.values)
+        read(path)
+        self.assertEqual(cache.hits, 1)
+        self._close.iloc[:100].to_csv(path)
+        self.assertEqual(read(path).shape[0], 100)
+        # least recently used results go first
+        for i in range(20):
+            cache.put(f"{i:040x}", np.full(100000, i, dtype=np.float64))
+        self.assertTrue(cache.nbytes <= cache.maxBytes)
+        self.assertTrue(f"{19:040x}" in cache)
+        self.assertFalse(f"{0:040x}" in cache)
+
+    def test_keys_and_sharing(self):
+        root = Path(self._root)
+        path = root / 'close.csv'
+        self._close.to_csv(path)
+        cache = Cache(root / 'cache')
+        read = lambda path, col='Close': pd.read_csv(path)[col]
+        key = cache.key(read, (str(path),))
+        key_path = cache.key(read, (str(path),), paths=['path'])
+        self._close.iloc[:10].to_csv(path)
+        # str arguments are values unless named in paths
+        self.assertEqual(cache.key(read, (str(path),)), key)
+        self.assertNotEqual(cache.key(read, (str(path),), paths=['path']), key_path)
+        self.assertEqual(hash_args(1.0, [2], {'a': True}),
+                         hash_args(np.float64(1.0), [np.int64(2)], {'a': np.bool_(True)}))
+        self.assertNotEqual(hash_args(1.0), hash_args(1))
+        # hits do not rewrite the index, processes sharing the directory keep each other's entries
+        other = Cache(root / 'cache')
+        cache.put('a' * 40, np.arange(10))
+        other.put('b' * 40, np.arange(20))
+        mtime = (root / 'cache' / INDEX_FILE).stat().st_mtime_ns
+        self.assertTrue(cache.get('b' * 40)[0] and other.get('a' * 40)[0])
+        self.assertEqual((root / 'cache' / INDEX_FILE).stat().st_mtime_ns, mtime)
+        self.assertEqual(len(Cache(root / 'cache')), 2)
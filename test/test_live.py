@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+import unittest, sys, tempfile, shutil, asyncio
+sys.path.append("..")
+from financialml.ch3.live import LivePipeline, FileReplaySource, BarrierBook
+from financialml.ch1.loader import load_bars
+from financialml.ch1.bars import dollar_bars_idx, get_ohlcv
+from financialml.ch2.dailyvol import DailyVol
+from financialml.ch2.cusumfilter import cusum_filter_close, CusumFilter
+from financialml.ch3.triplebarrier import get_t1, get_events
+from financialml.ch3.bins import get_bins_w_metalabel
+from financialml.utils.synthetic import TickGenerator
+from financialml.utils import Recorder
+from pathlib import Path
+import pandas as pd
+import numpy as np
+
+
+class TestLive(unittest.TestCase):
+    def setUp(self):
+        self._root = Path(tempfile.mkdtemp())
+        self._path = self._root / 'ticks.txt'
+        # one tick per timestamp, every bar has its own close time
+        ticks = TickGenerator(100000, ticks_per_day=5000, seed=5).ticks()
+        df = ticks[~ticks.index.duplicated()].reset_index()
+        df.insert(0, 'time', df['dates'].dt.strftime('%H:%M:%S'))
+        df.insert(0, 'date', df['dates'].dt.strftime('%m/%d/%Y'))
+        df.to_csv(self._path, header=False, index=False, columns=['date', 'time', 'price', 'bid', 'ask', 'size'],
+                  float_format='%.2f')
+
+    def tearDown(self):
+        shutil.rmtree(self._root, ignore_errors=True)
+
+    def test_cusum_filter(self):
+        close = pd.Series(50. * np.exp(np.cumsum(np.random.default_rng(0).normal(0., 1e-3, 5000))),
+                          index=pd.date_range('2020-01-01', periods=5000, freq='min'))
+        h = pd.Series(np.where(np.arange(5000) < 100, np.nan, 2e-3), index=close.index)
+        cusum = CusumFilter()
+        online = close.index[[cusum.update(p, x) for p, x in zip(close.values, h.values)]]
+        self.assertTrue(online.equals(cusum_filter_close(close, h)))
+
+    def test_live_pipeline(self):
+        m, span, ptsl = 5000000, 20, (1, 2)
+        # batch labels from the volatility known at every bar
+        ticks = load_bars(self._path, chunksize=50000)
+        bars = get_ohlcv(ticks, dollar_bars_idx(ticks, 'dv', m))
+        close = pd.Series(bars['close'].values, index=pd.DatetimeIndex(bars['end'].values))
+        estimator, vol = DailyVol(span), []
+        for t, price in close.items():
+            estimator.update(t, price)
+            vol.append(estimator.value[0])
+        vol = pd.Series(vol, index=close.index)
+        tEvents = cusum_filter_close(close, vol)
+        events = get_events(close, tEvents, list(ptsl), vol, t1=get_t1(close, tEvents, numDays=1))
+        expected = events.join(get_bins_w_metalabel(events, close)).dropna(subset=['bin'])
+
+        pipeline, seen = LivePipeline('dollar', m, span, 1, ptsl, maxQueue=500), []
+        with Recorder() as rec:
+            labels = asyncio.run(pipeline.run(FileReplaySource(self._path, chunksize=20000)))
+        self.assertTrue(labels.equals(expected))
+        stats = pipeline.stats
+        self.assertEqual(stats['ticks'], ticks.shape[0])
+        self.assertEqual(stats['labels'] + stats['open'], stats['events'])
+        self.assertTrue(stats['queue_max'] <= 500)
+        self.assertTrue(any(e.name == 'ch3.live' for e in rec.events))
+
+    def test_barrier_book(self):
+        book = BarrierBook(ptsl=(1, 1), numDays=1)
+        t0 = pd.Timestamp('2020-01-01 10:00')
+        self.assertTrue(book.open(t0, 100., 0.01))
+        self.assertFalse(book.open(t0, 100., 0.))
+        self.assertEqual(book.update(t0 + pd.Timedelta(hours=1), 100.5), [])
+        # the return has to exceed the target
+        label, = book.update(t0 + pd.Timedelta(hours=2), 101.01)
+        self.assertEqual((label.barrier, label.bin), ('pt', 1.))
+        book.open(t0, 100., 0.01)
+        label, = book.update(t0 + pd.Timedelta(days=1), 99.5)
+        self.assertEqual((label.barrier, label.bin), ('t1', 0.))
+        self.assertEqual(len(book), 0)
@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+import unittest, sys, operator, io
+sys.path.append("..")
+from financialml.utils.mp import mp_pandas_obj, weighted_parts
+from financialml.utils.shm import SharedStore, resolve
+from financialml.utils.executor import get_executor, Executor, ThreadExecutor
+from financialml.utils.metrics import Recorder, ProgressLogger, add_callback, remove_callback, enabled, instrument
+from financialml.ch2.cusumfilter import get_daily_vol
+import pandas as pd
+import numpy as np
+
+
+def double(molecule, close):
+    return close.loc[molecule] * 2
+
+
+def total(molecule, close):
+    return close.loc[molecule].sum()
+
+
+class TestBase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        n = 500000
+        index = pd.date_range("2009-09-28", periods=n, freq="s")
+        cls._close = pd.Series(np.random.default_rng(0).random(n), index=index)
+
+
+class TestMp(TestBase):
+    def test_shared_store(self):
+        events = pd.DataFrame({'trgt': self._close.values, 't1': self._close.index}, index=self._close.index)
+        with SharedStore(minBytes=0) as store:
+            close = resolve(store.share(self._close))
+            self.assertTrue(isinstance(close.values, np.memmap))
+            self.assertTrue(close.equals(self._close))
+            self.assertTrue(resolve(store.share(events)).equals(events))
+
+    def test_mp_pandas_obj_shared(self):
+        expected = self._close * 2
+        for shared in [False, True]:
+            out = mp_pandas_obj(double, ('molecule', self._close.index), 2, mpBatches=2,
+                                shared=shared, close=self._close)
+            self.assertTrue(out.equals(expected))
+
+    def test_mp_pandas_obj_order(self):
+        # unsorted atoms still come back sorted, sorted atoms in molecule order
+        atoms = self._close.index[::-1]
+        for backend in ['process', 'thread']:
+            out = mp_pandas_obj(double, ('molecule', atoms), 3, mpBatches=3, backend=backend,
+                                close=self._close)
+            self.assertTrue(out.equals(self._close * 2))
+
+    def test_mp_pandas_obj_reducer(self):
+        for numThreads in [1, 3]:
+            out = mp_pandas_obj(total, ('molecule', self._close.index), numThreads, mpBatches=4,
+                                reducer=operator.add, reducerInit=0., close=self._close)
+            self.assertAlmostEqual(out, self._close.sum(), places=6)
+
+    def test_weighted_parts(self):
+        weights = np.ones(8)
+        weights[4] = 10
+        # the heavy atom is a molecule of its own, the heaviest molecule costs 10
+        self.assertEqual(weighted_parts(weights, 3).tolist(), [0, 4, 5, 8])
+        self.assertEqual(weighted_parts(np.ones(10), 3).tolist(), [0, 4, 8, 10])
+        self.assertEqual(weighted_parts(np.ones(10), 4).tolist(), [0, 3, 6, 9, 10])
+        self.assertEqual(weighted_parts([1, 0, 0, 0, 0, 1], 4).tolist(), [0, 1, 2, 5, 6])
+        self.assertEqual(weighted_parts(np.zeros(2), 2).tolist(), [0, 1, 2])
+        # heavy atoms late in the index get molecules of their own, outputs keep index order
+        weights = np.arange(self._close.shape[0], dtype=np.float64) ** 2
+        out = mp_pandas_obj(double, ('molecule', self._close.index), 3, mpBatches=2,
+                            weights=weights, close=self._close)
+        self.assertTrue(out.equals(self._close * 2))
+
+    def test_executors(self):
+        self.assertIs(get_executor('process', 2), get_executor('process', 2))
+        self.assertIsNot(get_executor('thread', 2), get_executor('process', 2))
+        self.assertRaises(ValueError, get_executor, 'cluster')
+        self.assertRaises(TypeError, Executor)
+        # one executor per key when threads race to create it
+        with ThreadExecutor(8) as executor:
+            executors = executor.pool.map(lambda _: get_executor('thread', 5), range(32))
+        self.assertEqual(len(set(map(id, executors))), 1)
+        expected = self._close * 2
+        for backend in ['process', 'thread', 'sequential']:
+            out = mp_pandas_obj(double, ('molecule', self._close.index), 2, backend=backend, close=self._close)
+            self.assertTrue(out.equals(expected))
+        with ThreadExecutor(3) as executor:
+            out = mp_pandas_obj(double, ('molecule', self._close.index), 3, backend=executor, close=self._close)
+            self.assertTrue(out.equals(expected))
+
+    def test_metrics(self):
+        self.assertFalse(enabled())
+        stream = io.StringIO()
+        logger = add_callback(ProgressLogger(stream))
+        try:
+            with Recorder() as recorder:
+                mp_pandas_obj(double, ('molecule', self._close.index), 2, mpBatches=2, close=self._close)
+                get_daily_vol(self._close.iloc[:10000])
+        finally:
+            remove_callback(logger)
+        self.assertFalse(enabled())
+        df = recorder.to_frame()
+        jobs = df[df.kind == 'job']
+        self.assertEqual(sorted(jobs.job.tolist()), [0, 1, 2, 3])
+        stages = df[df.kind == 'stage'].set_index('name')
+        self.assertEqual(stages.loc['mp.process_jobs', 'rows'], 4)
+        self.assertTrue(0 < stages.loc['mp.process_jobs', 'utilization'])
+        self.assertTrue(stages.loc['ch2.get_daily_vol', 'seconds'] > 0)
+        self.assertIn(('stage', 'ch2.get_daily_vol'), recorder.summary().index)
+        self.assertTrue(stream.getvalue().endswith('minutes.\n'))
+
+    def test_stage_memory(self):
+        # memory is the peak of each stage, not the largest so far
+        big = instrument('big')(lambda: np.ones(1 << 23).sum())  # 64 MB
+        small = instrument('small')(lambda: np.ones(1 << 10).sum())
+        nested = instrument('nested')(lambda: big() + small())
+        with Recorder() as recorder:
+            big(), small(), nested()
+        memory = recorder.to_frame().set_index('name')['memory']
+        self.assertTrue(60 < memory.iloc[0] < 70)
+        self.assertTrue(memory.iloc[1] < 1)
+        self.assertTrue(memory.loc['nested'] >= memory.iloc[0])
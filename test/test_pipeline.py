@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+import unittest, sys, tempfile, shutil, os, signal
+sys.path.append("..")
+from financialml.ch3.pipeline import run_universe, label_symbol, read_labels, read_manifest
+from financialml.ch3.utils import macd_side
+from financialml.utils.synthetic import TickGenerator, daily_bars
+from pathlib import Path
+import pandas as pd
+
+
+def long_or_kill(close):
+    # side of a worker killed by the system while labeling the series named 'kill'
+    if close.name == 'kill':
+        os.kill(os.getpid(), signal.SIGKILL)
+    return pd.Series(1., index=close.index)
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self._root = Path(tempfile.mkdtemp())
+        self._universe = {}
+        for i in range(3):
+            path = self._root / f"S{i}.txt"
+            TickGenerator(60000, ticks_per_day=3000, seed=i).write(path)
+            self._universe[f"S{i}"] = str(path)
+        df = daily_bars(1000)
+        self._universe['G'] = pd.Series(df['Close'].values, index=pd.DatetimeIndex(df['Date'].values))
+        self._universe['BAD'] = str(self._root / 'missing.txt')
+        self._params = dict(bar_type='dollar', m=5e6, span=20, ptsl=(1, 1))
+
+    def tearDown(self):
+        shutil.rmtree(self._root, ignore_errors=True)
+
+    def test_run_universe(self):
+        labels = self._root / 'labels'
+        out = run_universe(self._universe, labels, numThreads=2, maxInFlight=2, **self._params)
+        self.assertEqual(out['status'].tolist(), ['done'] * 4 + ['failed'])
+        self.assertTrue('FileNotFoundError' in out.loc['BAD', 'error'])
+        for symbol in ['S0', 'G']:
+            expected = label_symbol(self._universe[symbol], **self._params)
+            self.assertTrue(pd.read_parquet(labels / f"{symbol}.parquet").equals(expected))
+            self.assertEqual(out.loc[symbol, 'events'], expected.shape[0])
+        # finished symbols are skipped, failed and changed ones are labeled again
+        TickGenerator(60000, ticks_per_day=3000, seed=9).write(self._universe['S1'])
+        out = run_universe(self._universe, labels, numThreads=2, backend='thread', **self._params)
+        self.assertEqual(out['status'].tolist(), ['skipped', 'done', 'skipped', 'skipped', 'failed'])
+        self.assertEqual(read_manifest(labels)['S1']['status'], 'done')
+        expected = label_symbol(self._universe['S1'], **self._params)
+        self.assertTrue(read_labels(labels).loc['S1'].equals(expected))
+        # other parameters label everything again
+        out = run_universe(self._universe, labels, numThreads=1, **dict(self._params, span=30))
+        self.assertEqual((out['status'] == 'done').sum(), 4)
+
+    def test_killed_worker_and_side(self):
+        labels = self._root / 'labels'
+        universe = dict(self._universe, G=self._universe['G'].rename('kill'))
+        out = run_universe(universe, labels, numThreads=2, maxInFlight=1, side=long_or_kill, **self._params)
+        self.assertEqual(out['status'].tolist(), ['done'] * 3 + ['failed'] * 2)
+        self.assertTrue('BrokenProcessPool' in out.loc['G', 'error'])
+        self.assertEqual(read_manifest(labels)['G']['status'], 'failed')
+        # module level functions are keys, lambdas are labeled again and do not pickle for processes
+        out = run_universe(self._universe, labels, numThreads=2, side=long_or_kill, **self._params)
+        self.assertEqual(out['status'].tolist(), ['skipped'] * 3 + ['done', 'failed'])
+        out = run_universe(self._universe, labels, numThreads=2, side=lambda close: long_or_kill(close),
+                           **self._params)
+        self.assertTrue(out['status'].eq('failed').all())
+        self.assertTrue('pickle' in out.loc['S0', 'error'])
+        for _ in range(2):
+            out = run_universe(self._universe, labels, numThreads=2, backend='thread',
+                               side=lambda close: long_or_kill(close), **self._params)
+            self.assertEqual(out['status'].tolist(), ['done'] * 4 + ['failed'])
+        # side names resolve in the worker
+        out = run_universe(self._universe, labels, numThreads=2, side='macd', **self._params)
+        self.assertEqual(out['status'].tolist(), ['done'] * 4 + ['failed'])
+        expected = label_symbol(self._universe['S2'], side=macd_side, **self._params)
+        self.assertTrue(read_labels(labels).loc['S2'].equals(expected))
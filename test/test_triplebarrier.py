@@ -2,20 +2,36 @@
 # -*- encoding: utf-8 -*-
 import unittest, sys
 sys.path.append("..")
-from financialml.ch2.cusumfilter import get_daily_vol, cusum_filter_close
-from financialml.ch3.triplebarrier import get_events, get_events_w_metalabel, get_t1
-from financialml.ch3.bins import get_bins, get_bins_w_metalabel
+from financialml.ch2.cusumfilter import get_daily_vol, cusum_filter_close, cusum_filter, cusum_filter_close_batch
+from financialml.ch2.dailyvol import DailyVol
+from financialml.ch3.triplebarrier import get_events, get_events_w_metalabel, get_t1, apply_ptslt1
+from financialml.ch3.bins import get_bins, get_bins_w_metalabel, get_bins_batch
+from financialml.ch3.grid import triple_barrier_grid
 from financialml.ch3.utils import macd_side, get_close
+from financialml.utils.synthetic import daily_bars
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import (accuracy_score, precision_score)
+from pathlib import Path
 import pandas as pd
 import numpy as np
 
 
+def baseline_daily_vol(close, span=100):
+    # get_daily_vol before DailyVol, pandas only
+    use_idx = close.index.searchsorted(close.index - pd.Timedelta(days=1))
+    use_idx = use_idx[use_idx > 0]
+    use_idx = np.unique(use_idx)
+    prev_idx = pd.Series(close.index[use_idx - 1], index=close.index[use_idx])
+    ret = close.loc[prev_idx.index] / close.loc[prev_idx.values].values - 1
+    return ret.ewm(span=span).std()
+
+
 class TestBase(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        df = pd.read_csv("../data/Google.csv")
+        path = Path("../data/Google.csv")
+        # synthetic daily bars when the sample is not available, nothing is written to data/
+        df = pd.read_csv(path) if path.exists() else daily_bars(3400)
         df.index = pd.DatetimeIndex(df['Date'].values)
         cls._close = df["Close"]
 
@@ -30,12 +46,68 @@ class TestTripleBarrier(TestBase):
         print("volatility:\n", volatility[:5])
         self.assertTrue(True)
 
+    def test_daily_vol_online(self):
+        expected = baseline_daily_vol(self._close, span=30)
+        # bar by bar
+        estimator, vols = DailyVol(30), {}
+        for t, price in self._close.items():
+            vol = estimator.update(t, price)
+            if vol is not None:
+                vols[estimator.timestamp] = vol
+        online = pd.Series(vols)
+        self.assertTrue(online.index.equals(expected.index))
+        np.testing.assert_allclose(online.values, expected.values)
+        # several spans in one pass, fed in batches
+        estimator = DailyVol([30, 100])
+        vols = pd.concat([estimator.update_batch(self._close.iloc[i:i + 250])
+                          for i in range(0, self._close.shape[0], 250)])
+        np.testing.assert_allclose(vols[30].values, expected.values)
+        np.testing.assert_allclose(vols[100].values, baseline_daily_vol(self._close, span=100).values)
+
+    def test_daily_vol_baseline(self):
+        # irregular intraday bars with overnight and weekend gaps and missing prices
+        rng = np.random.default_rng(3)
+        n = 5000
+        hours = np.cumsum(rng.exponential(3, n) * rng.choice([1, 1, 1, 30], n))
+        index = pd.Timestamp('2020-01-02 09:30') + pd.to_timedelta(hours, unit='h')
+        close = pd.Series(100 * np.exp(np.cumsum(rng.normal(0, .01, n))), index=pd.DatetimeIndex(index))
+        close.iloc[rng.choice(n, 100, replace=False)] = np.nan
+        expected = baseline_daily_vol(close, span=30)
+        self.assertTrue(expected.isna().any())
+        vol = get_daily_vol(close, span=30)
+        self.assertTrue(vol.index.equals(expected.index))
+        np.testing.assert_allclose(vol.values, expected.values)
+        # bar by bar and in uneven batches
+        estimator, vols = DailyVol(30), {}
+        for t, price in close.items():
+            v = estimator.update(t, price)
+            if v is not None:
+                vols[estimator.timestamp] = v
+        np.testing.assert_allclose(pd.Series(vols).values, expected.values)
+        estimator = DailyVol(30)
+        parts = np.split(np.arange(n), np.sort(rng.choice(np.arange(1, n), 20, replace=False)))
+        vols = pd.concat([estimator.update_batch(close.iloc[part]) for part in parts])
+        self.assertTrue(vols.index.equals(expected.index))
+        np.testing.assert_allclose(vols.values, expected.values)
+
     def test_cusum_filter(self):
         volatility = get_daily_vol(self._close, span=30)
         tEvents = cusum_filter_close(self._close, volatility)
         print("tEvents:\n", tEvents[:10])
         self.assertTrue(True)
 
+    def test_cusum_filter_batch(self):
+        volatility = get_daily_vol(self._close, span=30)
+        multipliers = [0.5, 1., 2.]
+        tEvents = cusum_filter_close_batch(self._close, volatility, multipliers)
+        for k in multipliers:
+            self.assertTrue(tEvents[k].equals(cusum_filter_close(self._close, volatility * k)))
+        self.assertTrue(len(tEvents[0.5]) >= len(tEvents[2.]))
+
+        tEvents = cusum_filter(np.log(self._close), 0.05)
+        print("tEvents:\n", tEvents[:10])
+        self.assertTrue(isinstance(tEvents, pd.DatetimeIndex))
+
     def test_get_t1(self):
         volatility = get_daily_vol(self._close, span=30)
         tEvents = cusum_filter_close(self._close, volatility)
@@ -43,6 +115,23 @@ class TestTripleBarrier(TestBase):
         print("t1:\n", t1[:5])
         self.assertTrue(True)
 
+    def test_apply_ptslt1(self):
+        volatility = get_daily_vol(self._close, span=30)
+        tEvents = cusum_filter_close(self._close, volatility)
+        t1 = get_t1(self._close, tEvents, numDays=5)
+        trgt = volatility.reindex(tEvents).dropna()
+        side = pd.Series(np.where(np.arange(trgt.shape[0]) % 2, 1., -1.), index=trgt.index)
+        events = pd.concat({'t1': t1, 'trgt': trgt, 'side': side}, axis=1).dropna(subset=['trgt'])
+        out = apply_ptslt1(self._close, events, [1, 2], events.index)
+
+        # scan every holding window
+        for loc, t1_ in events['t1'].fillna(self._close.index[-1]).items():
+            ret = (self._close[loc:t1_] / self._close[loc] - 1) * events.at[loc, 'side']
+            sl = ret[ret < -2 * events.at[loc, 'trgt']].index.min()
+            pt = ret[ret > events.at[loc, 'trgt']].index.min()
+            self.assertTrue(out.at[loc, 'sl'] == sl or (pd.isna(out.at[loc, 'sl']) and pd.isna(sl)))
+            self.assertTrue(out.at[loc, 'pt'] == pt or (pd.isna(out.at[loc, 'pt']) and pd.isna(pt)))
+
     def test_get_events(self):
         volatility = get_daily_vol(self._close, span=30)
         tEvents = cusum_filter_close(self._close, volatility)
@@ -66,6 +155,60 @@ class TestTripleBarrier(TestBase):
         print("bins:\n", bins[:5])
         self.assertTrue(True)
 
+    def test_get_bins_batch(self):
+        volatility = get_daily_vol(self._close, span=30)
+        tEvents = cusum_filter_close(self._close, volatility)
+        t1 = get_t1(self._close, tEvents, numDays=5)
+        events = {str(ptsl): get_events(self._close, tEvents, ptsl, trgt=volatility, t1=t1)
+                  for ptsl in [[1, 1], [2, 1], [0, 2]]}
+        bins = get_bins_batch(events, self._close)
+        for k, events_ in events.items():
+            expected = get_bins(events_, self._close)
+            self.assertTrue(bins[k].equals(expected))
+            # labels are the sign of the realized return up to t1
+            events_ = events_.dropna(subset=['t1'])
+            px = self._close.reindex(events_['t1'].values, method='bfill').values
+            np.testing.assert_allclose(expected['ret'].values, px / self._close[events_.index].values - 1.)
+        side = macd_side(self._close)
+        events = get_events_w_metalabel(self._close, tEvents, [1, 2], trgt=volatility, t1=t1, side=side)
+        bins = get_bins_batch({'meta': events}, self._close, metalabel=True)['meta']
+        self.assertTrue(bins.equals(get_bins_w_metalabel(events, self._close)))
+        self.assertTrue(set(bins['bin'].unique()) <= {0., 1.})
+
+    def test_triple_barrier_grid(self):
+        grid = triple_barrier_grid(self._close, spans=[30, 100], ptsls=[[1, 1], [2, 1], [0, 2]], numDays=[1, 5],
+                                   minRets=[0., 0.01])
+        self.assertEqual(grid.shape[0], 2 * 3 * 2 * 2)
+        self.assertTrue(grid.equals(triple_barrier_grid(self._close, spans=[30, 100], ptsls=[[1, 1], [2, 1], [0, 2]],
+                                                        numDays=[1, 5], minRets=[0., 0.01], numThreads=3)))
+        for _, row in grid.iloc[::5].iterrows():
+            volatility = get_daily_vol(self._close, span=row.span)
+            tEvents = cusum_filter_close(self._close, volatility)
+            t1 = get_t1(self._close, tEvents, numDays=row.numDays)
+            events = get_events(self._close, tEvents, [row.pt, row.sl], trgt=volatility, minRet=row.minRet, t1=t1)
+            bins = get_bins(events, self._close)
+            self.assertEqual(row.events, events.shape[0])
+            self.assertEqual(row.labeled, bins.shape[0])
+            self.assertEqual([row.bin_neg, row.bin_zero, row.bin_pos],
+                             [(bins.bin < 0).sum(), (bins.bin == 0).sum(), (bins.bin > 0).sum()])
+            self.assertAlmostEqual(row.ret_mean, bins.ret.mean())
+            self.assertAlmostEqual(row.ret_std, bins.ret.std())
+
+    def test_get_events_parallel(self):
+        volatility = get_daily_vol(self._close, span=30)
+        tEvents = cusum_filter_close(self._close, volatility)
+        t1 = get_t1(self._close, tEvents, numDays=1)
+        events = get_events(self._close, tEvents, [2, 2], trgt=volatility, t1=t1)
+        for backend in ['process', 'thread']:
+            events_ = get_events(self._close, tEvents, [2, 2], trgt=volatility, t1=t1,
+                                 numThreads=4, backend=backend)
+            self.assertTrue(events.equals(events_))
+        side = macd_side(self._close)
+        events = get_events_w_metalabel(self._close, tEvents, [1, 1], trgt=volatility, t1=t1, side=side)
+        events_ = get_events_w_metalabel(self._close, tEvents, [1, 1], trgt=volatility, t1=t1, side=side,
+                                         numThreads=4)
+        self.assertTrue(events.equals(events_))
+
     def test_get_events_w_metalabel(self):
         volatility = get_daily_vol(self._close, span=30)
         tEvents = cusum_filter_close(self._close, volatility)